@@ -5,22 +5,55 @@ Module for Inverted Index library
 from __future__ import annotations
 import sys
 import os
-from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter, FileType, ArgumentTypeError
+import time
 from io import TextIOWrapper
-import struct
-
-import json
-import re
-from typing import Dict, List
-from collections import defaultdict
+from collections.abc import Iterator
+from contextlib import contextmanager
 
 DEFAULT_DUMP_STRATEGY = 'struct'
+DEFAULT_TOP_TERMS = 10
+UNCOMPRESSED_POSTING_SIZE = 4
+QUERY_LATENCY_PERCENTILES = (50, 90, 99)
+QUIET = False
+QUERY_FILE_CHUNK_SIZE = 1 << 20
+QUERY_FILE_ENCODINGS = ('utf-8', 'cp1251')
+OUTPUT_FORMATS = ('csv', 'jsonl', 'binary')
+DEFAULT_OUTPUT_FORMAT = 'csv'
+OUTPUT_BUFFER_SIZE = 1 << 20
+
+
+def print_progress(message: str) -> None:
+    """Print progress message to stderr unless CLI runs in quiet mode
+
+    :param message: str - message to print
+    :return: nothing
+    """
+    if not QUIET:
+        print(message, file=sys.stderr)
+
+
+class EncodedFileType:
+    """
+    Class to fix encoding error with reading from buffer
+    Mirrors argparse.FileType without importing argparse on module import
+    """
+    def __init__(self, mode='r', bufsize=-1, encoding=None, errors=None):
+        """Class constructor
 
+        :param mode: str - file mode
+        :param bufsize: int - buffer size
+        :param encoding: str - file encoding
+        :param errors: str - encoding errors handling
+        """
+        self._mode = mode
+        self._bufsize = bufsize
+        self._encoding = encoding
+        self._errors = errors
 
-class EncodedFileType(FileType):
-    """Class to fix encoding error with reading from buffer"""
     def __call__(self, string):
         if string == '-':
+            if 'r' in self._mode and 'b' in self._mode:
+                return sys.stdin.buffer
             if 'r' in self._mode:
                 stdin = TextIOWrapper(sys.stdin.buffer, encoding=self._encoding)
                 return stdin
@@ -33,23 +66,137 @@ class EncodedFileType(FileType):
         try:
             return open(string, self._mode, self._bufsize, self._encoding, self._errors)
         except OSError as e:
+            from argparse import ArgumentTypeError
             message = "can't open '%s': %s"
             raise ArgumentTypeError(message % (string, e))
 
 
+class StageProfiler:
+    """
+    Class for collecting wall-clock timings of CLI stages
+    Stores total time per stage and latency of every single query
+    """
+    def __init__(self) -> None:
+        """Class constructor"""
+        self.timings = {}
+        self.query_latencies = []
+
+    @contextmanager
+    def stage(self, name: str):
+        """Measure time spent inside with-block and add it to stage timing
+
+        :param name: str - stage name
+        :return: nothing
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = self.timings.get(name, 0.0) + time.perf_counter() - start
+
+    def add_query_latency(self, latency: float) -> None:
+        """Store latency of one query
+
+        :param latency: float - query latency in seconds
+        :return: nothing
+        """
+        self.query_latencies.append(latency)
+
+    def report(self, file=None) -> None:
+        """Print collected timings
+
+        :param file: stream to print report, stderr by default
+        :return: nothing
+        """
+        file = file or sys.stderr
+        for name, seconds in self.timings.items():
+            print(f'{name}: {seconds * 1000:.3f} ms', file=file)
+        if self.query_latencies:
+            latencies = sorted(self.query_latencies)
+            print(f'queries: {len(latencies)}', file=file)
+            for percentile in QUERY_LATENCY_PERCENTILES:
+                rank = max(0, -(-len(latencies) * percentile // 100) - 1)
+                print(f'query latency p{percentile}: {latencies[rank] * 1000:.3f} ms', file=file)
+            print(f'query latency max: {latencies[-1] * 1000:.3f} ms', file=file)
+
+
+class QueryResultWriter:
+    """
+    Class for buffered writing of query results
+    Writes csv lines, JSON lines or compact binary records:
+    little-endian uint32 count followed by uint32 docs ids
+    """
+    def __init__(self, stream=None, output_format=DEFAULT_OUTPUT_FORMAT,
+                 buffer_size=OUTPUT_BUFFER_SIZE) -> None:
+        """Class constructor
+
+        :param stream: stream to write results, stdout by default
+        :param output_format: str - output format: csv, jsonl or binary
+        :param buffer_size: int - size of buffered output to flush
+        """
+        self.stream = stream or sys.stdout
+        self.output_format = output_format
+        self.buffer_size = buffer_size
+        self._parts = []
+        self._size = 0
+        if output_format == 'binary':
+            import struct
+            self._pack = struct.pack
+
+    def write(self, result: list[int]) -> None:
+        """Add query result to buffer and flush buffer if it is full
+
+        :param result: List[int] - docs ids
+        :return: nothing
+        """
+        if self.output_format == 'binary':
+            part = self._pack(f'<{len(result) + 1}I', len(result), *result)
+        elif self.output_format == 'jsonl':
+            part = '[' + ','.join(map(str, result)) + ']\n'
+        else:
+            part = ','.join(map(str, result)) + '\n'
+        self._parts.append(part)
+        self._size += len(part)
+        if self._size >= self.buffer_size:
+            self.flush()
+
+    def flush(self) -> None:
+        """Write buffered results to stream
+
+        :return: nothing
+        """
+        if not self._parts:
+            return
+        if self.output_format == 'binary':
+            self.stream.flush()
+            binary_stream = getattr(self.stream, 'buffer', self.stream)
+            binary_stream.write(b''.join(self._parts))
+            binary_stream.flush()
+        else:
+            self.stream.write(''.join(self._parts))
+        self._parts = []
+        self._size = 0
+
+    def __enter__(self) -> QueryResultWriter:
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.flush()
+
+
 class InvertedIndex:
     """
     Class for Inverted Index
     Provides search words, load and dump docs
     """
-    def __init__(self, index_dict: Dict[str, List[int]]) -> None:
+    def __init__(self, index_dict: dict[str, list[int]]) -> None:
         """Class constructor
 
         :param index_dict: Dict[str, List[int]] - dict: keys:terms and values:lists of docs ids
         """
         self.index_dict = index_dict
 
-    def query(self, words: List[str]) -> List[int]:
+    def query(self, words: list[str]) -> list[int]:
         """Return the list of relevant documents for the given query
 
         :param words: List[str] - list of words
@@ -78,10 +225,12 @@ class InvertedIndex:
         """
         strategy = strategy or DEFAULT_DUMP_STRATEGY
         if strategy == 'json':
+            import json
             json_string = json.dumps(self.index_dict)
             with open(filepath, mode='w', encoding='utf8') as f_out:
                 f_out.write(json_string)
         else:
+            import struct
             with open(filepath, 'wb') as f_out:
                 for key, value in self.index_dict.items():
                     b_key = key.encode('utf8')
@@ -99,13 +248,15 @@ class InvertedIndex:
         :return: InvertedIndex - InvertedIndex object
         """
         strategy = strategy or DEFAULT_DUMP_STRATEGY
-        print(f'Loading inverted index from {filepath} with strategy {strategy}', file=sys.stderr)
+        print_progress(f'Loading inverted index from {filepath} with strategy {strategy}')
         loaded_string = {}
         if strategy == 'json':
+            import json
             with open(filepath, mode='r', encoding='utf8') as fin:
                 loaded_string = json.load(fin)
             inverted_index = InvertedIndex(loaded_string)
         else:
+            import struct
             with open(filepath, 'rb') as fin:
                 file_size = os.fstat(fin.fileno()).st_size
                 while file_size > 0:
@@ -128,13 +279,167 @@ class InvertedIndex:
         return outcome
 
 
-def load_documents(filepath: str) -> defaultdict:
+def iter_posting_lengths(filepath: str, strategy='') -> Iterator[tuple[str, int]]:
+    """Iterate over terms of dumped InvertedIndex without loading postings
+
+    :param filepath: str - filepath of dumped inverted index
+    :param strategy: str - strategy to store: json or struct
+    :return: Iterator[Tuple[str, int]] - pairs of term and its posting length
+    """
+    strategy = strategy or DEFAULT_DUMP_STRATEGY
+    if strategy == 'json':
+        import json
+        with open(filepath, mode='r', encoding='utf8') as fin:
+            index_dict = json.load(fin)
+        for key, value in index_dict.items():
+            yield key, len(value)
+    else:
+        import struct
+        with open(filepath, 'rb') as fin:
+            file_size = os.fstat(fin.fileno()).st_size
+            while fin.tell() < file_size:
+                b_len, = struct.unpack(">H", fin.read(2))
+                key = fin.read(b_len).decode("utf8")
+                values_len, = struct.unpack(">H", fin.read(2))
+                fin.seek(values_len * 2, os.SEEK_CUR)
+                yield key, values_len
+
+
+def collect_index_stats(filepath: str, strategy='', top=DEFAULT_TOP_TERMS) -> dict:
+    """Collect statistics of dumped InvertedIndex
+
+    Compression ratio is the size of terms plus 32-bit document ids
+    divided by the size of the dump.
+
+    :param filepath: str - filepath of dumped inverted index
+    :param strategy: str - strategy to store: json or struct
+    :param top: int - number of heaviest terms to report
+    :return: Dict[str, Any] - dictionary of statistics
+    """
+    import heapq
+    from collections import Counter
+    length_counter = Counter()
+    terms_size = 0
+    heavy_terms = []
+    for key, values_len in iter_posting_lengths(filepath, strategy):
+        length_counter[values_len] += 1
+        terms_size += len(key.encode('utf8'))
+        if len(heavy_terms) < top:
+            heapq.heappush(heavy_terms, (values_len, key))
+        elif top and values_len > heavy_terms[0][0]:
+            heapq.heapreplace(heavy_terms, (values_len, key))
+    vocabulary_size = sum(length_counter.values())
+    postings_count = sum(length * count for length, count in length_counter.items())
+    file_size = os.path.getsize(filepath)
+    distribution = Counter()
+    for length, count in length_counter.items():
+        low = 1 << length.bit_length() >> 1
+        high = max(2 * low - 1, low)
+        distribution[str(low) if low == high else f'{low}-{high}'] += count
+    median = 0
+    seen = 0
+    for length in sorted(length_counter):
+        seen += length_counter[length]
+        if 2 * seen >= vocabulary_size:
+            median = length
+            break
+    return {
+        'vocabulary_size': vocabulary_size,
+        'postings_count': postings_count,
+        'file_size': file_size,
+        'posting_length_min': min(length_counter, default=0),
+        'posting_length_max': max(length_counter, default=0),
+        'posting_length_mean': postings_count / vocabulary_size if vocabulary_size else 0.0,
+        'posting_length_median': median,
+        'posting_length_distribution': dict(
+            sorted(distribution.items(), key=lambda item: int(item[0].split('-')[0]))
+        ),
+        'bytes_per_posting': file_size / postings_count if postings_count else 0.0,
+        'compression_ratio': (
+            (terms_size + postings_count * UNCOMPRESSED_POSTING_SIZE) / file_size if file_size else 0.0
+        ),
+        'top_terms': [(key, length) for length, key in sorted(heavy_terms, reverse=True)],
+    }
+
+
+def detect_query_encoding(data: bytes) -> str:
+    """Detect encoding of query file content: utf-8 or cp1251
+
+    :param data: bytes - query file content
+    :return: str - encoding name
+    """
+    try:
+        data.decode(QUERY_FILE_ENCODINGS[0])
+    except UnicodeDecodeError:
+        return QUERY_FILE_ENCODINGS[1]
+    return QUERY_FILE_ENCODINGS[0]
+
+
+def decode_queries(data: bytes, encoding: str) -> list[list[str]]:
+    """Decode block of whole query lines at once and split it into queries
+
+    :param data: bytes - block of query lines
+    :param encoding: str - encoding of block
+    :return: List[List[str]] - list of queries
+    """
+    return [line.split() for line in data.decode(encoding).split('\n')]
+
+
+def read_query_batches(query_file, encoding=None,
+                       chunk_size=QUERY_FILE_CHUNK_SIZE) -> Iterator[list[list[str]]]:
+    """Read queries from binary file by large chunks
+
+    Every chunk is cut at the last newline and decoded once, encoding is
+    detected from the first chunk with non-ASCII bytes if it is not provided,
+    ASCII chunks before it are decoded by their own detected encoding.
+
+    :param query_file: binary file with queries
+    :param encoding: str - query file encoding, None to detect
+    :param chunk_size: int - size of chunk to read
+    :return: Iterator[List[List[str]]] - batches of queries
+    """
+    tail = b''
+    while True:
+        chunk = query_file.read(chunk_size)
+        if not chunk:
+            break
+        if tail:
+            chunk = tail + chunk
+        end = chunk.rfind(b'\n')
+        if end < 0:
+            tail = chunk
+            continue
+        tail = chunk[end + 1:]
+        block = chunk[:end]
+        block_encoding = encoding or detect_query_encoding(block)
+        if not block.isascii():
+            encoding = block_encoding
+        yield decode_queries(block, block_encoding)
+    if tail:
+        yield decode_queries(tail, encoding or detect_query_encoding(tail))
+
+
+def iter_query_batches(query_file) -> Iterator[list[list[str]]]:
+    """Iterate over batches of queries of text or binary query file
+
+    :param query_file: text or binary file with queries
+    :return: Iterator[List[List[str]]] - batches of queries
+    """
+    if not hasattr(query_file, 'encoding'):
+        return read_query_batches(query_file)
+    if hasattr(query_file, 'buffer'):
+        return read_query_batches(query_file.buffer, query_file.encoding)
+    return iter([[line.split() for line in query_file]])
+
+
+def load_documents(filepath: str) -> dict[int, str]:
     """Upload Documents from file by filepath
 
     :param filepath: str - filepath to upload docs
     :return: Dict[int, str] - dictionary of documents in format id: str
     """
-    print(f'Loading documents from {filepath} to build inverted index...', file=sys.stderr)
+    from collections import defaultdict
+    print_progress(f'Loading documents from {filepath} to build inverted index...')
     documents_dict = defaultdict(list)
     with open(filepath, mode='r', encoding='utf8') as fin:
         for line in fin:
@@ -144,19 +449,35 @@ def load_documents(filepath: str) -> defaultdict:
     return documents_dict
 
 
-def build_inverted_index(documents: Dict[int, str]) -> InvertedIndex:
+def tokenize_documents(documents: dict[int, str]) -> dict[int, list[str]]:
+    """Split documents into words
+
+    :param documents: Dict[int, str] - dictionary of documents in format id: str
+    :return: Dict[int, List[str]] - dictionary of documents in format id: list of words
+    """
+    import re
+    return {doc_id: re.split(r"\W+", content) for doc_id, content in documents.items()}
+
+
+def build_inverted_index(documents: dict[int, str], profiler: StageProfiler = None) -> InvertedIndex:
     """Build inverted index from documents_dict
 
     :param documents: Dict[int, str] - dictionary of documents in format id: str
+    :param profiler: StageProfiler - profiler to measure tokenize and build stages
     :return: InvertedIndex - InvertedIndex object
     """
-    print('Building inverted index for provided documents...', file=sys.stderr)
-    index_dict = defaultdict(list)
-    for doc_id, content in documents.items():
-        words = re.split(r"\W+", content)
-        for word in words:
-            if doc_id not in index_dict[word]:
-                index_dict[word].append(doc_id)
+    from collections import defaultdict
+    print_progress('Building inverted index for provided documents...')
+    profiler = profiler or StageProfiler()
+    with profiler.stage('tokenize'):
+        tokenized_documents = tokenize_documents(documents)
+    with profiler.stage('build'):
+        index_dict = defaultdict(list)
+        for doc_id, words in tokenized_documents.items():
+            for word in words:
+                postings = index_dict[word]
+                if not postings or postings[-1] != doc_id:
+                    postings.append(doc_id)
     return InvertedIndex(index_dict=index_dict)
 
 
@@ -166,20 +487,27 @@ def callback_build(arguments):
     :param arguments: cmd arguments
     :return: process_build
     """
-    return process_build(arguments.path_to_load, arguments.path_to_store, arguments.dump_strategy)
+    return process_build(arguments.path_to_load, arguments.path_to_store, arguments.dump_strategy,
+                         getattr(arguments, 'profile', False))
 
 
-def process_build(path_to_load, path_to_store, dump_strategy):
+def process_build(path_to_load, path_to_store, dump_strategy, profile=False):
     """Process function for build
 
     :param path_to_load: path to load documents
     :param path_to_store: path to store inverted index
     :param dump_strategy: dump strategy
+    :param profile: print per-stage timings to stderr
     :return: nothing
     """
-    documents = load_documents(path_to_load)
-    inverted_index = build_inverted_index(documents)
-    inverted_index.dump(path_to_store, dump_strategy)
+    profiler = StageProfiler()
+    with profiler.stage('load'):
+        documents = load_documents(path_to_load)
+    inverted_index = build_inverted_index(documents, profiler)
+    with profiler.stage('dump'):
+        inverted_index.dump(path_to_store, dump_strategy)
+    if profile:
+        profiler.report()
 
 
 def callback_query(arguments):
@@ -189,30 +517,76 @@ def callback_query(arguments):
     :return: nothing
     """
     return process_queries(arguments.path_to_load_index, arguments.query_file,
-                           arguments.query, arguments.load_strategy)
+                           arguments.query, arguments.load_strategy,
+                           getattr(arguments, 'profile', False),
+                           getattr(arguments, 'output_format', DEFAULT_OUTPUT_FORMAT),
+                           getattr(arguments, 'log_queries', True))
 
 
-def process_queries(path_to_load_index, query_file, query, strategy):
+def process_queries(path_to_load_index, query_file, query, strategy, profile=False,
+                    output_format=DEFAULT_OUTPUT_FORMAT, log_queries=True):
     """Process function for query
 
     :param path_to_load_index: path to load index
     :param query_file: file with queries
     :param query: query without file
     :param strategy: inverted index load strategy
+    :param profile: print load timing and query latency percentiles to stderr
+    :param output_format: output format: csv, jsonl or binary
+    :param log_queries: print every query to stderr
     :return: nothing
     """
-    inverted_index = InvertedIndex.load(path_to_load_index, strategy)
+    profiler = StageProfiler()
+    with profiler.stage('load'):
+        inverted_index = InvertedIndex.load(path_to_load_index, strategy)
     if query:
-        for current_query in query:
-            print(f'Get documents ids for query {current_query}...', file=sys.stderr)
-            print(",".join([str(var) for var in inverted_index.query(current_query)]),
-                  file=sys.stdout)
+        batches = [query]
     else:
-        for current_query in query_file:
-            current_query = current_query.strip()
-            print(f'Get documents ids for query {current_query}...', file=sys.stderr)
-            print(",".join([str(var) for var in inverted_index.query(current_query.split())]),
-                  file=sys.stdout)
+        batches = iter_query_batches(query_file)
+    with QueryResultWriter(sys.stdout, output_format) as writer:
+        for batch in batches:
+            for current_query in batch:
+                if log_queries:
+                    print_progress(f'Get documents ids for query {current_query}...')
+                start = time.perf_counter()
+                result = inverted_index.query(current_query)
+                profiler.add_query_latency(time.perf_counter() - start)
+                writer.write(result)
+    if profile:
+        profiler.report()
+
+
+def callback_stats(arguments):
+    """Callback function for stats
+
+    :param arguments: cmd arguments
+    :return: nothing
+    """
+    return process_stats(arguments.path_to_load_index, arguments.load_strategy, arguments.top)
+
+
+def process_stats(path_to_load_index, strategy, top=DEFAULT_TOP_TERMS):
+    """Process function for stats
+
+    :param path_to_load_index: path to load index
+    :param strategy: inverted index load strategy
+    :param top: number of heaviest terms to print
+    :return: nothing
+    """
+    stats = collect_index_stats(path_to_load_index, strategy, top)
+    for name, value in stats.items():
+        if name == 'posting_length_distribution':
+            print(f'{name}:', file=sys.stdout)
+            for bucket, count in value.items():
+                print(f'  {bucket}: {count}', file=sys.stdout)
+        elif name == 'top_terms':
+            print(f'{name}:', file=sys.stdout)
+            for key, values_len in value:
+                print(f'  {key}: {values_len}', file=sys.stdout)
+        elif isinstance(value, float):
+            print(f'{name}: {value:.3f}', file=sys.stdout)
+        else:
+            print(f'{name}: {value}', file=sys.stdout)
 
 
 def setup_parser(parser):
@@ -221,6 +595,7 @@ def setup_parser(parser):
     :param parser: parser for arguments
     :return: nothing
     """
+    from argparse import ArgumentDefaultsHelpFormatter
     subparsers = parser.add_subparsers(help="choose command")
 
     build_parser = subparsers.add_parser("build",
@@ -234,6 +609,8 @@ def setup_parser(parser):
                               required=True, help="path to dataset to load",)
     build_parser.add_argument("-o", "--output", dest="path_to_store", required=True,
                               help="path to store inverted index",)
+    build_parser.add_argument("--profile", action="store_true",
+                              help="print per-stage timings to stderr",)
     build_parser.set_defaults(callback=callback_build)
 
     query_parser = subparsers.add_parser("query", help="query inverted index",
@@ -247,26 +624,52 @@ def setup_parser(parser):
     query_file_group = query_parser.add_mutually_exclusive_group(required=True)
     query_file_group.add_argument("--query", nargs="+", action='append', metavar="word",
                                   dest="query", help="query to run against inverted index")
+    query_file_group.add_argument("--query-file", dest="query_file",
+                                  type=EncodedFileType('rb'),
+                                  help="query file in utf-8 or cp1251 encoding detected automatically",)
     query_file_group.add_argument("--query-file-utf8", dest="query_file",
                                   type=EncodedFileType('r', encoding="utf-8"),
-                                  default=TextIOWrapper(sys.stdin.buffer, encoding="utf-8"),
                                   help="query file to get queries for inverted index",)
     query_file_group.add_argument("--query-file-cp1251", dest="query_file",
                                   type=EncodedFileType('r', encoding="cp1251"),
-                                  default=TextIOWrapper(sys.stdin.buffer, encoding="cp1251"),
                                   help="query file to get queries for inverted index",)
+    query_parser.add_argument("-f", "--output-format", choices=OUTPUT_FORMATS,
+                              dest="output_format",
+                              default=DEFAULT_OUTPUT_FORMAT,
+                              help="format to write query results",)
+    query_parser.add_argument("--no-query-log", action="store_false", dest="log_queries",
+                              help="do not print every query to stderr",)
+    query_parser.add_argument("--profile", action="store_true",
+                              help="print load timing and query latency percentiles to stderr",)
     query_parser.set_defaults(callback=callback_query)
 
+    stats_parser = subparsers.add_parser("stats", help="print statistics of dumped inverted index",
+                                         formatter_class=ArgumentDefaultsHelpFormatter,)
+    stats_parser.add_argument("-i", "--index", dest="path_to_load_index",
+                              required=True, help="path to read inverted index",)
+    stats_parser.add_argument("-s", "--strategy", choices=['json', 'struct'],
+                              dest="load_strategy",
+                              default=DEFAULT_DUMP_STRATEGY,
+                              help="strategy to load inverted index", )
+    stats_parser.add_argument("--top", type=int, default=DEFAULT_TOP_TERMS,
+                              help="number of heaviest terms to print",)
+    stats_parser.set_defaults(callback=callback_stats)
+
 
 def main():
     """Main function"""
+    global QUIET
+    from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
     parser = ArgumentParser(
         prog='inverted-index',
         description="Inverted Index CLI",
         formatter_class=ArgumentDefaultsHelpFormatter,
     )
+    parser.add_argument("-q", "--quiet", action="store_true",
+                        help="do not print progress messages to stderr",)
     setup_parser(parser)
     arguments = parser.parse_args()
+    QUIET = arguments.quiet
     arguments.callback(arguments)
 
 
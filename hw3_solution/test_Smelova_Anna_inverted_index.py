@@ -1,16 +1,27 @@
 from textwrap import dedent
 
 import pytest
+import io
 import json
 import os
+import struct
+import subprocess
+import sys
+import time
 from argparse import Namespace
 
 
 from task_Smelova_Anna_inverted_index import (
     InvertedIndex, load_documents, callback_query,
-    build_inverted_index, process_queries, callback_build
+    build_inverted_index, process_queries, callback_build,
+    collect_index_stats, process_stats, process_build,
+    read_query_batches, detect_query_encoding, QueryResultWriter
 )
 
+STARTUP_BUDGET_SECONDS = 0.03
+STARTUP_RUNS = 5
+LAZY_MODULES = ['argparse', 'json', 'struct', 're', 'typing', 'heapq']
+
 DICT_FOR_TEST = {'a': [1, 2], 'b': [2], 'c': [1, 3], 'd': [2, 3]}
 
 DOCUMENTS_FOR_TEST = dedent("""\
@@ -400,6 +411,185 @@ def test_callback_query_cp1251(tmpdir, capsys, query, expected_answer):
     )
 
 
+@pytest.mark.parametrize("strategy", ['json', 'struct'])
+def test_collect_index_stats(tmpdir, strategy):
+    inverted_index = InvertedIndex(index_dict=EXPECTED_INDEX_DICT)
+    temp_file_path = str(tmpdir.join('inverted_index.dump'))
+    inverted_index.dump(filepath=temp_file_path, strategy=strategy)
+    stats = collect_index_stats(temp_file_path, strategy=strategy, top=1)
+    assert stats['vocabulary_size'] == 25
+    assert stats['postings_count'] == 34
+    assert stats['posting_length_min'] == 1
+    assert stats['posting_length_max'] == 4
+    assert stats['posting_length_median'] == 1
+    assert stats['posting_length_distribution'] == {'1': 18, '2-3': 6, '4-7': 1}
+    assert stats['bytes_per_posting'] == stats['file_size'] / 34
+    assert stats['top_terms'] == [('information', 4)]
+
+
+def test_process_stats(tmpdir, capsys):
+    inverted_index = InvertedIndex(index_dict=DICT_FOR_TEST)
+    temp_file_path = str(tmpdir.join('inverted_index.dump'))
+    inverted_index.dump(filepath=temp_file_path)
+    process_stats(temp_file_path, 'struct', top=1)
+    captured = capsys.readouterr()
+    assert "vocabulary_size: 4" in captured.out
+    assert "compression_ratio:" in captured.out
+    assert "top_terms:\n  a: 2" in captured.out
+
+
+def test_process_build_and_queries_profile(tmpdir, capsys):
+    datapath = tmpdir.join('docs_for_test.txt')
+    datapath.write(DOCUMENTS_FOR_TEST)
+    temp_file_path = str(tmpdir.join('inverted_index.dump'))
+    process_build(datapath, temp_file_path, 'struct', profile=True)
+    captured = capsys.readouterr()
+    for stage in ('load', 'tokenize', 'build', 'dump'):
+        assert f"{stage}: " in captured.err
+    process_queries(temp_file_path, '', [['information'], ['doc']], 'struct', profile=True)
+    captured = capsys.readouterr()
+    query_answers = [sorted(int(var) for var in line.split(",")) for line in captured.out.split()]
+    assert query_answers == [[2, 3, 5, 9], [2, 4]]
+    assert "queries: 2" in captured.err
+    assert "query latency p99: " in captured.err
+
+
 def test_entrypoint():
     exit_status = os.system('python3 task_Smelova_Anna_inverted_index.py -h')
     assert exit_status == 0
+
+
+QUERIES_FOR_TEST = "текстовый запрос\ninformation\n\nuser  docs\r\nзапрос"
+EXPECTED_QUERIES = [['текстовый', 'запрос'], ['information'], [], ['user', 'docs'], ['запрос']]
+
+
+@pytest.mark.parametrize("encoding", ['utf-8', 'cp1251'])
+def test_detect_query_encoding(encoding):
+    assert detect_query_encoding(QUERIES_FOR_TEST.encode(encoding)) == encoding
+
+
+@pytest.mark.parametrize("encoding", ['utf-8', 'cp1251'])
+@pytest.mark.parametrize("chunk_size", [1, 7, 1 << 20])
+def test_read_query_batches(tmpdir, encoding, chunk_size):
+    query_path = tmpdir.join('queries.bin')
+    query_path.write_binary(QUERIES_FOR_TEST.encode(encoding))
+    with open(query_path, 'rb') as query_file:
+        batches = list(read_query_batches(query_file, chunk_size=chunk_size))
+    queries = [current_query for batch in batches for current_query in batch]
+    assert queries == EXPECTED_QUERIES
+
+
+@pytest.mark.parametrize("encoding", ['utf-8', 'cp1251'])
+def test_read_query_batches_detects_encoding_after_ascii_chunks(tmpdir, encoding):
+    query_path = tmpdir.join('queries.bin')
+    query_path.write_binary(('ascii query\n' * 10 + 'запрос\n' + 'текстовый запрос').encode(encoding))
+    with open(query_path, 'rb') as query_file:
+        batches = list(read_query_batches(query_file, chunk_size=16))
+    queries = [current_query for batch in batches for current_query in batch]
+    expected_result = [['ascii', 'query']] * 10 + [['запрос'], ['текстовый', 'запрос']]
+    assert queries == expected_result
+
+
+@pytest.mark.parametrize("encoding", ['utf-8', 'cp1251'])
+def test_callback_query_binary_query_file(tmpdir, capsys, encoding):
+    inverted_index = build_inverted_index(EXPECTED_INDEX_STR_DICT)
+    temp_file_path = str(tmpdir.join('inverted_index.dump'))
+    inverted_index.dump(temp_file_path)
+    query_path = tmpdir.join('queries.bin')
+    query_path.write_binary(QUERIES_FOR_TEST.encode(encoding))
+    with open(query_path, 'rb') as query_file:
+        arguments = Namespace(
+            path_to_load_index=temp_file_path,
+            query_file=query_file,
+            query='',
+            load_strategy=''
+        )
+        callback_query(arguments)
+    captured = capsys.readouterr()
+    query_answers = [
+        sorted(int(var) for var in line.split(",")) if line else []
+        for line in captured.out.split("\n")[:-1]
+    ]
+    assert query_answers == [[11], [2, 3, 5, 9], [], [10], [11, 12]]
+
+
+RESULTS_FOR_TEST = [[1, 3], [], [70000]]
+
+
+@pytest.mark.parametrize(
+    "output_format, expected_output",
+    [
+        pytest.param('csv', "1,3\n\n70000\n", id='csv'),
+        pytest.param('jsonl', "[1,3]\n[]\n[70000]\n", id='json lines'),
+    ]
+)
+@pytest.mark.parametrize("buffer_size", [1, 1 << 20])
+def test_query_result_writer_text(output_format, expected_output, buffer_size):
+    stream = io.StringIO()
+    with QueryResultWriter(stream, output_format, buffer_size) as writer:
+        for result in RESULTS_FOR_TEST:
+            writer.write(result)
+    assert stream.getvalue() == expected_output
+
+
+def test_query_result_writer_binary():
+    stream = io.BytesIO()
+    with QueryResultWriter(stream, 'binary') as writer:
+        for result in RESULTS_FOR_TEST:
+            writer.write(result)
+    assert stream.getvalue() == struct.pack('<6I', 2, 1, 3, 0, 1, 70000)
+
+
+def test_process_queries_jsonl_without_query_log(tmpdir, capsys):
+    inverted_index = InvertedIndex(index_dict=DICT_FOR_TEST)
+    temp_file_path = str(tmpdir.join('inverted_index.dump'))
+    inverted_index.dump(temp_file_path)
+    process_queries(temp_file_path, '', [['a', 'c'], ['f']], 'struct',
+                    output_format='jsonl', log_queries=False)
+    captured = capsys.readouterr()
+    assert [json.loads(line) for line in captured.out.splitlines()] == [[1], []]
+    assert "Get documents ids for query" not in captured.err
+
+
+def test_module_import_is_lazy():
+    code = (
+        "import sys; before = set(sys.modules); "
+        "import task_Smelova_Anna_inverted_index; "
+        "print(' '.join(sorted(set(sys.modules) - before)))"
+    )
+    output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True)
+    imported_modules = output.stdout.split()
+    for module in LAZY_MODULES:
+        assert module not in imported_modules, f'{module} is imported on module import'
+
+
+def measure_startup(code):
+    timings = []
+    for _ in range(STARTUP_RUNS):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', code], check=True)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+@pytest.mark.slow
+def test_module_import_startup_budget():
+    interpreter_startup = measure_startup('pass')
+    module_startup = measure_startup('import task_Smelova_Anna_inverted_index')
+    assert module_startup - interpreter_startup < STARTUP_BUDGET_SECONDS, (
+        f'Module import takes {module_startup - interpreter_startup:.3f}s, '
+        f'budget is {STARTUP_BUDGET_SECONDS}s'
+    )
+
+
+def test_quiet_option(tmpdir):
+    inverted_index = InvertedIndex(index_dict=DICT_FOR_TEST)
+    temp_file_path = str(tmpdir.join('inverted_index.dump'))
+    inverted_index.dump(temp_file_path)
+    output = subprocess.run(
+        [sys.executable, 'task_Smelova_Anna_inverted_index.py', '--quiet',
+         'query', '-i', temp_file_path, '--query', 'a', 'c'],
+        capture_output=True, text=True, check=True,
+    )
+    assert output.stdout == "1\n"
+    assert output.stderr == ""
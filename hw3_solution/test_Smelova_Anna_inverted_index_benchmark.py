@@ -0,0 +1,129 @@
+import io
+import random
+from itertools import accumulate
+
+import pytest
+
+from task_Smelova_Anna_inverted_index import (
+    InvertedIndex, load_documents, build_inverted_index, read_query_batches,
+    QueryResultWriter, OUTPUT_FORMATS
+)
+
+pytest.importorskip('pytest_benchmark')
+pytestmark = pytest.mark.slow
+
+CORPUS_SEED = 42
+CORPUS_SIZES = [1_000, 10_000, 50_000]
+VOCABULARY_SIZE = 20_000
+WORDS_PER_DOCUMENT = 50
+ZIPF_EXPONENT = 1.1
+QUERIES_PER_MIX = 200
+DUMP_STRATEGIES = ['json', 'struct']
+QUERY_MIXES = ['frequent', 'rare', 'mixed']
+
+
+def generate_zipf_corpus(documents_count, vocabulary_size=VOCABULARY_SIZE,
+                         words_per_document=WORDS_PER_DOCUMENT,
+                         exponent=ZIPF_EXPONENT, seed=CORPUS_SEED):
+    rng = random.Random(seed)
+    vocabulary = [f'term{rank}' for rank in range(vocabulary_size)]
+    cum_weights = list(accumulate(1.0 / (rank + 1) ** exponent for rank in range(vocabulary_size)))
+    lines = []
+    for doc_id in range(1, documents_count + 1):
+        words = rng.choices(vocabulary, cum_weights=cum_weights, k=words_per_document)
+        lines.append(f'{doc_id}\t{" ".join(words)}\n')
+    return ''.join(lines)
+
+
+def generate_queries(mix, vocabulary_size=VOCABULARY_SIZE, seed=CORPUS_SEED):
+    rng = random.Random(seed)
+    frequent = [f'term{rank}' for rank in range(20)]
+    rare = [f'term{rank}' for rank in range(vocabulary_size // 2, vocabulary_size)]
+    queries = []
+    for _ in range(QUERIES_PER_MIX):
+        if mix == 'frequent':
+            queries.append(rng.sample(frequent, 2))
+        elif mix == 'rare':
+            queries.append(rng.sample(rare, 2))
+        else:
+            queries.append([rng.choice(frequent), rng.choice(rare)])
+    return queries
+
+
+@pytest.fixture(scope='module', params=CORPUS_SIZES, ids=lambda size: f'{size}_docs')
+def dataset_path(request, tmp_path_factory):
+    path = tmp_path_factory.mktemp('corpus') / f'zipf_{request.param}.txt'
+    path.write_text(generate_zipf_corpus(request.param), encoding='utf8')
+    return str(path)
+
+
+@pytest.fixture(scope='module')
+def inverted_index(dataset_path):
+    return build_inverted_index(load_documents(dataset_path))
+
+
+def test_generate_zipf_corpus_is_reproducible():
+    assert generate_zipf_corpus(10) == generate_zipf_corpus(10)
+
+
+def test_benchmark_load_documents(benchmark, dataset_path):
+    documents = benchmark(load_documents, dataset_path)
+    assert documents
+
+
+def test_benchmark_build_inverted_index(benchmark, dataset_path):
+    documents = load_documents(dataset_path)
+    inverted_index = benchmark(build_inverted_index, documents)
+    assert inverted_index.index_dict
+
+
+@pytest.mark.parametrize('strategy', DUMP_STRATEGIES)
+def test_benchmark_dump(benchmark, tmp_path, inverted_index, strategy):
+    filepath = str(tmp_path / f'index.{strategy}')
+    benchmark(inverted_index.dump, filepath, strategy)
+
+
+@pytest.mark.parametrize('strategy', DUMP_STRATEGIES)
+def test_benchmark_load(benchmark, tmp_path, inverted_index, strategy):
+    filepath = str(tmp_path / f'index.{strategy}')
+    inverted_index.dump(filepath, strategy)
+    loaded_inverted_index = benchmark(InvertedIndex.load, filepath, strategy)
+    assert loaded_inverted_index == inverted_index
+
+
+@pytest.mark.parametrize('mix', QUERY_MIXES)
+def test_benchmark_query(benchmark, inverted_index, mix):
+    queries = generate_queries(mix)
+
+    def run_queries():
+        return [inverted_index.query(words) for words in queries]
+
+    results = benchmark(run_queries)
+    assert len(results) == QUERIES_PER_MIX
+
+
+@pytest.mark.parametrize('encoding', ['utf-8', 'cp1251'])
+def test_benchmark_read_query_batches(benchmark, tmp_path, encoding):
+    queries = generate_queries('mixed') * 500
+    query_path = tmp_path / 'queries.txt'
+    query_path.write_bytes(''.join(f'{" ".join(words)}\n' for words in queries).encode(encoding))
+
+    def read_queries():
+        with open(query_path, 'rb') as query_file:
+            return sum(len(batch) for batch in read_query_batches(query_file))
+
+    assert benchmark(read_queries) == len(queries)
+
+
+@pytest.mark.parametrize('output_format', OUTPUT_FORMATS)
+def test_benchmark_query_result_writer(benchmark, output_format):
+    results = [list(range(doc_id, doc_id + 1000)) for doc_id in range(1000)]
+
+    def write_results():
+        stream = io.BytesIO() if output_format == 'binary' else io.StringIO()
+        with QueryResultWriter(stream, output_format) as writer:
+            for result in results:
+                writer.write(result)
+        return stream
+
+    benchmark(write_results)
@@ -6,9 +6,17 @@ import sys
 from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
 from lxml import html
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 
 URL_GITLAB_FEATURES = 'https://about.gitlab.com/features/'
+HTTP_TIMEOUT = 10.0
+HTTP_RETRY = Retry(total=3, backoff_factor=0.3, status_forcelist=(500, 502, 503, 504),
+                   allowed_methods=['GET'], raise_on_status=False)
+
+http_session = requests.Session()
+http_session.mount('https://', HTTPAdapter(max_retries=HTTP_RETRY))
 
 
 def get_products_info_by_url(url=URL_GITLAB_FEATURES):
@@ -17,7 +25,7 @@ def get_products_info_by_url(url=URL_GITLAB_FEATURES):
     :param url: target url
     :return: products cnt divides by cost
     """
-    response = requests.get(url)
+    response = http_session.get(url, timeout=HTTP_TIMEOUT)
     dom = html.fromstring(response.text)
 
     free_products_blocks = dom.xpath("//a[@title='Available in GitLab SaaS Free']")
@@ -37,7 +37,7 @@ def build_response_mock_from_content(content, encoding=DEFAULT_ENCODING, status_
     return response
 
 
-@patch('requests.get')
+@patch('requests.Session.get')
 @pytest.mark.slow
 def test_get_products_info_by_url(mock_requests_get):
     with open(HTML_GITLAB_FEATURES_PATH, 'r') as content_fin:
@@ -2,152 +2,1768 @@
 """
 Web service for Asset
 """
-import bisect
-from typing import Any, Dict, List, Union
+import codecs
+import csv
+import itertools
+import json
+import math
+import os
+import sqlite3
+import struct
+import sys
+import threading
+import time
+import zlib
+from array import array
+from bisect import bisect_right
+from collections import OrderedDict, namedtuple
+from operator import attrgetter, itemgetter
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from uuid import uuid4
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Tuple, Union
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from bs4 import BeautifulSoup
-from flask import Flask, Response, jsonify, make_response, request
+from flask import Flask, Response, g, jsonify, make_response, request
+from flask.json.provider import DefaultJSONProvider
+try:
+    from lxml import etree, html as lxml_html
+except ImportError:
+    etree = lxml_html = None
+try:
+    import numpy as np
+except ImportError:
+    np = None
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 
 DAILY_URL = 'https://www.cbr.ru/eng/currency_base/daily/'
 KEY_INDICATORS_URL = 'https://www.cbr.ru/eng/key-indicators/'
+RATES_TTL = 60 * 60
+RATES_STALE_TTL = 24 * 60 * 60
+RATES_REFRESH_INTERVAL = 30 * 60
+RATES_VERSION_HEADER = 'X-Rates-Version'
+ETAG_PREFIX = uuid4().hex[:8]
+UPSTREAM_TIMEOUT = 5.0
+UPSTREAM_WORKERS = 4
+HTTP_POOL_SIZE = 10
+HTTP_RETRIES = 3
+HTTP_BACKOFF_FACTOR = 0.3
+HTTP_RETRY_STATUSES = (500, 502, 503, 504)
+REVENUE_MEMO_SIZE = 1024
+STORAGE_VERSIONS = itertools.count(1)
+ASSET_FIELDS = ('char_code', 'name', 'capital', 'interest')
+ASSET_STORAGE_PATH = os.environ.get('ASSET_STORAGE_PATH')
+ASSET_STORAGE_DIR = os.environ.get('ASSET_STORAGE_DIR')
+ASSET_STORAGE_COLUMNAR = os.environ.get('ASSET_STORAGE_COLUMNAR', '') not in ('', '0')
+SNAPSHOT_FILE_NAME = 'assets.snapshot'
+SNAPSHOT_MAGIC = b'ASN1'
+SNAPSHOT_HEADER = struct.Struct('<4sI')
+SNAPSHOT_WAL_SIZE = 16 << 20
+WAL_FILE_NAME = 'assets.wal'
+WAL_RECORD_HEADER = struct.Struct('<BII')
+WAL_ADD = 1
+WAL_CLEAR = 2
+SQLITE_TIMEOUT = 30.0
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS assets (
+    name TEXT PRIMARY KEY,
+    char_code TEXT NOT NULL,
+    capital NOT NULL,
+    interest NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS assets_capital_groups ON assets (char_code, interest, capital);
+CREATE INDEX IF NOT EXISTS assets_listing ON assets (char_code, name);
+CREATE TABLE IF NOT EXISTS storage_version (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    generation TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    modified_at REAL NOT NULL
+);
+INSERT OR IGNORE INTO storage_version (id, generation, version, modified_at)
+VALUES (0, lower(hex(randomblob(8))), 0, strftime('%s', 'now'));
+"""
+ASSET_LIST_MAX_LIMIT = 1000
+ASSET_LIST_STREAM_BATCH = 1000
+ASSET_LIST_CURSOR_HEADER = 'X-Next-After'
+BULK_CHUNK_SIZE = 1 << 16
+BULK_FORMATS = {
+    'text/csv': 'csv',
+    'application/jsonl': 'jsonl',
+    'application/x-ndjson': 'jsonl',
+}
+CBR_PARSER = os.environ.get('CBR_PARSER', 'lxml' if lxml_html is not None else 'bs4')
+JSON_PROVIDER = os.environ.get('JSON_PROVIDER', 'orjson' if orjson is not None else 'stdlib')
+RATES_REFRESHER = os.environ.get('RATES_REFRESHER', '1') not in ('', '0')
+COMPRESS_RESPONSES = os.environ.get('COMPRESS_RESPONSES', '1') not in ('', '0')
+COMPRESS_MIN_SIZE = 1024
+COMPRESS_LEVEL = 6
+COMPRESS_WBITS = {
+    'gzip': 16 + zlib.MAX_WBITS,
+    'deflate': zlib.MAX_WBITS,
+}
+
+if etree is not None:
+    DAILY_ROWS_XPATH = etree.XPath("(//table[@class='data'])[1]/tbody[1]//tr[count(td) = 5]")
+    KEY_INDICATORS_TABLES_XPATH = etree.XPath(
+        "(//div[@class='table key-indicator_table'])[position() <= 2]"
+    )
+    KEY_INDICATORS_ROWS_XPATH = etree.XPath(".//tr[position() > 1]")
+    KEY_INDICATORS_CHAR_CODE_XPATH = etree.XPath(
+        "string((.//div[@class='col-md-3 offset-md-1 _subinfo'])[1])"
+    )
+    KEY_INDICATORS_VALUE_XPATH = etree.XPath("string((.//td)[last()])")
+
+
+def dump_json(obj: Any) -> str:
+    """
+    Serialize object to compact JSON with JSON_PROVIDER library
+    :param obj: object
+    :return: JSON string
+    """
+    if JSON_PROVIDER == 'orjson':
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode()
+    return json.dumps(obj, separators=(',', ':'))
+
+
+def load_json(data: Union[str, bytes]) -> Any:
+    """
+    Deserialize JSON with JSON_PROVIDER library
+    :param data: JSON string
+    :return: object
+    """
+    if JSON_PROVIDER == 'orjson':
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """
+    Flask JSON provider which serializes with orjson,
+    responses are built from bytes without decoding
+    """
+
+    def _get_option(self) -> int:
+        return orjson.OPT_NON_STR_KEYS | (orjson.OPT_SORT_KEYS if self.sort_keys else 0)
+
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        """
+        Serialize object to JSON
+        :param obj: object
+        :return: JSON string
+        """
+        return orjson.dumps(obj, option=self._get_option()).decode()
+
+    def loads(self, s: Union[str, bytes], **kwargs: Any) -> Any:
+        """
+        Deserialize JSON
+        :param s: JSON string
+        :return: object
+        """
+        return orjson.loads(s)
+
+    def response(self, *args: Any, **kwargs: Any) -> Response:
+        """
+        Serialize arguments to JSON response
+        :return: response
+        """
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson.dumps(obj, option=self._get_option()),
+                                        mimetype=self.mimetype)
+
+
+JSON_PROVIDERS = {'stdlib': DefaultJSONProvider}
+if orjson is not None:
+    JSON_PROVIDERS['orjson'] = OrjsonProvider
+
+
+class Asset:
+    """
+    Asset class
+    """
+    __slots__ = ('name', 'capital', 'interest', 'char_code')
+
+    def __init__(self, name: str, capital: float, interest: float, char_code: str):
+        """
+        Initialization
+        :param name: name
+        :param capital: capital
+        :param interest: interest
+        :param char_code: currency
+        """
+        self.name = name
+        self.capital = capital
+        self.interest = interest
+        self.char_code = char_code
+
+    def calculate_revenue(self, years: int) -> float:
+        """
+        Calculate revenue function
+        :param years: years
+        :return: revenue
+        """
+        revenue = self.capital * ((1.0 + self.interest) ** years - 1.0)
+        return revenue
+
+    def get_json(self):
+        """
+        Get JSON function
+        :return: json
+        """
+        return [
+            self.char_code,
+            self.name,
+            self.capital,
+            self.interest
+        ]
+
+    def __repr__(self):
+        repr_ = f'{self.__class__.__name__}({self.name}, {self.capital}, {self.interest}, {self.char_code})'
+        return repr_
+
+    def __lt__(self, other) -> bool:
+        """
+        less than operator
+        :param other: right value
+        :return: result of compare
+        """
+        if isinstance(other, Asset):
+            return self.name < other.name
+        raise ValueError(f'Can not compare Asset and {other.__class__.__name__}')
+
+
+def get_groups_total_revenues(groups: Dict[Tuple[str, float], float], periods: List[int],
+                              key_indicator: Dict[str, float],
+                              daily: Dict[str, float]) -> Dict[int, float]:
+    """
+    Calculate total revenue of capital groups for every period
+    :param groups: mapping of (char code, interest) to capital
+    :param periods: periods for revenue
+    :param key_indicator: mapping of char code to currency value
+    :param daily: mapping of char code to currency value
+    :return: mapping of period to total revenue
+    """
+    totals = {}
+    for period in periods:
+        result = 0
+        for (char_code, interest), capital in groups.items():
+            if char_code in key_indicator:
+                mapping = key_indicator[char_code]
+            else:
+                mapping = daily[char_code]
+            result += capital * ((1.0 + interest) ** period - 1.0) * mapping
+        totals[period] = result
+    return totals
+
+
+def get_group_columns(groups: Dict[Tuple[str, float], float]) -> Tuple[Any, Any, Any, List[str]]:
+    """
+    Build numpy columns of capital groups
+    :param groups: mapping of (char code, interest) to capital
+    :return: capitals, interests, char code ids and char codes
+    """
+    char_code_ids = {}
+    return (
+        np.fromiter(groups.values(), dtype=float, count=len(groups)),
+        np.array([interest for _, interest in groups], dtype=float),
+        np.array([char_code_ids.setdefault(char_code, len(char_code_ids))
+                  for char_code, _ in groups], dtype=np.intp),
+        list(char_code_ids),
+    )
+
+
+def get_columns_total_revenues(columns: Tuple[Any, Any, Any, List[str]], periods: List[int],
+                               key_indicator: Dict[str, float],
+                               daily: Dict[str, float]) -> Dict[int, float]:
+    """
+    Calculate total revenue of capital groups columns for every period
+    in one vectorized operation
+    :param columns: columns built by get_group_columns
+    :param periods: periods for revenue
+    :param key_indicator: mapping of char code to currency value
+    :param daily: mapping of char code to currency value
+    :return: mapping of period to total revenue
+    """
+    capitals, interests, char_code_ids, char_codes = columns
+    char_code_rates = np.array([
+        key_indicator[char_code] if char_code in key_indicator else daily[char_code]
+        for char_code in char_codes
+    ], dtype=float)
+    growth = (1.0 + interests) ** np.array(periods, dtype=float)[:, None] - 1.0
+    totals = (capitals * growth * char_code_rates[char_code_ids]).sum(axis=1)
+    return dict(zip(periods, totals.tolist()))
+
+
+def slice_json_page(rows: List[List[Any]], cursor: Union[Tuple[str, str], None],
+                    limit: Union[int, None]) -> List[List[Any]]:
+    """
+    Get page of json repr sorted by char code and name
+    :param rows: list of repr sorted by char code and name
+    :param cursor: char code and name of last asset of previous page
+    :param limit: max count of assets in page, all assets if None
+    :return: list of repr
+    """
+    start = bisect_right(rows, cursor, key=itemgetter(0, 1)) if cursor is not None else 0
+    return rows[start:] if limit is None else rows[start:start + limit]
+
+
+class Storage:
+    """
+    Class for storing assets
+    Assets are kept in dict by name, sorted by name list is built lazily.
+    Capital is summed up by (char code, interest) groups on every change,
+    so total revenue is calculated over groups instead of assets.
+    Version is changed on every change and is unique among all storages.
+    Changes and cache builds are done under lock, published lists and caches
+    are never changed in place, so readers can use them without lock.
+    New assets are appended in place to pending list, which is read
+    and merged into sorted list only under lock
+    """
+
+    def __init__(self, asset_list: Union[List[Asset], None] = None):
+        """
+        Storage init
+        :param asset_list: list of assets
+        """
+        self.lock = threading.RLock()
+        self.asset_dict = {}
+        self.capital_groups = {}
+        self._group_sizes = {}
+        self._sorted_assets = []
+        self._unsorted_assets = []
+        self._json_cache = None
+        self._json_dump_cache = None
+        self._columns_cache = None
+        self.version = next(STORAGE_VERSIONS)
+        self.modified_at = time.time()
+        if asset_list:
+            self.add_assets(asset_list)
+
+    @property
+    def asset_list(self) -> List[Asset]:
+        """
+        Assets sorted by name, new assets are merged in on access
+        :return: list of assets
+        """
+        if self._unsorted_assets:
+            with self.lock:
+                if self._unsorted_assets:
+                    sorted_assets = self._sorted_assets + self._unsorted_assets
+                    sorted_assets.sort(key=attrgetter('name'))
+                    self._sorted_assets = sorted_assets
+                    self._unsorted_assets = []
+        return self._sorted_assets
+
+    def add_asset(self, item: Asset, replace: bool = True) -> bool:
+        """
+        Add asset to storage, check and add are done atomically
+        :param item: asset
+        :param replace: replace asset with the same name
+        :return: False if asset with the same name exists and replace is False
+        """
+        return not self.add_assets([item], replace)
+
+    def add_assets(self, items: Iterable[Asset], replace: bool = True) -> List[Asset]:
+        """
+        Add batch of assets to storage, sorted view is rebuilt only once
+        :param items: assets
+        :param replace: replace assets with the same names
+        :return: assets which were not added because their names exist
+        """
+        items = list(items)
+        rejected = []
+        with self.lock:
+            replaced = set()
+            added = []
+            for item in items:
+                old_item = self.asset_dict.get(item.name)
+                if old_item is not None:
+                    if not replace:
+                        rejected.append(item)
+                        continue
+                    self._remove_from_groups(old_item)
+                    replaced.add(item.name)
+                self.asset_dict[item.name] = item
+                self._add_to_groups(item)
+                added.append(item)
+            if not added:
+                return rejected
+            if replaced:
+                self._sorted_assets = [
+                    asset for asset in self.asset_list if asset.name not in replaced
+                ]
+            self._unsorted_assets.extend(
+                item for item in added if self.asset_dict[item.name] is item
+            )
+            self._invalidate_caches()
+        return rejected
+
+    def _add_to_groups(self, item: Asset):
+        group = (item.char_code, item.interest)
+        self.capital_groups[group] = self.capital_groups.get(group, 0.0) + item.capital
+        self._group_sizes[group] = self._group_sizes.get(group, 0) + 1
+
+    def _remove_from_groups(self, item: Asset):
+        group = (item.char_code, item.interest)
+        self._group_sizes[group] -= 1
+        if self._group_sizes[group]:
+            self.capital_groups[group] -= item.capital
+        else:
+            del self._group_sizes[group]
+            del self.capital_groups[group]
+
+    def is_contains(self, item: Asset) -> bool:
+        """
+        Check do asset contains in list
+        :param item: asset
+        :return: True if contains else False
+        """
+        return item.name in self.asset_dict
+
+    def get_json(self) -> List[List[Any]]:
+        """
+        Get json repr
+        :return: list of repr
+        """
+        return list(self._get_json_rows())
+
+    def _get_json_rows(self) -> List[List[Any]]:
+        json_cache = self._json_cache
+        if json_cache is None:
+            with self.lock:
+                if self._json_cache is None:
+                    self._json_cache = sorted(
+                        (item.get_json() for item in self.asset_dict.values()),
+                        key=itemgetter(0, 1),
+                    )
+                json_cache = self._json_cache
+        return json_cache
+
+    def get_json_dump(self) -> str:
+        """
+        Get serialized json repr, cached until storage is changed
+        :return: JSON string
+        """
+        json_dump_cache = self._json_dump_cache
+        if json_dump_cache is None:
+            with self.lock:
+                if self._json_dump_cache is None:
+                    self._json_dump_cache = dump_json(self.get_json())
+                json_dump_cache = self._json_dump_cache
+        return json_dump_cache
+
+    def get_json_page(self, after: Union[str, None] = None,
+                      limit: Union[int, None] = None) -> List[List[Any]]:
+        """
+        Get page of json repr in order of get_json
+        :param after: name of last asset of previous page
+        :param limit: max count of assets in page, all assets by default
+        :return: list of repr
+        """
+        cursor = None
+        if after is not None:
+            item = self.asset_dict[after]
+            cursor = (item.char_code, item.name)
+        return slice_json_page(self._get_json_rows(), cursor, limit)
+
+    def clear_storage(self):
+        """
+        Clear storage
+        :return: Nothing
+        """
+        with self.lock:
+            self.asset_dict.clear()
+            self.capital_groups.clear()
+            self._group_sizes.clear()
+            self._sorted_assets = []
+            self._unsorted_assets = []
+            self._invalidate_caches()
+
+    def _invalidate_caches(self):
+        self.version = next(STORAGE_VERSIONS)
+        self.modified_at = time.time()
+        self._json_cache = None
+        self._json_dump_cache = None
+        self._columns_cache = None
+
+    def get_assets(self, name: str) -> List[Any]:
+        """
+        Method to get asset list repr by name
+        :param name: asset name
+        :return: list repr
+        """
+        item = self.asset_dict.get(name)
+        if item is not None:
+            return item.get_json()
+        return []
+
+    def get_many_assets(self, names: Iterable[str]) -> List[List[Any]]:
+        """
+        Get list repr of assets by names in one batch, unknown and repeated
+        names are skipped. Assets are looked up by name and only found ones
+        are sorted, so batch of k names costs O(k log k) after any change
+        :param names: asset names
+        :return: list of repr in order of get_json
+        """
+        items = [self.asset_dict.get(name) for name in set(names)]
+        return sorted(item.get_json() for item in items if item is not None)
+
+    def get_total_revenue(self, period: int,
+                          key_indicator: Dict[str, float],
+                          daily: Dict[str, float]) -> float:
+        """
+        Calculate total revenue by mapping of key_interest map and daily map
+        :param period: period for revenue
+        :param key_indicator: mapping of char code to currency value
+        :param daily: mapping of char code to currency value
+        :return: Total revenue of storage
+        """
+        return self.get_total_revenues([period], key_indicator, daily)[period]
+
+    def get_total_revenues(self, periods: List[int],
+                           key_indicator: Dict[str, float],
+                           daily: Dict[str, float]) -> Dict[int, float]:
+        """
+        Calculate total revenue for every period over capital groups,
+        with numpy all groups and all periods are calculated
+        in one vectorized operation
+        :param periods: periods for revenue
+        :param key_indicator: mapping of char code to currency value
+        :param daily: mapping of char code to currency value
+        :return: mapping of period to total revenue of storage
+        """
+        if np is None:
+            with self.lock:
+                groups = dict(self.capital_groups)
+            return get_groups_total_revenues(groups, periods, key_indicator, daily)
+        return get_columns_total_revenues(self._get_columns(), periods, key_indicator, daily)
+
+    def _get_columns(self):
+        columns = self._columns_cache
+        if columns is None:
+            with self.lock:
+                if self._columns_cache is None:
+                    self._columns_cache = get_group_columns(self.capital_groups)
+                columns = self._columns_cache
+        return columns
+
+
+class ColumnarStorage:
+    """
+    Class for storing assets in columns: list of names, arrays of capitals,
+    interests and char code ids in table of interned char codes.
+    Asset objects and json repr are not kept, only sorted by char code
+    and name array of row ids is cached, so only requested rows are built.
+    Capital groups, caches and version work like in Storage
+    """
+
+    def __init__(self, asset_list: Union[List[Asset], None] = None):
+        """
+        Storage init
+        :param asset_list: list of assets
+        """
+        self.lock = threading.RLock()
+        self.names = []
+        self.capitals = array('d')
+        self.interests = array('d')
+        self.char_code_ids = array('H')
+        self.char_codes = []
+        self.capital_groups = {}
+        self._group_sizes = {}
+        self._rows = {}
+        self._char_code_ids = {}
+        self._order_cache = None
+        self._json_dump_cache = None
+        self._columns_cache = None
+        self.version = next(STORAGE_VERSIONS)
+        self.modified_at = time.time()
+        if asset_list:
+            self.add_assets(asset_list)
+
+    def _get_row(self, row: int) -> List[Any]:
+        return [
+            self.char_codes[self.char_code_ids[row]],
+            self.names[row],
+            self.capitals[row],
+            self.interests[row],
+        ]
+
+    def _get_row_key(self, row: int) -> Tuple[str, str]:
+        return self.char_codes[self.char_code_ids[row]], self.names[row]
+
+    def _get_order(self) -> array:
+        if self._order_cache is None:
+            self._order_cache = array('I', sorted(range(len(self.names)), key=self._get_row_key))
+        return self._order_cache
+
+    @property
+    def asset_list(self) -> List[Asset]:
+        """
+        Assets sorted by name, built from columns on every access
+        :return: list of assets
+        """
+        with self.lock:
+            return [
+                Asset(self.names[row], self.capitals[row], self.interests[row],
+                      self.char_codes[self.char_code_ids[row]])
+                for row in sorted(range(len(self.names)), key=self.names.__getitem__)
+            ]
+
+    def add_asset(self, item: Asset, replace: bool = True) -> bool:
+        """
+        Add asset to storage, check and add are done atomically
+        :param item: asset
+        :param replace: replace asset with the same name
+        :return: False if asset with the same name exists and replace is False
+        """
+        return not self.add_assets([item], replace)
+
+    def add_assets(self, items: Iterable[Asset], replace: bool = True) -> List[Asset]:
+        """
+        Add batch of assets to storage
+        :param items: assets
+        :param replace: replace assets with the same names
+        :return: assets which were not added because their names exist
+        """
+        rejected = []
+        changed = False
+        with self.lock:
+            for item in items:
+                row = self._rows.get(item.name)
+                if row is None:
+                    row = self._rows[item.name] = len(self.names)
+                    self.names.append(item.name)
+                    self.capitals.append(item.capital)
+                    self.interests.append(item.interest)
+                    self.char_code_ids.append(self._get_char_code_id(item.char_code))
+                elif replace:
+                    self._update_groups(self.char_codes[self.char_code_ids[row]],
+                                        self.interests[row], self.capitals[row], -1)
+                    self.capitals[row] = item.capital
+                    self.interests[row] = item.interest
+                    self.char_code_ids[row] = self._get_char_code_id(item.char_code)
+                else:
+                    rejected.append(item)
+                    continue
+                self._update_groups(item.char_code, self.interests[row], self.capitals[row], 1)
+                changed = True
+            if changed:
+                self._invalidate_caches()
+        return rejected
+
+    def _get_char_code_id(self, char_code: str) -> int:
+        char_code_id = self._char_code_ids.get(char_code)
+        if char_code_id is None:
+            char_code_id = self._char_code_ids[char_code] = len(self.char_codes)
+            self.char_codes.append(sys.intern(char_code))
+        return char_code_id
+
+    def _update_groups(self, char_code: str, interest: float, capital: float, sign: int):
+        group = (char_code, interest)
+        size = self._group_sizes.get(group, 0) + sign
+        if size:
+            self._group_sizes[group] = size
+            self.capital_groups[group] = self.capital_groups.get(group, 0.0) + sign * capital
+        else:
+            del self._group_sizes[group]
+            del self.capital_groups[group]
+
+    def is_contains(self, item: Asset) -> bool:
+        """
+        Check do asset contains in storage
+        :param item: asset
+        :return: True if contains else False
+        """
+        return item.name in self._rows
+
+    def get_json(self) -> List[List[Any]]:
+        """
+        Get json repr, rows are built from columns on every call
+        :return: list of repr
+        """
+        with self.lock:
+            return [self._get_row(row) for row in self._get_order()]
+
+    def get_json_dump(self) -> str:
+        """
+        Get serialized json repr, cached until storage is changed
+        :return: JSON string
+        """
+        json_dump_cache = self._json_dump_cache
+        if json_dump_cache is None:
+            with self.lock:
+                if self._json_dump_cache is None:
+                    self._json_dump_cache = dump_json(self.get_json())
+                json_dump_cache = self._json_dump_cache
+        return json_dump_cache
+
+    def get_json_page(self, after: Union[str, None] = None,
+                      limit: Union[int, None] = None) -> List[List[Any]]:
+        """
+        Get page of json repr in order of get_json
+        :param after: name of last asset of previous page
+        :param limit: max count of assets in page, all assets by default
+        :return: list of repr
+        """
+        with self.lock:
+            order = self._get_order()
+            start = 0
+            if after is not None:
+                cursor = self._get_row_key(self._rows[after])
+                start = bisect_right(order, cursor, key=self._get_row_key)
+            rows = order[start:] if limit is None else order[start:start + limit]
+            return [self._get_row(row) for row in rows]
+
+    def clear_storage(self):
+        """
+        Clear storage
+        :return: Nothing
+        """
+        with self.lock:
+            self.names = []
+            self.capitals = array('d')
+            self.interests = array('d')
+            self.char_code_ids = array('H')
+            self.char_codes = []
+            self.capital_groups.clear()
+            self._group_sizes.clear()
+            self._rows.clear()
+            self._char_code_ids.clear()
+            self._invalidate_caches()
+
+    def _invalidate_caches(self):
+        self.version = next(STORAGE_VERSIONS)
+        self.modified_at = time.time()
+        self._order_cache = None
+        self._json_dump_cache = None
+        self._columns_cache = None
+
+    def get_assets(self, name: str) -> List[Any]:
+        """
+        Method to get asset list repr by name
+        :param name: asset name
+        :return: list repr
+        """
+        with self.lock:
+            row = self._rows.get(name)
+            if row is not None:
+                return self._get_row(row)
+        return []
+
+    def get_many_assets(self, names: Iterable[str]) -> List[List[Any]]:
+        """
+        Get list repr of assets by names in one batch, unknown and repeated
+        names are skipped. Rows are looked up by name and only found ones
+        are built and sorted, so batch of k names costs O(k log k) after any change
+        :param names: asset names
+        :return: list of repr in order of get_json
+        """
+        names = set(names)
+        with self.lock:
+            rows = [self._rows.get(name) for name in names]
+            return sorted(self._get_row(row) for row in rows if row is not None)
+
+    def get_total_revenue(self, period: int,
+                          key_indicator: Dict[str, float],
+                          daily: Dict[str, float]) -> float:
+        """
+        Calculate total revenue by mapping of key_interest map and daily map
+        :param period: period for revenue
+        :param key_indicator: mapping of char code to currency value
+        :param daily: mapping of char code to currency value
+        :return: Total revenue of storage
+        """
+        return self.get_total_revenues([period], key_indicator, daily)[period]
+
+    def get_total_revenues(self, periods: List[int],
+                           key_indicator: Dict[str, float],
+                           daily: Dict[str, float]) -> Dict[int, float]:
+        """
+        Calculate total revenue for every period over capital groups
+        :param periods: periods for revenue
+        :param key_indicator: mapping of char code to currency value
+        :param daily: mapping of char code to currency value
+        :return: mapping of period to total revenue of storage
+        """
+        if np is None:
+            with self.lock:
+                groups = dict(self.capital_groups)
+            return get_groups_total_revenues(groups, periods, key_indicator, daily)
+        columns = self._columns_cache
+        if columns is None:
+            with self.lock:
+                if self._columns_cache is None:
+                    self._columns_cache = get_group_columns(self.capital_groups)
+                columns = self._columns_cache
+        return get_columns_total_revenues(columns, periods, key_indicator, daily)
+
+
+class SQLiteStorage:
+    """
+    Class for storing assets in SQLite database in WAL mode,
+    one database file can be shared by threads and worker processes.
+    Assets are indexed by name, capital groups are read by covering index.
+    Version is kept in database and is changed by every write transaction,
+    so changes made by other processes are seen
+    """
+
+    def __init__(self, path: str, asset_list: Union[List[Asset], None] = None,
+                 timeout: float = SQLITE_TIMEOUT):
+        """
+        Storage init
+        :param path: path to database file
+        :param asset_list: list of assets
+        :param timeout: seconds to wait for lock of database
+        """
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        self._storage_id = next(STORAGE_VERSIONS)
+        self._json_dump_cache = (None, None)
+        self._connection().executescript(SQLITE_SCHEMA)
+        if asset_list:
+            self.add_assets(asset_list)
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    @contextmanager
+    def _transaction(self, write: bool = False):
+        connection = self._connection()
+        connection.execute('BEGIN IMMEDIATE' if write else 'BEGIN')
+        try:
+            yield connection
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+
+    @staticmethod
+    def _get_version(connection: sqlite3.Connection) -> Tuple[str, int]:
+        return connection.execute('SELECT generation, version FROM storage_version').fetchone()
+
+    @staticmethod
+    def _bump_version(connection: sqlite3.Connection):
+        connection.execute('UPDATE storage_version SET version = version + 1, modified_at = ?',
+                           (time.time(),))
+
+    @property
+    def modified_at(self) -> float:
+        """
+        Time of last change of database
+        :return: unix time
+        """
+        return self._connection().execute('SELECT modified_at FROM storage_version').fetchone()[0]
+
+    @property
+    def version(self) -> Tuple[int, str, int]:
+        """
+        Version of storage, unique among all storage objects
+        :return: storage id, generation and version of database
+        """
+        return (self._storage_id, *self._get_version(self._connection()))
+
+    @property
+    def shared_version(self) -> Tuple[str, int]:
+        """
+        Version of database, the same in all processes sharing it.
+        Generation is random id of database set on its creation,
+        so recreated database never repeats versions of replaced one
+        :return: generation and version of database
+        """
+        return self._get_version(self._connection())
+
+    @property
+    def asset_list(self) -> List[Asset]:
+        """
+        Assets sorted by name
+        :return: list of assets
+        """
+        rows = self._connection().execute(
+            'SELECT name, capital, interest, char_code FROM assets ORDER BY name'
+        )
+        return [Asset(*row) for row in rows]
+
+    @property
+    def capital_groups(self) -> Dict[Tuple[str, float], float]:
+        """
+        Capital summed up by (char code, interest)
+        :return: mapping of (char code, interest) to capital
+        """
+        rows = self._connection().execute(
+            'SELECT char_code, interest, SUM(capital) FROM assets GROUP BY char_code, interest'
+        )
+        return {(char_code, interest): capital for char_code, interest, capital in rows}
+
+    def add_asset(self, item: Asset, replace: bool = True) -> bool:
+        """
+        Add asset to storage, check and add are done atomically
+        :param item: asset
+        :param replace: replace asset with the same name
+        :return: False if asset with the same name exists and replace is False
+        """
+        return not self.add_assets([item], replace)
+
+    def add_assets(self, items: Iterable[Asset], replace: bool = True) -> List[Asset]:
+        """
+        Add batch of assets to storage in one transaction
+        :param items: assets
+        :param replace: replace assets with the same names
+        :return: assets which were not added because their names exist
+        """
+        query = (f'INSERT OR {"REPLACE" if replace else "IGNORE"} INTO assets '
+                 f'(char_code, name, capital, interest) VALUES (?, ?, ?, ?)')
+        rejected = []
+        with self._transaction(write=True) as connection:
+            for item in items:
+                cursor = connection.execute(query, item.get_json())
+                if not cursor.rowcount:
+                    rejected.append(item)
+            self._bump_version(connection)
+        return rejected
+
+    def is_contains(self, item: Asset) -> bool:
+        """
+        Check do asset contains in storage
+        :param item: asset
+        :return: True if contains else False
+        """
+        cursor = self._connection().execute('SELECT 1 FROM assets WHERE name = ?', (item.name,))
+        return cursor.fetchone() is not None
+
+    def get_json(self) -> List[List[Any]]:
+        """
+        Get json repr
+        :return: list of repr
+        """
+        rows = self._connection().execute(
+            'SELECT char_code, name, capital, interest FROM assets ORDER BY char_code, name'
+        )
+        return [list(row) for row in rows]
+
+    def get_json_dump(self) -> str:
+        """
+        Get serialized json repr, cached until database version is changed
+        :return: JSON string
+        """
+        with self._transaction() as connection:
+            version = self._get_version(connection)
+            cached_version, json_dump = self._json_dump_cache
+            if cached_version != version:
+                json_dump = dump_json(self.get_json())
+                self._json_dump_cache = (version, json_dump)
+        return json_dump
+
+    def get_json_page(self, after: Union[str, None] = None,
+                      limit: Union[int, None] = None) -> List[List[Any]]:
+        """
+        Get page of json repr in order of get_json
+        :param after: name of last asset of previous page
+        :param limit: max count of assets in page, all assets by default
+        :return: list of repr
+        """
+        query = 'SELECT char_code, name, capital, interest FROM assets'
+        params = []
+        with self._transaction() as connection:
+            if after is not None:
+                row = connection.execute(
+                    'SELECT char_code FROM assets WHERE name = ?', (after,)
+                ).fetchone()
+                if row is None:
+                    raise KeyError(after)
+                query += ' WHERE (char_code, name) > (?, ?)'
+                params.extend([row[0], after])
+            query += ' ORDER BY char_code, name'
+            if limit is not None:
+                query += ' LIMIT ?'
+                params.append(limit)
+            return [list(row) for row in connection.execute(query, params)]
+
+    def clear_storage(self):
+        """
+        Clear storage
+        :return: Nothing
+        """
+        with self._transaction(write=True) as connection:
+            connection.execute('DELETE FROM assets')
+            self._bump_version(connection)
+
+    def get_assets(self, name: str) -> List[Any]:
+        """
+        Method to get asset list repr by name
+        :param name: asset name
+        :return: list repr
+        """
+        row = self._connection().execute(
+            'SELECT char_code, name, capital, interest FROM assets WHERE name = ?', (name,)
+        ).fetchone()
+        return list(row) if row is not None else []
+
+    def get_many_assets(self, names: Iterable[str]) -> List[List[Any]]:
+        """
+        Get list repr of assets by names in one query,
+        unknown and repeated names are skipped
+        :param names: asset names
+        :return: list of repr in order of get_json
+        """
+        rows = self._connection().execute(
+            'SELECT char_code, name, capital, interest FROM assets '
+            'WHERE name IN (SELECT value FROM json_each(?)) ORDER BY char_code, name',
+            (dump_json(list(set(names))),)
+        )
+        return [list(row) for row in rows]
+
+    def get_total_revenue(self, period: int,
+                          key_indicator: Dict[str, float],
+                          daily: Dict[str, float]) -> float:
+        """
+        Calculate total revenue by mapping of key_interest map and daily map
+        :param period: period for revenue
+        :param key_indicator: mapping of char code to currency value
+        :param daily: mapping of char code to currency value
+        :return: Total revenue of storage
+        """
+        return self.get_total_revenues([period], key_indicator, daily)[period]
+
+    def get_total_revenues(self, periods: List[int],
+                           key_indicator: Dict[str, float],
+                           daily: Dict[str, float]) -> Dict[int, float]:
+        """
+        Calculate total revenue for every period over capital groups
+        :param periods: periods for revenue
+        :param key_indicator: mapping of char code to currency value
+        :param daily: mapping of char code to currency value
+        :return: mapping of period to total revenue of storage
+        """
+        groups = self.capital_groups
+        if np is None:
+            return get_groups_total_revenues(groups, periods, key_indicator, daily)
+        return get_columns_total_revenues(get_group_columns(groups), periods, key_indicator, daily)
+
+
+def encode_assets(assets: List[Asset]) -> bytes:
+    """
+    Encode assets in compact binary form: count, capitals, interests,
+    sizes of names and char codes, then utf-8 names and char codes
+    :param assets: assets
+    :return: bytes
+    """
+    count = len(assets)
+    names = [asset.name.encode() for asset in assets]
+    char_codes = [asset.char_code.encode() for asset in assets]
+    header = struct.pack(
+        f'<I{count}d{count}d{count}I{count}I', count,
+        *(asset.capital for asset in assets),
+        *(asset.interest for asset in assets),
+        *map(len, names),
+        *map(len, char_codes),
+    )
+    return b''.join([header, *names, *char_codes])
+
+
+def decode_assets(data: bytes) -> List[Asset]:
+    """
+    Decode assets encoded by encode_assets
+    :param data: bytes
+    :return: assets
+    """
+    count, = struct.unpack_from('<I', data)
+    values_format = f'<{count}d{count}d{count}I{count}I'
+    values = struct.unpack_from(values_format, data, 4)
+    capitals = values[:count]
+    interests = values[count:2 * count]
+    strings = []
+    offset = 4 + struct.calcsize(values_format)
+    for size in values[2 * count:]:
+        strings.append(data[offset:offset + size].decode())
+        offset += size
+    return [
+        Asset(name, capital, interest, char_code)
+        for name, capital, interest, char_code
+        in zip(strings[:count], capitals, interests, strings[count:])
+    ]
+
+
+class WriteAheadLog:
+    """
+    Append-only log of storage changes with group commit:
+    records appended by many threads are written and synced to disk
+    by one of the waiting threads in one write.
+    Failed write or sync marks log as failed, records of failed write
+    are cut off the file and never reported as committed,
+    every append and commit after it raises
+    """
+
+    def __init__(self, path: str, sync: bool = True):
+        """
+        Log init
+        :param path: path to log file
+        :param sync: fsync log file on commit
+        """
+        self.path = path
+        self.sync = sync
+        self._file = open(path, 'ab', buffering=0)
+        self._condition = threading.Condition()
+        self._pending = []
+        self._appended = 0
+        self._committed = 0
+        self._committing = False
+        self._error = None
+
+    @property
+    def size(self) -> int:
+        """
+        Size of log file with records which are not written yet
+        :return: size in bytes
+        """
+        with self._condition:
+            return self._file.tell() + sum(map(len, self._pending))
+
+    def append(self, op: int, payload: bytes = b'') -> int:
+        """
+        Append record to log, it is durable only after commit
+        :param op: operation code
+        :param payload: operation data
+        :return: sequence number of record
+        """
+        record = WAL_RECORD_HEADER.pack(op, len(payload), zlib.crc32(payload)) + payload
+        with self._condition:
+            if self._error is not None:
+                raise OSError(f'Write-ahead log failed: {self.path}') from self._error
+            self._pending.append(record)
+            self._appended += 1
+            return self._appended
+
+    def commit(self, sequence: Union[int, None] = None):
+        """
+        Wait until record with sequence number and all records before it are on disk
+        :param sequence: sequence number, all appended records by default
+        :return: Nothing
+        """
+        with self._condition:
+            if sequence is None:
+                sequence = self._appended
+            while self._committed < sequence:
+                if self._error is not None:
+                    raise OSError(f'Write-ahead log failed: {self.path}') from self._error
+                if self._committing:
+                    self._condition.wait()
+                    continue
+                self._committing = True
+                records, self._pending = self._pending, []
+                last = self._appended
+                offset = self._file.tell()
+                self._condition.release()
+                try:
+                    self._write(b''.join(records))
+                    if self.sync:
+                        os.fsync(self._file.fileno())
+                except BaseException as error:
+                    self._discard(offset)
+                    self._condition.acquire()
+                    self._error = error
+                    self._committing = False
+                    self._condition.notify_all()
+                    raise
+                self._condition.acquire()
+                self._committing = False
+                self._committed = last
+                self._condition.notify_all()
+
+    def _write(self, data: bytes):
+        view = memoryview(data)
+        while view:
+            view = view[self._file.write(view):]
+
+    def _discard(self, offset: int):
+        try:
+            os.ftruncate(self._file.fileno(), offset)
+            self._file.seek(offset)
+        except OSError:
+            pass
+
+    def truncate(self):
+        """
+        Commit pending records and truncate log
+        :return: Nothing
+        """
+        self.commit()
+        with self._condition:
+            self._file.truncate(0)
+            self._file.seek(0)
+            if self.sync:
+                os.fsync(self._file.fileno())
+
+    def close(self):
+        """
+        Commit pending records and close log
+        :return: Nothing
+        """
+        try:
+            self.commit()
+        finally:
+            self._file.close()
+
+    @staticmethod
+    def read(path: str) -> Tuple[List[Tuple[int, bytes]], int]:
+        """
+        Read records of log, reading stops on torn or corrupted record
+        :param path: path to log file
+        :return: list of operation code and payload, size of valid part of log
+        """
+        if not os.path.exists(path):
+            return [], 0
+        with open(path, 'rb') as log_file:
+            data = log_file.read()
+        records = []
+        offset = 0
+        while offset + WAL_RECORD_HEADER.size <= len(data):
+            op, size, crc = WAL_RECORD_HEADER.unpack_from(data, offset)
+            start = offset + WAL_RECORD_HEADER.size
+            payload = data[start:start + size]
+            if len(payload) != size or zlib.crc32(payload) != crc:
+                break
+            records.append((op, payload))
+            offset = start + size
+        return records, offset
+
+
+class PersistentStorage(Storage):
+    """
+    In memory storage which is kept on disk by write-ahead log of changes
+    and compact binary snapshot, log is replaced by snapshot when it grows.
+    Change is logged and committed first and applied to memory after commit
+    in order of log, so only durable changes are served.
+    Adds and clears are idempotent, so replay of log over snapshot
+    written just before crash gives the same storage
+    """
+
+    def __init__(self, directory: str, sync: bool = True,
+                 snapshot_wal_size: int = SNAPSHOT_WAL_SIZE):
+        """
+        Storage init, storage is recovered from snapshot and log of directory
+        :param directory: directory for snapshot and log files
+        :param sync: fsync files on commit
+        :param snapshot_wal_size: size of log in bytes to make snapshot
+        """
+        super().__init__()
+        os.makedirs(directory, exist_ok=True)
+        self.snapshot_path = os.path.join(directory, SNAPSHOT_FILE_NAME)
+        self.wal_path = os.path.join(directory, WAL_FILE_NAME)
+        self.sync = sync
+        self.snapshot_wal_size = snapshot_wal_size
+        self._applied = threading.Condition(self.lock)
+        self._applied_sequence = 0
+        self._logged_sequence = 0
+        self._logged_names = {}
+        self._logged_clear = 0
+        self._recover()
+        self.wal = WriteAheadLog(self.wal_path, sync)
+
+    def _recover(self):
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, 'rb') as snapshot_file:
+                data = snapshot_file.read()
+            magic, crc = SNAPSHOT_HEADER.unpack_from(data)
+            payload = data[SNAPSHOT_HEADER.size:]
+            if magic != SNAPSHOT_MAGIC or zlib.crc32(payload) != crc:
+                raise ValueError(f'Corrupted snapshot: {self.snapshot_path}')
+            super().add_assets(decode_assets(payload))
+        records, size = WriteAheadLog.read(self.wal_path)
+        for op, payload in records:
+            if op == WAL_ADD:
+                super().add_assets(decode_assets(payload))
+            elif op == WAL_CLEAR:
+                super().clear_storage()
+        if os.path.exists(self.wal_path) and os.path.getsize(self.wal_path) != size:
+            with open(self.wal_path, 'r+b') as wal_file:
+                wal_file.truncate(size)
+
+    def _is_logged(self, name: str) -> bool:
+        sequence = self._logged_names.get(name)
+        if sequence is not None and sequence > self._logged_clear:
+            return True
+        return not self._logged_clear and name in self.asset_dict
+
+    def add_assets(self, items: Iterable[Asset], replace: bool = True) -> List[Asset]:
+        """
+        Add batch of assets to log and to storage after commit,
+        added assets are chosen under lock over logged changes
+        :param items: assets
+        :param replace: replace assets with the same names
+        :return: assets which were not added because their names exist
+        """
+        rejected = []
+        added = []
+        names = set()
+        with self.lock:
+            for item in items:
+                if not replace and (item.name in names or self._is_logged(item.name)):
+                    rejected.append(item)
+                    continue
+                names.add(item.name)
+                added.append(item)
+            if not added:
+                return rejected
+            sequence = self._log(WAL_ADD, encode_assets(added))
+            for name in names:
+                self._logged_names[name] = sequence
+        self._commit_and_apply(sequence, WAL_ADD, added)
+        self._snapshot_if_needed()
+        return rejected
 
+    def clear_storage(self):
+        """
+        Log clear and clear storage after commit
+        :return: Nothing
+        """
+        with self.lock:
+            sequence = self._logged_clear = self._log(WAL_CLEAR)
+        self._commit_and_apply(sequence, WAL_CLEAR)
 
-class Asset:
+    def _log(self, op: int, payload: bytes = b'') -> int:
+        self._logged_sequence = self.wal.append(op, payload)
+        return self._logged_sequence
+
+    def _commit_and_apply(self, sequence: int, op: int, items: Union[List[Asset], None] = None):
+        try:
+            self.wal.commit(sequence)
+        except BaseException:
+            self._apply(sequence, None)
+            raise
+        self._apply(sequence, op, items)
+
+    def _apply(self, sequence: int, op: Union[int, None], items: Union[List[Asset], None] = None):
+        with self._applied:
+            self._applied.wait_for(lambda: self._applied_sequence == sequence - 1)
+            try:
+                if op == WAL_ADD:
+                    super().add_assets(items)
+                elif op == WAL_CLEAR:
+                    super().clear_storage()
+            finally:
+                self._applied_sequence = sequence
+                if self._logged_clear == sequence:
+                    self._logged_clear = 0
+                for name in [name for name, logged in self._logged_names.items() if logged <= sequence]:
+                    del self._logged_names[name]
+                self._applied.notify_all()
+
+    def snapshot(self):
+        """
+        Write snapshot of storage and truncate log
+        :return: Nothing
+        """
+        with self._applied:
+            self._applied.wait_for(lambda: self._applied_sequence == self._logged_sequence)
+            payload = encode_assets(list(self.asset_dict.values()))
+            temp_path = f'{self.snapshot_path}.tmp'
+            with open(temp_path, 'wb') as snapshot_file:
+                snapshot_file.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, zlib.crc32(payload)))
+                snapshot_file.write(payload)
+                snapshot_file.flush()
+                if self.sync:
+                    os.fsync(snapshot_file.fileno())
+            os.replace(temp_path, self.snapshot_path)
+            if self.sync and os.name == 'posix':
+                directory_fd = os.open(os.path.dirname(self.snapshot_path) or '.', os.O_RDONLY)
+                try:
+                    os.fsync(directory_fd)
+                finally:
+                    os.close(directory_fd)
+            self.wal.truncate()
+
+    def _snapshot_if_needed(self):
+        if self.wal.size >= self.snapshot_wal_size:
+            with self.lock:
+                if self.wal.size >= self.snapshot_wal_size:
+                    self.snapshot()
+
+    def close(self):
+        """
+        Commit log and close it
+        :return: Nothing
+        """
+        self.wal.close()
+
+
+def create_storage(path: Union[str, None] = ASSET_STORAGE_PATH,
+                   directory: Union[str, None] = ASSET_STORAGE_DIR,
+                   columnar: bool = ASSET_STORAGE_COLUMNAR
+                   ) -> Union[Storage, ColumnarStorage, SQLiteStorage]:
     """
-    Asset class
+    Create storage of assets
+    :param path: path to SQLite database shared by worker processes
+    :param directory: directory of snapshot and log of persistent storage,
+    in memory storage is used if path and directory are not set
+    :param columnar: use columnar in memory storage
+    :return: storage
     """
-    def __init__(self, name: str, capital: float, interest: float, char_code: str):
+    if path:
+        return SQLiteStorage(path)
+    if directory:
+        return PersistentStorage(directory)
+    if columnar:
+        return ColumnarStorage()
+    return Storage()
+
+
+class RevenueMemo:
+    """
+    Bounded LRU memo of total revenues
+    keyed on storage version, rates version and period
+    """
+
+    def __init__(self, maxsize: int = REVENUE_MEMO_SIZE):
         """
-        Initialization
-        :param name: name
-        :param capital: capital
-        :param interest: interest
-        :param char_code: currency
+        Memo init
+        :param maxsize: max count of memorized totals
         """
-        self.name = name
-        self.capital = capital
-        self.interest = interest
-        self.char_code = char_code
+        self.maxsize = maxsize
+        self._totals = OrderedDict()
+        self._lock = threading.Lock()
 
-    def calculate_revenue(self, years: int) -> float:
+    def get_total_revenues(self, storage: Storage, rates_version: int, periods: List[int],
+                           key_indicator: Dict[str, float],
+                           daily: Dict[str, float]) -> Dict[int, float]:
         """
-        Calculate revenue function
-        :param years: years
-        :return: revenue
+        Get memorized totals, missing totals are calculated by storage
+        :param storage: storage of assets
+        :param rates_version: version of key_indicator and daily mappings
+        :param periods: periods for revenue
+        :param key_indicator: mapping of char code to currency value
+        :param daily: mapping of char code to currency value
+        :return: mapping of period to total revenue of storage
         """
-        revenue = self.capital * ((1.0 + self.interest) ** years - 1.0)
-        return revenue
+        storage_version = storage.version
+        result = {}
+        missing = []
+        with self._lock:
+            for period in periods:
+                key = (storage_version, rates_version, period)
+                if key in self._totals:
+                    self._totals.move_to_end(key)
+                    result[period] = self._totals[key]
+                else:
+                    missing.append(period)
+        if missing:
+            totals = storage.get_total_revenues(missing, key_indicator, daily)
+            result.update(totals)
+            with self._lock:
+                for period, total in totals.items():
+                    self._totals[(storage_version, rates_version, period)] = total
+                while len(self._totals) > self.maxsize:
+                    self._totals.popitem(last=False)
+        return {period: result[period] for period in periods}
 
-    def get_json(self):
+    def clear(self):
         """
-        Get JSON function
-        :return: json
+        Clear memo
+        :return: Nothing
         """
-        return [
-            self.char_code,
-            self.name,
-            self.capital,
-            self.interest
-        ]
+        with self._lock:
+            self._totals.clear()
 
-    def __repr__(self):
-        repr_ = f'{self.__class__.__name__}({self.name}, {self.capital}, {self.interest}, {self.char_code})'
-        return repr_
 
-    def __lt__(self, other) -> bool:
+RatesSnapshot = namedtuple('RatesSnapshot', ['version', 'values', 'loaded_at', 'versions', 'updated_at'])
+
+
+class RatesCache:
+    """
+    Cache for parsed CBR pages
+    Serves fresh values for ttl seconds, then serves stale values for
+    stale_ttl seconds while refreshing them in background thread.
+    Missing and expired value is loaded once, concurrent callers wait for the same load.
+    Values are published as immutable versioned RatesSnapshot,
+    so readers never take a lock
+    """
+
+    def __init__(self, ttl: float = RATES_TTL, stale_ttl: float = RATES_STALE_TTL):
         """
-        less than operator
-        :param other: right value
-        :return: result of compare
+        Cache init
+        :param ttl: seconds while value is fresh
+        :param stale_ttl: seconds after ttl while stale value is served
         """
-        if isinstance(other, Asset):
-            return self.name < other.name
-        raise ValueError(f'Can not compare Asset and {other.__class__.__name__}')
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.snapshot = RatesSnapshot(0, {}, {}, {}, {})
+        self._refreshing = set()
+        self._loading = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=UPSTREAM_WORKERS)
 
+    def get(self, key: str, loader: Callable[[], Any]) -> Any:
+        """
+        Get cached value or load it
+        :param key: cache key
+        :param loader: function to load value
+        :return: value
+        """
+        values, _ = self.get_many({key: loader})
+        return values[key]
 
-class Storage:
-    """Class for storing assets"""
+    def get_many(self, loaders: Dict[str, Callable[[], Any]]) -> Tuple[Dict[str, Any], int]:
+        """
+        Get cached values from one snapshot
+        :param loaders: mapping of cache key to function to load value
+        :return: mapping of cache key to value and version of snapshot with these values
+        """
+        snapshot = self.get_snapshot(loaders)
+        return {key: snapshot.values[key] for key in loaders}, snapshot.version
 
-    def __init__(self, asset_list: Union[List[Asset], None] = None):
+    def get_snapshot(self, loaders: Dict[str, Callable[[], Any]]) -> RatesSnapshot:
         """
-        Storage init
-        :param asset_list: list of assets
+        Get snapshot with all values, missing and expired values are loaded concurrently,
+        value which is already loading is waited for instead of loading it again.
+        Returned snapshot has all values even if other values were published
+        or cache was cleared while loading
+        :param loaders: mapping of cache key to function to load value
+        :return: snapshot
         """
-        self.asset_list = []
-        if asset_list:
-            for item in asset_list:
-                bisect.insort_left(self.asset_list, item)
+        snapshot = self.snapshot
+        expired_keys, stale_keys = self.get_expired(loaders, snapshot)
+        for key in stale_keys:
+            self._refresh_in_background(key, loaders[key])
+        if expired_keys:
+            futures = []
+            started = []
+            with self._lock:
+                for key in expired_keys:
+                    future = self._loading.get(key)
+                    if future is None:
+                        future = self._loading[key] = Future()
+                        started.append((key, future))
+                    futures.append(future)
+            for key, future in started[1:]:
+                self._executor.submit(self._load_shared, key, loaders[key], future)
+            if started:
+                key, future = started[0]
+                self._load_shared(key, loaders[key], future)
+            for future in futures:
+                future.result()
+            snapshot = self.snapshot
+            if any(key not in snapshot.values for key in loaders):
+                return self.get_snapshot(loaders)
+        return snapshot
 
-    def add_asset(self, item: Asset):
+    def get_expired(self, keys: Iterable[str], snapshot: Union[RatesSnapshot, None] = None
+                    ) -> Tuple[List[str], List[str]]:
         """
-        Add asset to storage
-        :return: Nothing
+        Check age of cached values
+        :param keys: cache keys
+        :param snapshot: snapshot to check, current snapshot if None
+        :return: missing or expired keys which should be loaded
+        and stale keys which should be refreshed in background
         """
-        bisect.insort_left(self.asset_list, item)
+        snapshot = snapshot or self.snapshot
+        now = time.monotonic()
+        expired = []
+        stale = []
+        for key in keys:
+            age = now - snapshot.loaded_at[key] if key in snapshot.values else None
+            if age is None or age >= self.ttl + self.stale_ttl:
+                expired.append(key)
+            elif age >= self.ttl:
+                stale.append(key)
+        return expired, stale
 
-    def is_contains(self, item: Asset) -> bool:
+    def claim_refresh(self, key: str) -> bool:
         """
-        Check do asset contains in list
-        :param item: asset
-        :return: True if contains else False
+        Mark value as refreshing in background, so it is refreshed only once
+        :param key: cache key
+        :return: True if value was not refreshing yet
         """
-        i = bisect.bisect_left(self.asset_list, item)
-        if len(self.asset_list) != i and item.name == self.asset_list[i].name:
+        with self._lock:
+            if key in self._refreshing:
+                return False
+            self._refreshing.add(key)
             return True
-        return False
 
-    def get_json(self) -> List[List[Any]]:
+    def release_refresh(self, key: str):
         """
-        Get json repr
-        :return: list of repr
+        Mark value as not refreshing
+        :param key: cache key
+        :return: Nothing
         """
-        result = []
-        for item in self.asset_list:
-            bisect.insort_left(result, item.get_json())
-        return result
+        with self._lock:
+            self._refreshing.discard(key)
 
-    def clear_storage(self):
+    def publish(self, values: Dict[str, Any]) -> RatesSnapshot:
         """
-        Clear storage
+        Publish new snapshot with updated values
+        :param values: mapping of cache key to value
+        :return: published snapshot
+        """
+        loaded_at = time.monotonic()
+        updated_at = time.time()
+        with self._lock:
+            snapshot = self.snapshot
+            version = snapshot.version + 1
+            self.snapshot = RatesSnapshot(
+                version,
+                {**snapshot.values, **values},
+                {**snapshot.loaded_at, **dict.fromkeys(values, loaded_at)},
+                {**snapshot.versions, **dict.fromkeys(values, version)},
+                {**snapshot.updated_at, **dict.fromkeys(values, updated_at)},
+            )
+            return self.snapshot
+
+    def clear(self):
+        """
+        Clear cache
         :return: Nothing
         """
-        self.asset_list.clear()
+        with self._lock:
+            self.snapshot = RatesSnapshot(self.snapshot.version + 1, {}, {}, {}, {})
 
-    def get_assets(self, name: str) -> List[Any]:
+    def _load(self, key: str, loader: Callable[[], Any]) -> Any:
+        value = loader()
+        self.publish({key: value})
+        return value
+
+    def _load_shared(self, key: str, loader: Callable[[], Any], future: Future):
+        try:
+            self.publish({key: loader()})
+        except BaseException as error:
+            future.set_exception(error)
+            raise
+        else:
+            future.set_result(None)
+        finally:
+            with self._lock:
+                del self._loading[key]
+
+    def _refresh_in_background(self, key: str, loader: Callable[[], Any]):
+        if self.claim_refresh(key):
+            threading.Thread(target=self._refresh, args=(key, loader), daemon=True).start()
+
+    def _refresh(self, key: str, loader: Callable[[], Any]):
+        try:
+            self._load(key, loader)
+        except Exception:  # pylint: disable=broad-except
+            pass
+        finally:
+            self.release_refresh(key)
+
+
+class RatesRefresher:
+    """
+    Background thread which periodically loads CBR pages
+    and publishes them to RatesCache as one snapshot
+    """
+
+    def __init__(self, cache: RatesCache, loaders: Dict[str, Callable[[], Any]],
+                 interval: float = RATES_REFRESH_INTERVAL):
         """
-        Method to get asset list repr by name
-        :param name: asset name
-        :return: list repr
+        Refresher init
+        :param cache: cache to publish snapshots
+        :param loaders: mapping of cache key to function to load value
+        :param interval: seconds between refreshes
         """
-        i = bisect.bisect_left(self.asset_list, Asset(name, 0, 0, 'US'))
-        if i != len(self.asset_list) and self.asset_list[i].name == name:
-            return self.asset_list[i].get_json()
-        return []
+        self.cache = cache
+        self.loaders = loaders
+        self.interval = interval
+        self._stopped = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
 
-    def get_total_revenue(self, period: int,
-                          key_indicator: Dict[str, float],
-                          daily: Dict[str, float]) -> float:
+    def refresh(self) -> RatesSnapshot:
         """
-        Calculate total revenue by mapping of key_interest map and daily map
-        :param period: period for revenue
-        :param key_indicator: mapping of char code to currency value
-        :param daily: mapping of char code to currency value
-        :return: Total revenue of storage
+        Load all pages and publish them
+        :return: published snapshot
         """
-        result = 0
-        for item in self.asset_list:
-            if item.char_code in key_indicator:
-                mapping = key_indicator[item.char_code]
-            else:
-                mapping = daily[item.char_code]
-            result += item.calculate_revenue(period) * mapping
-        return result
+        values = {key: loader() for key, loader in self.loaders.items()}
+        return self.cache.publish(values)
+
+    def start(self):
+        """
+        Start background thread once per process,
+        so forked worker process starts its own thread
+        :return: Nothing
+        """
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+            self._pid = os.getpid()
+
+    def stop(self):
+        """
+        Stop background thread
+        :return: Nothing
+        """
+        with self._lock:
+            self._stopped.set()
+            if self._thread is not None and self._pid == os.getpid():
+                self._thread.join()
+            self._thread = None
+            self._pid = None
+
+    def _run(self):
+        while True:
+            try:
+                self.refresh()
+            except Exception:  # pylint: disable=broad-except
+                pass
+            if self._stopped.wait(self.interval):
+                return
+
+
+def create_http_session(pool_size: int = HTTP_POOL_SIZE,
+                        retries: int = HTTP_RETRIES,
+                        backoff_factor: float = HTTP_BACKOFF_FACTOR) -> requests.Session:
+    """
+    Create HTTP session with connection pool and retries with backoff
+    :param pool_size: connections kept alive per host
+    :param retries: retries of failed GET requests
+    :param backoff_factor: backoff factor between retries
+    :return: session
+    """
+    retry = Retry(total=retries, backoff_factor=backoff_factor,
+                  status_forcelist=HTTP_RETRY_STATUSES, allowed_methods=['GET'],
+                  raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
 
 
 app = Flask(__name__)
-app.bank = Storage()
+app.config.update(
+    DAILY_URL=DAILY_URL,
+    DAILY_TIMEOUT=UPSTREAM_TIMEOUT,
+    KEY_INDICATORS_URL=KEY_INDICATORS_URL,
+    KEY_INDICATORS_TIMEOUT=UPSTREAM_TIMEOUT,
+    CBR_PARSER=CBR_PARSER,
+    RATES_REFRESHER=RATES_REFRESHER,
+    COMPRESS_RESPONSES=COMPRESS_RESPONSES,
+    COMPRESS_MIN_SIZE=COMPRESS_MIN_SIZE,
+)
+app.json = JSON_PROVIDERS[JSON_PROVIDER](app)
+app.bank = create_storage()
+app.rates_cache = RatesCache()
+app.revenue_memo = RevenueMemo()
+app.http_session = create_http_session()
 
 
 def custom_float(string: str) -> float:
@@ -159,9 +1775,159 @@ def custom_float(string: str) -> float:
     return float(string.replace(',', ''))
 
 
+def iter_body_lines(stream, chunk_size: int = BULK_CHUNK_SIZE) -> Iterator[str]:
+    """
+    Read utf-8 request body by chunks and split it into lines,
+    invalid bytes are kept as surrogates, so only their rows are rejected
+    :param stream: binary stream
+    :param chunk_size: size of chunk in bytes
+    :return: iterator of lines with line endings
+    """
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='surrogateescape')
+    tail = ''
+    while True:
+        chunk = stream.read(chunk_size)
+        lines = (tail + decoder.decode(chunk, final=not chunk)).split('\n')
+        tail = lines.pop()
+        for line in lines:
+            yield line + '\n'
+        if not chunk:
+            break
+    if tail:
+        yield tail
+
+
+def iter_csv_rows(lines: Iterable[str]) -> Iterator[Tuple[int, Any, str]]:
+    """
+    Parse CSV rows in char_code,name,capital,interest order,
+    header row is optional
+    :param lines: lines of body
+    :return: iterator of line number, row and error
+    """
+    reader = csv.reader(lines)
+    for row in reader:
+        if not row:
+            continue
+        if reader.line_num == 1 and tuple(field.strip() for field in row) == ASSET_FIELDS:
+            continue
+        if len(row) != len(ASSET_FIELDS):
+            yield reader.line_num, None, f'Expected {len(ASSET_FIELDS)} columns, got {len(row)}'
+            continue
+        yield reader.line_num, dict(zip(ASSET_FIELDS, row)), None
+
+
+def iter_jsonl_rows(lines: Iterable[str]) -> Iterator[Tuple[int, Any, str]]:
+    """
+    Parse JSON lines rows, one object with asset fields per line
+    :param lines: lines of body
+    :return: iterator of line number, row and error
+    """
+    for line_num, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            row = load_json(line)
+        except ValueError as error:
+            yield line_num, None, f'Invalid JSON: {error}'
+            continue
+        if not isinstance(row, dict):
+            yield line_num, None, 'Expected JSON object'
+            continue
+        yield line_num, row, None
+
+
+BULK_ROW_PARSERS = {
+    'csv': iter_csv_rows,
+    'jsonl': iter_jsonl_rows,
+}
+
+
+def build_asset(row: Dict[str, Any]) -> Asset:
+    """
+    Validate row and build asset from it
+    :param row: mapping of asset field to value
+    :return: asset
+    """
+    missing = [field for field in ASSET_FIELDS if field not in row]
+    if missing:
+        raise ValueError(f'Missing fields: {", ".join(missing)}')
+    name = str(row['name']).strip()
+    char_code = str(row['char_code']).strip()
+    if not name or not char_code:
+        raise ValueError('Empty name or char code')
+    try:
+        (name + char_code).encode('utf-8')
+    except UnicodeEncodeError:
+        raise ValueError('Invalid UTF-8 in name or char code') from None
+    capital = float(row['capital'])
+    interest = float(row['interest'])
+    if not math.isfinite(capital) or not math.isfinite(interest):
+        raise ValueError('Capital and interest should be finite numbers')
+    return Asset(
+        char_code=char_code,
+        name=name,
+        capital=capital,
+        interest=interest
+    )
+
+
 def parse_cbr_currency_base_daily(html_data: str) -> Dict[str,float]:
     """
-    Parse https://www.cbr.ru/eng/currency_base/daily/
+    Parse https://www.cbr.ru/eng/currency_base/daily/ with parser
+    selected by CBR_PARSER config: lxml or bs4
+    :param html_data: page content
+    :return: mapping of char code to one unit price
+    """
+    return CBR_DAILY_PARSERS[app.config['CBR_PARSER']](html_data)
+
+
+def parse_cbr_key_indicators(html_data: str) -> Dict[str,float]:
+    """
+    Parse https://www.cbr.ru/eng/key-indicators/ with parser
+    selected by CBR_PARSER config: lxml or bs4
+    :param html_data: page content
+    :return: mapping of char code to one unit price
+    """
+    return CBR_KEY_INDICATORS_PARSERS[app.config['CBR_PARSER']](html_data)
+
+
+def parse_cbr_currency_base_daily_lxml(html_data: str) -> Dict[str,float]:
+    """
+    Parse https://www.cbr.ru/eng/currency_base/daily/ with lxml and compiled XPath
+    :param html_data: page content
+    :return: mapping of char code to one unit price
+    """
+    result = {}
+    parsed = lxml_html.document_fromstring(html_data)
+    for row in DAILY_ROWS_XPATH(parsed):
+        cols = row.findall('td')
+        result[cols[1].text_content()] = \
+            custom_float(cols[4].text_content()) / custom_float(cols[2].text_content())
+    if not result:
+        raise ValueError('Currency rates table is not found')
+    return result
+
+
+def parse_cbr_key_indicators_lxml(html_data: str) -> Dict[str,float]:
+    """
+    Parse https://www.cbr.ru/eng/key-indicators/ with lxml and compiled XPath
+    :param html_data: page content
+    :return: mapping of char code to one unit price
+    """
+    result = {}
+    parsed = lxml_html.document_fromstring(html_data)
+    for div_table in KEY_INDICATORS_TABLES_XPATH(parsed):
+        for row in KEY_INDICATORS_ROWS_XPATH(div_table):
+            char_code = KEY_INDICATORS_CHAR_CODE_XPATH(row)
+            result[char_code] = custom_float(KEY_INDICATORS_VALUE_XPATH(row))
+    if not result:
+        raise ValueError('Key indicators tables are not found')
+    return result
+
+
+def parse_cbr_currency_base_daily_bs4(html_data: str) -> Dict[str,float]:
+    """
+    Parse https://www.cbr.ru/eng/currency_base/daily/ with BeautifulSoup
     :param html_data: page content
     :return: mapping of char code to one unit price
     """
@@ -169,18 +1935,20 @@ def parse_cbr_currency_base_daily(html_data: str) -> Dict[str,float]:
     #result['RUB'] = custom_float('1')
     parsed = BeautifulSoup(html_data, 'html.parser')
     table = parsed.find('table', attrs={'class': 'data'})
-    table_body = table.find('tbody')
-    rows = table_body.find_all('tr')
+    table_body = table.find('tbody') if table is not None else None
+    rows = table_body.find_all('tr') if table_body is not None else []
     for row in rows:
         cols = row.find_all('td')
         if len(cols) == 5:
             result[cols[1].text] = custom_float(cols[4].text) / custom_float(cols[2].text)
+    if not result:
+        raise ValueError('Currency rates table is not found')
     return result
 
 
-def parse_cbr_key_indicators(html_data: str) -> Dict[str,float]:
+def parse_cbr_key_indicators_bs4(html_data: str) -> Dict[str,float]:
     """
-    Parse https://www.cbr.ru/eng/key-indicators/
+    Parse https://www.cbr.ru/eng/key-indicators/ with BeautifulSoup
     :param html_data: page content
     :return: mapping of char code to one unit price
     """
@@ -195,18 +1963,213 @@ def parse_cbr_key_indicators(html_data: str) -> Dict[str,float]:
                                  attrs={'class': 'col-md-3 offset-md-1 _subinfo'}).text
             value = custom_float(row.findAll('td')[-1].text)
             result[char_code] = value
+    if not result:
+        raise ValueError('Key indicators tables are not found')
     return result
 
 
+CBR_DAILY_PARSERS = {
+    'bs4': parse_cbr_currency_base_daily_bs4,
+    'lxml': parse_cbr_currency_base_daily_lxml,
+}
+CBR_KEY_INDICATORS_PARSERS = {
+    'bs4': parse_cbr_key_indicators_bs4,
+    'lxml': parse_cbr_key_indicators_lxml,
+}
+
+
+def fetch_cbr_daily() -> Dict[str, float]:
+    """
+    Download and parse https://www.cbr.ru/eng/currency_base/daily/
+    :return: mapping of char code to one unit price
+    """
+    response = app.http_session.get(app.config['DAILY_URL'],
+                                    timeout=app.config['DAILY_TIMEOUT'])
+    response.raise_for_status()
+    return parse_cbr_currency_base_daily(response.text)
+
+
+def fetch_cbr_key_indicators() -> Dict[str, float]:
+    """
+    Download and parse https://www.cbr.ru/eng/key-indicators/
+    :return: mapping of char code to one unit price
+    """
+    response = app.http_session.get(app.config['KEY_INDICATORS_URL'],
+                                    timeout=app.config['KEY_INDICATORS_TIMEOUT'])
+    response.raise_for_status()
+    return parse_cbr_key_indicators(response.text)
+
+
+def get_cbr_daily() -> Dict[str, float]:
+    """
+    Get cached currency mapping from https://www.cbr.ru/eng/currency_base/daily/
+    :return: mapping of char code to one unit price
+    """
+    return app.rates_cache.get(DAILY_URL, fetch_cbr_daily)
+
+
+def get_cbr_key_indicators() -> Dict[str, float]:
+    """
+    Get cached currency mapping from https://www.cbr.ru/eng/key-indicators/
+    :return: mapping of char code to one unit price
+    """
+    return app.rates_cache.get(KEY_INDICATORS_URL, fetch_cbr_key_indicators)
+
+
+app.rates_refresher = RatesRefresher(app.rates_cache, {
+    DAILY_URL: fetch_cbr_daily,
+    KEY_INDICATORS_URL: fetch_cbr_key_indicators,
+})
+
+
+@app.before_request
+def start_rates_refresher():
+    """
+    Start rates refresher on first request of every process,
+    so it works under any WSGI server and in forked workers
+    :return: Nothing
+    """
+    if app.config['RATES_REFRESHER']:
+        app.rates_refresher.start()
+
+
+@app.after_request
+def add_rates_version(response: Response) -> Response:
+    """
+    Add version of rates snapshot which was used by handler
+    :param response: response
+    :return: response
+    """
+    rates_version = g.get('rates_version')
+    if rates_version is not None:
+        response.headers[RATES_VERSION_HEADER] = str(rates_version)
+    return response
+
+
+def iter_compressed(chunks: Iterable[bytes], compressor) -> Iterator[bytes]:
+    """
+    Compress streamed response body
+    :param chunks: chunks of body
+    :param compressor: zlib compress object
+    :return: iterator of compressed chunks
+    """
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+@app.after_request
+def compress_response(response: Response) -> Response:
+    """
+    Compress large and streamed responses with gzip or deflate
+    accepted by client, ETag of compressed response is weak
+    :param response: response
+    :return: response
+    """
+    if not app.config['COMPRESS_RESPONSES'] or response.status_code != 200 \
+            or 'Content-Encoding' in response.headers or response.direct_passthrough:
+        return response
+    if not response.is_streamed and (response.content_length or 0) < app.config['COMPRESS_MIN_SIZE']:
+        return response
+    encoding = request.accept_encodings.best_match(list(COMPRESS_WBITS))
+    if encoding is None:
+        return response
+    compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, COMPRESS_WBITS[encoding])
+    if response.is_streamed:
+        response.response = iter_compressed(response.iter_encoded(), compressor)
+        response.headers.pop('Content-Length', None)
+    else:
+        response.set_data(compressor.compress(response.get_data()) + compressor.flush())
+    response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    etag, is_weak = response.get_etag()
+    if etag is not None and not is_weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+def make_etag(kind: str, version: Union[int, Tuple[Any, ...]], shared: bool = False) -> str:
+    """
+    Make ETag of data version, tag is unique for process
+    unless version is shared by processes
+    :param kind: kind of data
+    :param version: version of data
+    :param shared: version is the same in all processes
+    :return: ETag
+    """
+    if isinstance(version, tuple):
+        version = '.'.join(map(str, version))
+    if shared:
+        return f'{kind}-{version}'
+    return f'{ETAG_PREFIX}-{os.getpid()}-{kind}-{version}'
+
+
+def get_assets_etag(bank: Storage) -> str:
+    """
+    Make ETag of storage, tag of storage shared by processes depends only
+    on its generation and version, so all workers give the same tag for the same data
+    :param bank: storage
+    :return: ETag
+    """
+    shared_version = getattr(bank, 'shared_version', None)
+    if shared_version is not None:
+        return make_etag('assets', shared_version, shared=True)
+    return make_etag('assets', bank.version)
+
+
+def set_validators(response: Response, etag: str, modified_at: float) -> Response:
+    """
+    Set ETag and Last-Modified headers
+    :param response: response
+    :param etag: ETag
+    :param modified_at: unix time of data change
+    :return: response
+    """
+    response.set_etag(etag)
+    response.last_modified = datetime.fromtimestamp(int(modified_at), timezone.utc)
+    return response
+
+
+def get_not_modified_response(etag: str, modified_at: float) -> Union[Response, None]:
+    """
+    Check If-None-Match and If-Modified-Since headers of request
+    :param etag: ETag of actual data
+    :param modified_at: unix time of data change
+    :return: 304 response if client has actual data else None
+    """
+    if request.if_none_match:
+        if not request.if_none_match.contains_weak(etag):
+            return None
+    elif request.if_modified_since is None or int(modified_at) > request.if_modified_since.timestamp():
+        return None
+    return set_validators(Response(status=304), etag, modified_at)
+
+
+def get_rates_response(key: str, loader: Callable[[], Any]) -> Response:
+    """
+    Get cached CBR page response, 304 is returned if client has actual data
+    :param key: cache key
+    :param loader: function to load value
+    :return: JSON
+    """
+    snapshot = app.rates_cache.get_snapshot({key: loader})
+    g.rates_version = snapshot.version
+    etag = make_etag('rates', snapshot.versions[key])
+    response = get_not_modified_response(etag, snapshot.updated_at[key])
+    if response is None:
+        response = set_validators(jsonify(snapshot.values[key]), etag, snapshot.updated_at[key])
+    return response
+
+
 @app.route('/cbr/daily')
 def cbr_daily_api() -> Response:
     """
     Get currency mapping from https://www.cbr.ru/eng/currency_base/daily/
     :return: JSON
     """
-    response = requests.get(DAILY_URL)
-    result = parse_cbr_currency_base_daily(response.text)
-    return jsonify(result)
+    return get_rates_response(DAILY_URL, fetch_cbr_daily)
 
 
 @app.route('/cbr/key_indicators')
@@ -215,9 +2178,7 @@ def cbr_interest_key_api() -> Response:
     Get currency mapping from https://www.cbr.ru/eng/key-indicators/
     :return: JSON
     """
-    response = requests.get(KEY_INDICATORS_URL)
-    result = parse_cbr_key_indicators(response.text)
-    return jsonify(result)
+    return get_rates_response(KEY_INDICATORS_URL, fetch_cbr_key_indicators)
 
 
 @app.errorhandler(404)
@@ -254,35 +2215,134 @@ def add_asset_api(char_code: str, name: str, capital: str, interest: str) -> Res
         capital=float(capital),
         interest=float(interest)
     )
-    if app.bank.is_contains(asset):
+    if not app.bank.add_asset(asset, replace=False):
         return make_response('Name has already exist', 403)
-    app.bank.add_asset(asset)
     return make_response(f"Asset '{name}' was successfully added", 200)
 
 
+@app.route('/api/asset/bulk', methods=['POST'])
+def asset_bulk_api() -> Response:
+    """
+    Add assets from CSV or JSON lines body,
+    valid rows are added in one batch
+    :return: count of added assets and errors by line number
+    """
+    bulk_format = BULK_FORMATS.get(request.mimetype)
+    if bulk_format is None:
+        return make_response('Unsupported content type', 415)
+    rows = BULK_ROW_PARSERS[bulk_format](iter_body_lines(request.stream))
+    assets = []
+    names = {}
+    errors = []
+    for line_num, row, error in rows:
+        if error is None:
+            try:
+                asset = build_asset(row)
+            except (TypeError, ValueError) as exc:
+                error = str(exc)
+            else:
+                if asset.name in names or app.bank.is_contains(asset):
+                    error = 'Name has already exist'
+        if error is not None:
+            errors.append({'line': line_num, 'error': error})
+            continue
+        names[asset.name] = line_num
+        assets.append(asset)
+    rejected = app.bank.add_assets(assets, replace=False)
+    if rejected:
+        errors.extend({'line': names[asset.name], 'error': 'Name has already exist'}
+                      for asset in rejected)
+        errors.sort(key=itemgetter('line'))
+    return jsonify(added=len(assets) - len(rejected), errors=errors)
+
+
+def iter_asset_list_lines(bank: Storage, after: Union[str, None],
+                          limit: Union[int, None]) -> Iterator[str]:
+    """
+    Read asset list by pages and serialize it as JSON lines
+    :param bank: storage
+    :param after: name of asset to start after
+    :param limit: max count of assets, all assets if None
+    :return: iterator of chunks of JSON lines
+    """
+    while limit is None or limit > 0:
+        batch_size = ASSET_LIST_STREAM_BATCH if limit is None else min(limit, ASSET_LIST_STREAM_BATCH)
+        try:
+            page = bank.get_json_page(after, batch_size)
+        except KeyError:
+            return
+        if not page:
+            return
+        yield ''.join(dump_json(row) + '\n' for row in page)
+        if len(page) < batch_size:
+            return
+        if limit is not None:
+            limit -= len(page)
+        after = page[-1][1]
+
+
+def get_asset_list_response(after: Union[str, None], limit: Union[int, None]) -> Response:
+    """
+    Build response of asset list api
+    :param after: name of asset to start after
+    :param limit: max count of assets
+    :return: JSON of asset list
+    """
+    if request.args.get('format') == 'jsonl':
+        return Response(iter_asset_list_lines(app.bank, after, limit), mimetype='application/x-ndjson')
+    if after is None and limit is None:
+        return Response(app.bank.get_json_dump(), mimetype='application/json')
+    limit = min(limit or ASSET_LIST_MAX_LIMIT, ASSET_LIST_MAX_LIMIT)
+    try:
+        page = app.bank.get_json_page(after, limit)
+    except KeyError:
+        return make_response(f"Asset '{after}' not found", 400)
+    response = Response(dump_json(page), mimetype='application/json')
+    if len(page) == limit:
+        response.headers[ASSET_LIST_CURSOR_HEADER] = page[-1][1]
+    return response
+
+
 @app.route('/api/asset/list')
 def asset_list_api():
     """
-    Api to get asset list
+    Api to get asset list, with limit or after page of list is returned
+    and name of its last asset is set to X-Next-After header if there can be
+    next page, with format=jsonl list is streamed as JSON lines
     :return: JSON of asset list
     """
-    data = app.bank.get_json()
-    return jsonify(data)
+    after = request.args.get('after')
+    limit = request.args.get('limit')
+    if limit is not None:
+        if not limit.isdigit() or not int(limit):
+            return make_response('Limit should be positive integer', 400)
+        limit = int(limit)
+    if after is not None and not app.bank.get_assets(after):
+        return make_response(f"Asset '{after}' not found", 400)
+    etag = get_assets_etag(app.bank)
+    modified_at = app.bank.modified_at
+    not_modified_response = get_not_modified_response(etag, modified_at)
+    if not_modified_response is not None:
+        return not_modified_response
+    response = get_asset_list_response(after, limit)
+    if response.status_code == 200:
+        set_validators(response, etag, modified_at)
+    return response
 
 
 @app.route('/api/asset/get')
 def asset_get_api():
     """
-    Api to get asset from list by names
+    Api to get assets from list by names in one batch
     :return: JSON of asset list
     """
-    data = []
-    names = request.args.getlist('name')
-    for name in names:
-        asset = app.bank.get_assets(name)
-        if asset:
-            data.append(asset)
-    return jsonify(sorted(data))
+    etag = get_assets_etag(app.bank)
+    modified_at = app.bank.modified_at
+    response = get_not_modified_response(etag, modified_at)
+    if response is not None:
+        return response
+    data = app.bank.get_many_assets(request.args.getlist('name'))
+    return set_validators(jsonify(data), etag, modified_at)
 
 
 @app.route('/api/asset/calculate_revenue')
@@ -291,18 +2351,20 @@ def asset_calc_revenue_api():
     Api to calculate revenue
     :return: JSON of dict period to revenue
     """
-    data = {}
-    periods = request.args.getlist('period')
-    cbr_indicator_response = requests.get(KEY_INDICATORS_URL)
-    cbr_daily_response = requests.get(DAILY_URL)
-    indicator_map = parse_cbr_key_indicators(cbr_indicator_response.text)
-    daily_map = parse_cbr_currency_base_daily(cbr_daily_response.text)
-    daily_map['RUB'] = custom_float('1')
-    for period in periods:
-        data[int(period)] = app.bank.get_total_revenue(
-            period=int(period),
-            key_indicator=indicator_map,
-            daily=daily_map)
+    periods = [int(period) for period in request.args.getlist('period')]
+    rates, rates_version = app.rates_cache.get_many({
+        KEY_INDICATORS_URL: fetch_cbr_key_indicators,
+        DAILY_URL: fetch_cbr_daily,
+    })
+    g.rates_version = rates_version
+    indicator_map = rates[KEY_INDICATORS_URL]
+    daily_map = dict(rates[DAILY_URL], RUB=custom_float('1'))
+    data = app.revenue_memo.get_total_revenues(
+        storage=app.bank,
+        rates_version=rates_version,
+        periods=periods,
+        key_indicator=indicator_map,
+        daily=daily_map)
     return jsonify(data)
 
 
@@ -314,3 +2376,8 @@ def clear_api():
     """
     app.bank.clear_storage()
     return make_response('there are no more assets', 200)
+
+
+if __name__ == '__main__':
+    app.rates_refresher.start()
+    app.run()
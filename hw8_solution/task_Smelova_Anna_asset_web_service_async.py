@@ -0,0 +1,388 @@
+#!/usr/bin/env python3
+"""
+Asyncio ASGI variant of web service for Asset
+CBR pages are loaded with async HTTP client before request is passed
+to Flask app, so worker threads never wait for cbr.ru
+"""
+import asyncio
+import functools
+import http.client
+import io
+import ssl
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Tuple, Union
+from urllib.parse import urljoin, urlsplit
+
+from task_Smelova_Anna_asset_web_service import \
+    DAILY_URL, KEY_INDICATORS_URL, HTTP_RETRIES, HTTP_BACKOFF_FACTOR, HTTP_RETRY_STATUSES, \
+    RatesCache, app, parse_cbr_currency_base_daily, parse_cbr_key_indicators
+
+WSGI_WORKERS = 32
+HTTP_MAX_REDIRECTS = 10
+HTTP_REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+HTTP_NO_BODY_STATUSES = (204, 304)
+HTTP_MAX_BODY_SIZE = 16 << 20
+HTTP_READ_SIZE = 1 << 16
+ASYNC_RATES_ROUTES = {
+    '/cbr/daily': (DAILY_URL,),
+    '/cbr/key_indicators': (KEY_INDICATORS_URL,),
+    '/api/asset/calculate_revenue': (KEY_INDICATORS_URL, DAILY_URL),
+}
+
+
+class AsyncHttpClient:
+    """
+    Minimal asyncio HTTP/1.0 client for GET requests with retries,
+    backoff and redirects, connection is closed after response.
+    Body is read by Content-Length or until connection is closed,
+    truncated body is an error like refused connection and is retried
+    """
+
+    def __init__(self, retries: int = HTTP_RETRIES,
+                 backoff_factor: float = HTTP_BACKOFF_FACTOR,
+                 max_body_size: int = HTTP_MAX_BODY_SIZE):
+        """
+        Client init
+        :param retries: retries of failed GET requests
+        :param backoff_factor: backoff factor between retries
+        :param max_body_size: max size of response body in bytes
+        """
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.max_body_size = max_body_size
+        self._ssl_context = None
+
+    async def get(self, url: str, timeout: float) -> str:
+        """
+        Download page, redirects are followed like in requests session,
+        any final status except 200 is an error
+        :param url: url of page
+        :param timeout: seconds to wait for each attempt
+        :return: decoded page content
+        """
+        for _ in range(HTTP_MAX_REDIRECTS + 1):
+            status, location, text = await self._get_with_retries(url, timeout)
+            if status in HTTP_REDIRECT_STATUSES and location:
+                url = urljoin(url, location)
+                continue
+            if status != 200:
+                raise ConnectionError(f'{url} responded with status {status}')
+            return text
+        raise ConnectionError(f'{url} exceeded {HTTP_MAX_REDIRECTS} redirects')
+
+    async def _get_with_retries(self, url: str, timeout: float) -> Tuple[int, Union[str, None], str]:
+        for attempt in range(self.retries + 1):
+            try:
+                response = await asyncio.wait_for(self._get(url), timeout)
+            except (OSError, asyncio.TimeoutError):
+                if attempt == self.retries:
+                    raise
+            else:
+                if response[0] not in HTTP_RETRY_STATUSES or attempt == self.retries:
+                    return response
+            await asyncio.sleep(self.backoff_factor * 2 ** attempt)
+
+    async def _get(self, url: str) -> Tuple[int, Union[str, None], str]:
+        parts = urlsplit(url)
+        secure = parts.scheme == 'https'
+        if secure and self._ssl_context is None:
+            self._ssl_context = ssl.create_default_context()
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        reader, writer = await asyncio.open_connection(
+            parts.hostname, parts.port or (443 if secure else 80),
+            ssl=self._ssl_context if secure else None)
+        try:
+            writer.write(f'GET {path} HTTP/1.0\r\n'
+                         f'Host: {parts.netloc}\r\n'
+                         f'Accept-Encoding: identity\r\n'
+                         f'Connection: close\r\n\r\n'.encode('ascii'))
+            await writer.drain()
+            try:
+                head = await reader.readuntil(b'\r\n\r\n')
+                status_line, _, header_data = head.partition(b'\r\n')
+                headers = http.client.parse_headers(io.BytesIO(header_data))
+                status = int(status_line.split()[1])
+                body = await self._read_body(reader, status, headers)
+            except asyncio.IncompleteReadError as error:
+                raise ConnectionError(f'{url} response is truncated') from error
+        finally:
+            writer.close()
+        text = body.decode(headers.get_content_charset() or 'utf-8', errors='replace')
+        return status, headers.get('Location'), text
+
+    async def _read_body(self, reader: asyncio.StreamReader, status: int,
+                         headers: http.client.HTTPMessage) -> bytes:
+        if status in HTTP_NO_BODY_STATUSES or 100 <= status < 200:
+            return b''
+        length = headers.get('Content-Length')
+        if length is not None:
+            if not length.strip().isdigit():
+                raise ValueError(f'Wrong Content-Length: {length}')
+            if int(length) > self.max_body_size:
+                raise ValueError(f'Body size {length} exceeds {self.max_body_size} bytes')
+            return await reader.readexactly(int(length))
+        chunks = []
+        size = 0
+        while True:
+            chunk = await reader.read(HTTP_READ_SIZE)
+            if not chunk:
+                return b''.join(chunks)
+            size += len(chunk)
+            if size > self.max_body_size:
+                raise ValueError(f'Body size exceeds {self.max_body_size} bytes')
+            chunks.append(chunk)
+
+
+class AsyncRatesLoader:
+    """
+    Loads missing and expired values of RatesCache with coroutines,
+    concurrent requests of one value wait for the same load
+    """
+
+    def __init__(self, cache: RatesCache, loaders: Dict[str, Callable[[], Awaitable[Any]]]):
+        """
+        Loader init
+        :param cache: cache to publish values
+        :param loaders: mapping of cache key to coroutine function to load value
+        """
+        self.cache = cache
+        self.loaders = loaders
+        self._pending = {}
+
+    async def ensure(self, keys: Iterable[str]):
+        """
+        Load values which can not be served from cache,
+        stale values are refreshed in background
+        :param keys: cache keys
+        :return: Nothing
+        """
+        expired, stale = self.cache.get_expired(keys)
+        for key in stale:
+            if key not in self._pending and self.cache.claim_refresh(key):
+                self._start(key).add_done_callback(functools.partial(self._release_refresh, key))
+        if expired:
+            await asyncio.gather(*(asyncio.shield(self._start(key)) for key in expired))
+
+    def _start(self, key: str) -> asyncio.Task:
+        task = self._pending.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._load(key))
+            self._pending[key] = task
+            task.add_done_callback(lambda _: self._pending.pop(key, None))
+        return task
+
+    async def _load(self, key: str) -> Any:
+        value = await self.loaders[key]()
+        self.cache.publish({key: value})
+        return value
+
+    def _release_refresh(self, key: str, task: asyncio.Task):
+        if not task.cancelled():
+            task.exception()
+        self.cache.release_refresh(key)
+
+
+async def run_in_worker(func: Callable, *args: Any) -> Any:
+    """
+    Run blocking function in worker thread
+    :param func: function
+    :param args: arguments of function
+    :return: result of function
+    """
+    return await asyncio.get_running_loop().run_in_executor(wsgi_executor, func, *args)
+
+
+async def fetch_cbr_daily_async() -> Dict[str, float]:
+    """
+    Download https://www.cbr.ru/eng/currency_base/daily/ with async client
+    and parse it in worker thread
+    :return: mapping of char code to one unit price
+    """
+    html_data = await http_client.get(app.config['DAILY_URL'], app.config['DAILY_TIMEOUT'])
+    return await run_in_worker(parse_cbr_currency_base_daily, html_data)
+
+
+async def fetch_cbr_key_indicators_async() -> Dict[str, float]:
+    """
+    Download https://www.cbr.ru/eng/key-indicators/ with async client
+    and parse it in worker thread
+    :return: mapping of char code to one unit price
+    """
+    html_data = await http_client.get(app.config['KEY_INDICATORS_URL'], app.config['KEY_INDICATORS_TIMEOUT'])
+    return await run_in_worker(parse_cbr_key_indicators, html_data)
+
+
+wsgi_executor = ThreadPoolExecutor(max_workers=WSGI_WORKERS)
+http_client = AsyncHttpClient()
+rates_loader = AsyncRatesLoader(app.rates_cache, {
+    DAILY_URL: fetch_cbr_daily_async,
+    KEY_INDICATORS_URL: fetch_cbr_key_indicators_async,
+})
+
+
+def build_environ(scope: Dict[str, Any], body: bytes) -> Dict[str, Any]:
+    """
+    Build WSGI environ of ASGI http request
+    :param scope: ASGI connection scope
+    :param body: request body
+    :return: WSGI environ
+    """
+    server_name, server_port = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf8').decode('latin1'),
+        'PATH_INFO': scope['path'].encode('utf8').decode('latin1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin1'),
+        'SERVER_NAME': server_name,
+        'SERVER_PORT': str(server_port),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': scope['client'][0] if scope.get('client') else '',
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.input_terminated': True,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin1').upper().replace('-', '_')
+        value = value.decode('latin1')
+        if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            name = 'HTTP_' + name
+        environ[name] = f'{environ[name]},{value}' if name in environ else value
+    return environ
+
+
+async def read_body(receive: Callable[[], Awaitable[Dict[str, Any]]]) -> bytes:
+    """
+    Read body of ASGI http request
+    :param receive: ASGI receive function
+    :return: request body
+    """
+    chunks = []
+    more_body = True
+    while more_body:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            break
+        chunks.append(message.get('body', b''))
+        more_body = message.get('more_body', False)
+    return b''.join(chunks)
+
+
+async def send_response(send: Callable[[Dict[str, Any]], Awaitable[None]], status: int,
+                        headers: List[Tuple[str, str]], chunks: Iterable[bytes]):
+    """
+    Send response of WSGI app, body chunks are read in worker thread
+    :param send: ASGI send function
+    :param status: status code
+    :param headers: response headers
+    :param chunks: iterable of body chunks
+    :return: Nothing
+    """
+    iterator = iter(chunks)
+    try:
+        chunk = await run_in_worker(next, iterator, None)
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(name.lower().encode('latin1'), value.encode('latin1')) for name, value in headers],
+        })
+        while chunk is not None:
+            if chunk:
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            chunk = await run_in_worker(next, iterator, None)
+        await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        if hasattr(chunks, 'close'):
+            await run_in_worker(chunks.close)
+
+
+async def call_wsgi(scope: Dict[str, Any], body: bytes,
+                    send: Callable[[Dict[str, Any]], Awaitable[None]]):
+    """
+    Pass request to Flask app in worker thread
+    :param scope: ASGI connection scope
+    :param body: request body
+    :param send: ASGI send function
+    :return: Nothing
+    """
+    started = {}
+
+    def start_response(status: str, headers: List[Tuple[str, str]], exc_info: Any = None):
+        started['status'] = int(status.split(' ', 1)[0])
+        started['headers'] = headers
+
+    chunks = await run_in_worker(app.wsgi_app, build_environ(scope, body), start_response)
+    await send_response(send, started['status'], started['headers'], chunks)
+
+
+async def handle_lifespan(receive: Callable[[], Awaitable[Dict[str, Any]]],
+                          send: Callable[[Dict[str, Any]], Awaitable[None]]):
+    """
+    Start rates refresher on startup and stop it on shutdown
+    :param receive: ASGI receive function
+    :param send: ASGI send function
+    :return: Nothing
+    """
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            app.rates_refresher.start()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await run_in_worker(app.rates_refresher.stop)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def reject_websocket(receive: Callable[[], Awaitable[Dict[str, Any]]],
+                           send: Callable[[Dict[str, Any]], Awaitable[None]]):
+    """
+    Close websocket connection before accepting it, server responds with 403
+    :param receive: ASGI receive function
+    :param send: ASGI send function
+    :return: Nothing
+    """
+    message = await receive()
+    if message['type'] == 'websocket.connect':
+        await send({'type': 'websocket.close', 'code': 1008})
+
+
+async def asgi_app(scope: Dict[str, Any], receive: Callable[[], Awaitable[Dict[str, Any]]],
+                   send: Callable[[Dict[str, Any]], Awaitable[None]]):
+    """
+    ASGI app, pages required by rates routes are loaded with coroutines,
+    then request is served by Flask app from fresh cache
+    :param scope: ASGI connection scope
+    :param receive: ASGI receive function
+    :param send: ASGI send function
+    :return: Nothing
+    """
+    if scope['type'] == 'lifespan':
+        await handle_lifespan(receive, send)
+        return
+    if scope['type'] == 'websocket':
+        await reject_websocket(receive, send)
+        return
+    if scope['type'] != 'http':
+        raise ValueError(f"Unsupported ASGI scope type: {scope['type']}")
+    keys = ASYNC_RATES_ROUTES.get(scope['path'])
+    if keys:
+        try:
+            await rates_loader.ensure(keys)
+        except Exception:  # pylint: disable=broad-except
+            await send_response(send, 503, [('Content-Type', 'text/html; charset=utf-8')],
+                                [b'CBR service is unavailable'])
+            return
+    await call_wsgi(scope, await read_body(receive), send)
+
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run(asgi_app)
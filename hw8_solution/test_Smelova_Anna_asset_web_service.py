@@ -1,13 +1,24 @@
+import io
+import json
+import itertools
+import os
+import subprocess
+import sys
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 import pytest
-from unittest.mock import patch
-from collections import namedtuple
+from unittest.mock import patch, MagicMock
 from task_Smelova_Anna_asset_web_service import \
-    Asset, Storage, DAILY_URL, KEY_INDICATORS_URL, app, \
-    custom_float, parse_cbr_currency_base_daily, parse_cbr_key_indicators
+    Asset, Storage, ColumnarStorage, SQLiteStorage, PersistentStorage, WriteAheadLog, create_storage, encode_assets, decode_assets, DAILY_URL, KEY_INDICATORS_URL, app, RatesCache, RatesRefresher, RevenueMemo, RATES_VERSION_HEADER, create_http_session, \
+    custom_float, iter_body_lines, dump_json, load_json, JSON_PROVIDERS, parse_cbr_currency_base_daily, parse_cbr_key_indicators, \
+    CBR_DAILY_PARSERS, CBR_KEY_INDICATORS_PARSERS
 
 
 @pytest.fixture
 def client():
+    app.rates_cache.clear()
     with app.test_client() as client:
         yield client
 
@@ -43,6 +54,13 @@ def test_asset_repr():
         f'expected: Asset(Vasya, 12.0, 0.5)')
 
 
+def test_asset_has_no_dict():
+    asset = Asset('Anya', 10.0, 1.5, 'USD')
+    assert not hasattr(asset, '__dict__')
+    with pytest.raises(AttributeError):
+        asset.currency = 'USD'
+
+
 def test_asset_error():
     left = Asset('Anya', 10.0, 1.5, 'USD')
     with pytest.raises(ValueError):
@@ -129,6 +147,367 @@ def test_storage_is_contains(asset, expected_result):
     )
 
 
+def test_storage_sorted_view_after_interleaved_adds():
+    bank = Storage()
+    for name in ['Veronika', 'Diana', 'Anya', 'Alice']:
+        bank.add_asset(Asset(name, 10, 1, 'USD'))
+        names = [var.name for var in bank.asset_list]
+        assert sorted(names) == names
+    bank.add_asset(Asset('Diana', 20, 2, 'EUR'))
+    assert ['Alice', 'Anya', 'Diana', 'Veronika'] == [var.name for var in bank.asset_list]
+    assert ['EUR', 'Diana', 20, 2] == bank.get_assets('Diana')
+
+
+def test_storage_new_assets_are_appended_in_place():
+    bank = Storage([Asset(f'asset{number:03d}', 1, 0.1, 'USD') for number in range(99, 0, -1)])
+    pending = bank._unsorted_assets
+    assert 99 == len(pending)
+    for number in range(100, 200):
+        bank.add_asset(Asset(f'asset{number:03d}', 1, 0.1, 'USD'))
+    assert pending is bank._unsorted_assets and 199 == len(pending)
+    assert [f'asset{number:03d}' for number in range(1, 200)] == [var.name for var in bank.asset_list]
+    assert [] == bank._unsorted_assets
+
+
+def test_storage_add_assets():
+    bank = Storage([Asset('Diana', 5, 0, 'RUB'), Asset('Anya', 10, 1, 'USD')])
+    bank.add_assets([
+        Asset('Veronika', 50, 1, 'USD'),
+        Asset('Diana', 20, 2, 'EUR'),
+        Asset('Alice', 15, 2, 'EUR'),
+        Asset('Alice', 25, 2, 'EUR'),
+    ])
+    expected_result = [
+        ['EUR', 'Alice', 25, 2],
+        ['EUR', 'Diana', 20, 2],
+        ['USD', 'Anya', 10, 1],
+        ['USD', 'Veronika', 50, 1],
+    ]
+    assert expected_result == bank.get_json()
+    assert ['Alice', 'Anya', 'Diana', 'Veronika'] == [var.name for var in bank.asset_list]
+    assert {('USD', 1): 60, ('EUR', 2): 45} == bank.capital_groups
+
+
+def test_storage_add_asset_without_replace():
+    bank = Storage([Asset('Anya', 10, 1, 'USD')])
+    assert bank.add_asset(Asset('Anya', 20, 2, 'EUR'), replace=False) is False
+    assert ['USD', 'Anya', 10, 1] == bank.get_assets('Anya')
+    assert bank.add_asset(Asset('Diana', 20, 2, 'EUR'), replace=False) is True
+    rejected = bank.add_assets([Asset('Diana', 5, 1, 'RUB'), Asset('Alice', 5, 1, 'RUB')], replace=False)
+    assert ['Diana'] == [asset.name for asset in rejected]
+    assert ['Alice', 'Anya', 'Diana'] == [var.name for var in bank.asset_list]
+
+
+@pytest.mark.parametrize('numpy_enabled', [True, False])
+def test_storage_concurrent_stress(monkeypatch, numpy_enabled):
+    if not numpy_enabled:
+        monkeypatch.setattr('task_Smelova_Anna_asset_web_service.np', None)
+    bank = Storage()
+    rates = {'USD': 2.0, 'EUR': 3.0}
+    writers_count, names_count = 4, 300
+    added = [[] for _ in range(writers_count)]
+    errors = []
+    done = threading.Event()
+
+    def writer(index):
+        for number in range(names_count):
+            char_code = 'USD' if number % 2 else 'EUR'
+            asset = Asset(f'asset{number:04d}', 10, 0.1, char_code)
+            if bank.add_asset(asset, replace=False):
+                added[index].append(asset.name)
+            if number % 50 == 0:
+                bank.add_assets([Asset(f'batch{index}_{number}', 1, 0.1, 'USD')])
+
+    def reader():
+        try:
+            while not done.is_set():
+                names = [var.name for var in bank.asset_list]
+                assert sorted(names) == names
+                assert len(bank.get_json()) >= len(names)
+                bank.get_json_dump()
+                bank.get_total_revenues([1, 2], rates, {})
+        except Exception as error:
+            errors.append(error)
+
+    readers = [threading.Thread(target=reader) for _ in range(4)]
+    writers = [threading.Thread(target=writer, args=(index,)) for index in range(writers_count)]
+    for thread in readers + writers:
+        thread.start()
+    for thread in writers:
+        thread.join()
+    done.set()
+    for thread in readers:
+        thread.join()
+
+    assert [] == errors
+    added_names = sorted(itertools.chain.from_iterable(added))
+    assert [f'asset{number:04d}' for number in range(names_count)] == added_names
+    expected_size = names_count + writers_count * len(range(0, names_count, 50))
+    assert expected_size == len(bank.asset_list) == len(bank.get_json())
+    expected_result = {('EUR', 0.1): 10 * names_count / 2,
+                       ('USD', 0.1): 10 * names_count / 2 + writers_count * len(range(0, names_count, 50))}
+    assert expected_result == bank.capital_groups
+
+
+def create_persistent_storage(directory, assets=None):
+    bank = PersistentStorage(directory, sync=False)
+    if assets:
+        bank.add_assets(assets)
+    return bank
+
+
+@pytest.fixture(params=['memory', 'columnar', 'sqlite', 'persistent'])
+def storage_factory(request, tmp_path):
+    if request.param == 'columnar':
+        return ColumnarStorage
+    if request.param == 'sqlite':
+        return lambda assets=None: SQLiteStorage(str(tmp_path / 'assets.db'), assets)
+    if request.param == 'persistent':
+        return lambda assets=None: create_persistent_storage(str(tmp_path / 'storage'), assets)
+    return Storage
+
+
+def test_storage_backends(storage_factory):
+    bank = storage_factory([Asset('Diana', 5, 0, 'RUB'), Asset('Anya', 10, 1, 'USD')])
+    versions = [bank.version]
+    assert bank.add_asset(Asset('Alice', 15, 2, 'EUR'), replace=False) is True
+    assert bank.add_asset(Asset('Anya', 20, 2, 'EUR'), replace=False) is False
+    versions.append(bank.version)
+    bank.add_asset(Asset('Diana', 7, 1, 'USD'))
+    versions.append(bank.version)
+    expected_result = [['EUR', 'Alice', 15, 2], ['USD', 'Anya', 10, 1], ['USD', 'Diana', 7, 1]]
+    assert expected_result == bank.get_json()
+    assert expected_result == json.loads(bank.get_json_dump())
+    assert expected_result[1:] == bank.get_json_page('Alice')
+    assert expected_result[:2] == bank.get_json_page(limit=2)
+    assert [expected_result[2]] == bank.get_json_page('Anya', 5)
+    with pytest.raises(KeyError):
+        bank.get_json_page('Veronika')
+    assert ['Alice', 'Anya', 'Diana'] == [var.name for var in bank.asset_list]
+    assert ['USD', 'Anya', 10, 1] == bank.get_assets('Anya') and [] == bank.get_assets('Veronika')
+    assert [expected_result[0], expected_result[2]] == bank.get_many_assets(['Diana', 'Veronika', 'Alice', 'Diana'])
+    assert bank.is_contains(Asset('Alice', 1, 1, 'RUB'))
+    assert {('EUR', 2): 15, ('USD', 1): 17} == bank.capital_groups
+    result = bank.get_total_revenues([1, 2], {'USD': 2.0}, {'EUR': 3.0})
+    assert {1: pytest.approx(15 * 2 * 3.0 + 17 * 2.0), 2: pytest.approx(15 * 8 * 3.0 + 17 * 3 * 2.0)} == result
+    bank.clear_storage()
+    versions.append(bank.version)
+    assert [] == bank.get_json() and '[]' == bank.get_json_dump() and {} == bank.capital_groups
+    assert len(set(versions)) == len(versions)
+
+
+def test_storage_get_many_assets(storage_factory):
+    char_codes = ['USD', 'EUR', 'RUB']
+    bank = storage_factory([Asset(f'asset{index:03d}', index, 0.1, char_codes[index % 3]) for index in range(300)])
+    names = [f'asset{index:03d}' for index in range(0, 400, 7)] * 2
+    expected_result = [row for row in bank.get_json() if row[1] in names]
+    result = bank.get_many_assets(names)
+    assert expected_result == result, (
+        f'Wrong result: {result}, '
+        f'expected: {expected_result}'
+    )
+    bank.add_asset(Asset('asset007', 1, 0.2, 'AUD'))
+    assert ['AUD', 'asset007', 1, 0.2] == bank.get_many_assets(names)[0]
+    assert [] == bank.get_many_assets([])
+
+
+@pytest.mark.parametrize('storage_class, cache', [(Storage, '_json_cache'), (ColumnarStorage, '_order_cache')])
+def test_storage_get_many_assets_after_change_does_not_build_json(storage_class, cache):
+    bank = storage_class([Asset(f'asset{index:03d}', index, 0.1, 'USD') for index in range(300)])
+    bank.get_json()
+    bank.add_asset(Asset('asset999', 1, 0.2, 'EUR'))
+    names = [f'asset{index:03d}' for index in range(0, 1000, 3)]
+    assert 101 == len(bank.get_many_assets(names))
+    assert getattr(bank, cache) is None
+
+
+def test_columnar_storage_columns():
+    bank = ColumnarStorage([Asset('Diana', 5, 0, 'RUB'), Asset('Anya', 10, 1, 'USD'), Asset('Alice', 15, 2, 'USD')])
+    bank.add_asset(Asset('Diana', 7, 1, 'USD'))
+    assert ['Diana', 'Anya', 'Alice'] == bank.names
+    assert [7, 10, 15] == list(bank.capitals) and [1, 1, 2] == list(bank.interests)
+    assert ['RUB', 'USD'] == bank.char_codes and [1, 1, 1] == list(bank.char_code_ids)
+    assert ['Alice', 'Anya', 'Diana'] == [var.name for var in bank.asset_list]
+    assert {('USD', 1): 17, ('USD', 2): 15} == bank.capital_groups
+
+
+def test_sqlite_storage_is_shared_between_processes(tmp_path):
+    path = str(tmp_path / 'assets.db')
+    bank = SQLiteStorage(path, [Asset('Anya', 10, 1, 'USD')])
+    assert '[["USD","Anya",10,1]]' == bank.get_json_dump()
+    version = bank.version
+    script = (
+        'import sys\n'
+        'from task_Smelova_Anna_asset_web_service import Asset, SQLiteStorage\n'
+        'bank = SQLiteStorage(sys.argv[1])\n'
+        'assert bank.add_asset(Asset("Diana", 15, 2, "RUB"), replace=False)\n'
+        'assert not bank.add_asset(Asset("Anya", 15, 2, "RUB"), replace=False)\n'
+    )
+    subprocess.run([sys.executable, '-c', script, path], check=True)
+    assert version != bank.version
+    assert ['RUB', 'Diana', 15, 2] == bank.get_assets('Diana')
+    assert '[["RUB","Diana",15,2],["USD","Anya",10,1]]' == bank.get_json_dump()
+
+
+def test_create_storage(tmp_path):
+    assert type(create_storage(None, None)) is Storage
+    assert isinstance(create_storage(None, None, columnar=True), ColumnarStorage)
+    assert isinstance(create_storage(str(tmp_path / 'assets.db'), None), SQLiteStorage)
+    assert isinstance(create_storage(None, str(tmp_path / 'storage')), PersistentStorage)
+
+
+def test_encode_assets():
+    assets = [Asset('Анна', 10.5, 0.1, 'USD'), Asset('Diana', 5, 0, 'Au')]
+    result = [var.get_json() for var in decode_assets(encode_assets(assets))]
+    expected_result = [var.get_json() for var in assets]
+    assert expected_result == result, (
+        f'Wrong result: {result}, '
+        f'expected: {expected_result}'
+    )
+
+
+def test_persistent_storage_recovery(tmp_path):
+    directory = str(tmp_path / 'storage')
+    bank = PersistentStorage(directory)
+    bank.add_assets([Asset('Anya', 10, 1, 'USD'), Asset('Diana', 15, 2, 'RUB')])
+    bank.clear_storage()
+    bank.add_asset(Asset('Alice', 15, 2, 'EUR'))
+    bank.snapshot()
+    assert 0 == os.path.getsize(bank.wal_path)
+    bank.add_asset(Asset('Veronika', 50, 1, 'USD'))
+    assert not bank.add_asset(Asset('Alice', 1, 1, 'RUB'), replace=False)
+    bank.add_asset(Asset('Alice', 20, 2, 'EUR'))
+    expected_result = bank.get_json()
+    bank.close()
+    recovered_bank = PersistentStorage(directory)
+    result = recovered_bank.get_json()
+    assert expected_result == result == [['EUR', 'Alice', 20, 2], ['USD', 'Veronika', 50, 1]], (
+        f'Wrong result: {result}, '
+        f'expected: {expected_result}'
+    )
+    assert {('EUR', 2): 20, ('USD', 1): 50} == recovered_bank.capital_groups
+    recovered_bank.close()
+
+
+def test_persistent_storage_torn_log_tail(tmp_path):
+    directory = str(tmp_path / 'storage')
+    bank = PersistentStorage(directory, sync=False)
+    bank.add_asset(Asset('Anya', 10, 1, 'USD'))
+    bank.add_asset(Asset('Diana', 15, 2, 'RUB'))
+    bank.close()
+    size = os.path.getsize(bank.wal_path)
+    with open(bank.wal_path, 'r+b') as wal_file:
+        wal_file.truncate(size - 3)
+    recovered_bank = PersistentStorage(directory, sync=False)
+    assert [['USD', 'Anya', 10, 1]] == recovered_bank.get_json()
+    recovered_bank.add_asset(Asset('Alice', 15, 2, 'EUR'))
+    recovered_bank.close()
+    records, valid_size = WriteAheadLog.read(recovered_bank.wal_path)
+    assert 2 == len(records) and os.path.getsize(recovered_bank.wal_path) == valid_size
+
+
+def test_persistent_storage_snapshot_by_log_size(tmp_path):
+    directory = str(tmp_path / 'storage')
+    bank = PersistentStorage(directory, sync=False, snapshot_wal_size=1024)
+    for number in range(100):
+        bank.add_asset(Asset(f'asset{number:03d}', number, 0.1, 'USD'))
+    assert os.path.exists(bank.snapshot_path)
+    assert bank.wal.size < 1024
+    bank.close()
+    assert 100 == len(PersistentStorage(directory, sync=False).asset_list)
+
+
+def test_write_ahead_log_group_commit(tmp_path):
+    bank = PersistentStorage(str(tmp_path / 'storage'))
+    real_fsync = os.fsync
+
+    def slow_fsync(fd):
+        time.sleep(0.01)
+        real_fsync(fd)
+
+    def add(number):
+        for index in range(10):
+            bank.add_asset(Asset(f'asset{number}_{index}', 1, 0.1, 'USD'))
+
+    with patch('os.fsync', side_effect=slow_fsync) as fsync:
+        threads = [threading.Thread(target=add, args=(number,)) for number in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    assert 80 == len(bank.asset_list)
+    assert fsync.call_count < 80, (
+        f'Wrong fsync count: {fsync.call_count}, '
+        f'expected less than 80'
+    )
+    records, _ = WriteAheadLog.read(bank.wal_path)
+    assert 80 == len(records)
+
+
+def test_write_ahead_log_failed_commit(tmp_path):
+    bank = PersistentStorage(str(tmp_path / 'storage'))
+    bank.add_asset(Asset('Anya', 10, 1, 'USD'))
+    with patch('os.fsync', side_effect=OSError('disk failure')):
+        with pytest.raises(OSError, match='disk failure'):
+            bank.add_asset(Asset('Alice', 15, 2, 'EUR'))
+    with pytest.raises(OSError, match='Write-ahead log failed'):
+        bank.add_asset(Asset('Diana', 5, 0, 'RUB'))
+    with pytest.raises(OSError, match='Write-ahead log failed'):
+        bank.close()
+    assert bank.wal._file.closed
+
+
+def test_persistent_storage_serves_only_committed_changes(tmp_path):
+    directory = str(tmp_path / 'storage')
+    bank = PersistentStorage(directory)
+    bank.add_asset(Asset('Anya', 10, 1, 'USD'))
+    version = bank.version
+    with patch('os.fsync', side_effect=OSError('disk failure')):
+        with pytest.raises(OSError, match='disk failure'):
+            bank.add_asset(Asset('Alice', 15, 2, 'EUR'))
+    with pytest.raises(OSError, match='Write-ahead log failed'):
+        bank.add_assets([Asset('Diana', 5, 0, 'RUB')])
+    with pytest.raises(OSError, match='Write-ahead log failed'):
+        bank.clear_storage()
+    expected_result = [['USD', 'Anya', 10, 1]]
+    assert expected_result == bank.get_json() and version == bank.version
+    assert ['Anya'] == [var.name for var in bank.asset_list]
+    assert {('USD', 1): 10} == bank.capital_groups
+    with pytest.raises(OSError):
+        bank.close()
+    result = PersistentStorage(directory).get_json()
+    assert expected_result == result, (
+        f'Wrong result: {result}, '
+        f'expected: {expected_result}'
+    )
+
+
+def test_persistent_storage_concurrent_adds_without_replace(tmp_path):
+    bank = PersistentStorage(str(tmp_path / 'storage'), sync=False)
+    added = []
+
+    def add(number):
+        for index in range(50):
+            if bank.add_asset(Asset(f'asset{index:02d}', number, 0.1, 'USD'), replace=False):
+                added.append(index)
+            if index % 10 == 0:
+                bank.clear_storage()
+
+    threads = [threading.Thread(target=add, args=(number,)) for number in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    expected_result = bank.get_json()
+    bank.close()
+    result = PersistentStorage(str(tmp_path / 'storage'), sync=False).get_json()
+    assert expected_result == result, (
+        f'Wrong result: {result}, '
+        f'expected: {expected_result}'
+    )
+    assert len(added) >= len(result)
+
+
 def test_storage_get_json():
     asset_1 = Asset('Anya', 10, 1, 'USD')
     asset_2 = Asset('Diana', 15, 2, 'RUB')
@@ -144,6 +523,16 @@ def test_storage_get_json():
     )
 
 
+def test_storage_get_json_cache_is_invalidated():
+    bank = Storage([Asset('Anya', 10, 1, 'USD')])
+    assert '[["USD","Anya",10,1]]' == bank.get_json_dump()
+    bank.add_asset(Asset('Diana', 15, 2, 'RUB'))
+    assert [['RUB', 'Diana', 15, 2], ['USD', 'Anya', 10, 1]] == bank.get_json()
+    assert '[["RUB","Diana",15,2],["USD","Anya",10,1]]' == bank.get_json_dump()
+    bank.clear_storage()
+    assert [] == bank.get_json() and '[]' == bank.get_json_dump()
+
+
 def test_storage_clear_storage():
     asset_1 = Asset('Anya', 10, 1, 'USD')
     asset_2 = Asset('Diana', 15, 2, 'RUB')
@@ -205,6 +594,79 @@ def test_storage_get_total_revenue():
     )
 
 
+@pytest.mark.parametrize('numpy_enabled', [True, False])
+def test_storage_get_total_revenues(monkeypatch, numpy_enabled):
+    if not numpy_enabled:
+        monkeypatch.setattr('task_Smelova_Anna_asset_web_service.np', None)
+    assets = [
+        Asset('Anya', 10, 0.1, 'USD'),
+        Asset('Alice', 15, 0.2, 'EUR'),
+        Asset('Diana', 5, 0, 'JPY'),
+        Asset('Veronika', 50, 0.05, 'USD'),
+    ]
+    key_indicator_map = {'USD': 73.6, 'EUR': 83.1}
+    daily_map = {'JPY': 64.8}
+    rates = {**daily_map, **key_indicator_map}
+    periods = [1, 3, 10]
+    bank = Storage(assets)
+    result = bank.get_total_revenues(periods, key_indicator_map, daily_map)
+    for period in periods:
+        expected_result = sum(asset.calculate_revenue(period) * rates[asset.char_code] for asset in assets)
+        assert expected_result == pytest.approx(result[period]), (
+            f'Wrong result: {result[period]}, '
+            f'expected: {expected_result}'
+        )
+
+
+def test_storage_capital_groups():
+    bank = Storage([
+        Asset('Anya', 10, 0.1, 'USD'),
+        Asset('Alice', 15, 0.1, 'USD'),
+        Asset('Diana', 5, 0.2, 'USD'),
+        Asset('Veronika', 50, 0.1, 'EUR'),
+    ])
+    expected_result = {('USD', 0.1): 25, ('USD', 0.2): 5, ('EUR', 0.1): 50}
+    assert expected_result == bank.capital_groups, (
+        f'Wrong result: {bank.capital_groups}, '
+        f'expected: {expected_result}'
+    )
+    bank.add_asset(Asset('Alice', 20, 0.1, 'USD'))
+    bank.add_asset(Asset('Diana', 7, 0.3, 'EUR'))
+    expected_result = {('USD', 0.1): 30, ('EUR', 0.1): 50, ('EUR', 0.3): 7}
+    assert expected_result == bank.capital_groups, (
+        f'Wrong result: {bank.capital_groups}, '
+        f'expected: {expected_result}'
+    )
+    bank.clear_storage()
+    assert {} == bank.capital_groups
+
+
+def test_storage_version_is_bumped():
+    bank = Storage()
+    other_bank = Storage()
+    versions = [bank.version, other_bank.version]
+    bank.add_asset(Asset('Anya', 10, 1, 'USD'))
+    versions.append(bank.version)
+    bank.clear_storage()
+    versions.append(bank.version)
+    assert len(set(versions)) == len(versions)
+
+
+def test_revenue_memo():
+    bank = Storage([Asset('Anya', 10, 1, 'USD')])
+    memo = RevenueMemo(maxsize=2)
+    rates = {'USD': 2.0}
+    with patch.object(bank, 'get_total_revenues', wraps=bank.get_total_revenues) as calc:
+        assert {1: 20.0, 2: 60.0} == memo.get_total_revenues(bank, 1, [1, 2], rates, {})
+        assert {2: 60.0, 1: 20.0} == memo.get_total_revenues(bank, 1, [2, 1], rates, {})
+        assert 1 == calc.call_count
+        memo.get_total_revenues(bank, 2, [1], rates, {})
+        assert 2 == calc.call_count
+        bank.add_asset(Asset('Diana', 10, 1, 'USD'))
+        assert {1: 40.0} == memo.get_total_revenues(bank, 2, [1], rates, {})
+        assert 3 == calc.call_count
+
+
 def test_storage_custom_float():
     expected_result = 1234.56
     result = custom_float('1,234.56')
@@ -247,7 +709,7 @@ def test_parse_cbr_key_indicators():
     )
 
 
-@patch('requests.get')
+@patch('requests.Session.get')
 def test_cbr_daily_api(mock_get, client):
     with open('cbr_currency_base_daily.html', 'r', encoding='utf8') as f:
         mock_get.return_value.text = f.read()
@@ -268,7 +730,26 @@ def test_cbr_daily_api(mock_get, client):
     )
 
 
-@patch('requests.get')
+def test_cbr_daily_api_conditional_get(client):
+    app.rates_cache.publish({DAILY_URL: {'AUD': 57.0229}})
+    response = client.get('/cbr/daily')
+    etag = response.headers['ETag']
+    assert 200 == response.status_code and response.headers['Last-Modified']
+    with patch('task_Smelova_Anna_asset_web_service.jsonify') as mock_jsonify:
+        result = client.get('/cbr/daily', headers={'If-None-Match': etag})
+        assert 304 == result.status_code and b'' == result.data
+        result = client.get('/cbr/daily', headers={'If-Modified-Since': response.headers['Last-Modified']})
+        assert 304 == result.status_code
+        mock_jsonify.assert_not_called()
+    app.rates_cache.publish({KEY_INDICATORS_URL: {'USD': 75.4571}})
+    assert 304 == client.get('/cbr/daily', headers={'If-None-Match': etag}).status_code
+    app.rates_cache.publish({DAILY_URL: {'AUD': 58.0}})
+    result = client.get('/cbr/daily', headers={'If-None-Match': etag})
+    assert 200 == result.status_code and {'AUD': 58.0} == result.json
+    assert etag != result.headers['ETag']
+
+
+@patch('requests.Session.get')
 def test_cbr_key_indicator_api(mock_get, client):
     with open('cbr_key_indicators.html', 'r', encoding='utf8') as f:
         mock_get.return_value.text = f.read()
@@ -302,7 +783,7 @@ def test_bad_route_api(client):
     )
 
 
-@patch('requests.get')
+@patch('requests.Session.get')
 def test_cbr_daily_api_unavailable(mock_get, client):
     mock_get.return_value.status_code = 503
     expected_result = 'CBR service is unavailable'
@@ -318,7 +799,7 @@ def test_cbr_daily_api_unavailable(mock_get, client):
     )
 
 
-@patch('requests.get')
+@patch('requests.Session.get')
 def test_cbr_key_indicator_api_unavailable(mock_get, client):
     mock_get.return_value.status_code = 503
     expected_result = 'CBR service is unavailable'
@@ -387,6 +868,257 @@ def test_add_existed_asset_api(route, expected_message, expected_status_code, cl
     )
 
 
+@pytest.mark.parametrize('chunk_size', [1, 3, 1024])
+def test_iter_body_lines(chunk_size):
+    body = 'a,Анна\nb\n\nc'.encode()
+    result = list(iter_body_lines(io.BytesIO(body), chunk_size))
+    assert ['a,Анна\n', 'b\n', '\n', 'c'] == result
+
+
+@pytest.mark.parametrize(
+    'content_type, body',
+    [
+        pytest.param(
+            'text/csv',
+            'char_code,name,capital,interest\n'
+            'USD,Anya,10,1\n'
+            'EUR,Alice,ten,2\n'
+            'EUR,Diana,15\n'
+            'RUB,Veronika,5,0.5\n'
+            'USD,Anya,20,1\n',
+            id='csv'
+        ),
+        pytest.param(
+            'application/x-ndjson',
+            '{"char_code": "USD", "name": "Anya", "capital": 10, "interest": 1}\n'
+            '{"char_code": "EUR", "name": "Alice", "capital": "ten", "interest": 2}\n'
+            '{"char_code": "EUR", "name": "Diana", "capital": 15}\n'
+            '{"char_code": "RUB", "name": "Veronika", "capital": 5, "interest": 0.5}\n'
+            '{"char_code": "USD", "name": "Anya", "capital": 20, "interest": 1}\n',
+            id='jsonl'
+        ),
+    ]
+)
+def test_asset_bulk_api(content_type, body, client):
+    client.application.bank = Storage()
+    response = client.post('/api/asset/bulk', data=body.encode(), content_type=content_type)
+    assert 200 == response.status_code
+    result = response.get_json()
+    assert 2 == result['added']
+    error_lines = [error['line'] for error in result['errors']]
+    first_line = 2 if content_type == 'text/csv' else 1
+    expected_lines = [first_line + 1, first_line + 2, first_line + 4]
+    assert expected_lines == error_lines, (
+        f'Wrong result: {error_lines}, '
+        f'expected: {expected_lines}'
+    )
+    assert 'Name has already exist' == result['errors'][-1]['error']
+    expected_result = [['RUB', 'Veronika', 5, 0.5], ['USD', 'Anya', 10, 1]]
+    assert expected_result == client.application.bank.get_json()
+
+
+@pytest.mark.parametrize('content_type, body', [
+    pytest.param('text/csv', b'USD,Anya,1,0.1\n\xff\xfe,b,1,1\nEUR,Alice,nan,1\nEUR,Diana,1,inf\nRUB,\xd0\x90\xd0\xbd\xd0\xbd\xd0\xb0,2,0.2\n',
+                 id='csv'),
+    pytest.param('application/x-ndjson',
+                 b'{"char_code": "USD", "name": "Anya", "capital": 1, "interest": 0.1}\n'
+                 b'{"char_code": "\xff\xfe", "name": "b", "capital": 1, "interest": 1}\n'
+                 b'{"char_code": "EUR", "name": "Alice", "capital": "nan", "interest": 1}\n'
+                 b'{"char_code": "EUR", "name": "Diana", "capital": 1, "interest": "inf"}\n'
+                 b'{"char_code": "RUB", "name": "\xd0\x90\xd0\xbd\xd0\xbd\xd0\xb0", "capital": 2, "interest": 0.2}\n',
+                 id='jsonl'),
+])
+def test_asset_bulk_api_rejects_invalid_rows(content_type, body, client):
+    client.application.bank = Storage()
+    response = client.post('/api/asset/bulk', data=body, content_type=content_type)
+    assert 200 == response.status_code
+    result = response.get_json()
+    error_lines = [error['line'] for error in result['errors']]
+    assert 2 == result['added'] and [2, 3, 4] == error_lines, (
+        f'Wrong result: {result}, '
+        f'expected 2 added assets and errors in lines [2, 3, 4]'
+    )
+    expected_result = [['RUB', 'Анна', 2, 0.2], ['USD', 'Anya', 1, 0.1]]
+    assert expected_result == client.application.bank.get_json()
+
+
+def test_asset_bulk_api_rejects_existing_and_unknown_format(client):
+    client.application.bank = Storage([Asset('Anya', 10, 1, 'USD')])
+    response = client.post('/api/asset/bulk', data=b'USD,Anya,20,1\n', content_type='text/csv')
+    assert {'added': 0, 'errors': [{'line': 1, 'error': 'Name has already exist'}]} == response.get_json()
+    response = client.post('/api/asset/bulk', data=b'USD,Anya,20,1\n', content_type='text/plain')
+    assert 415 == response.status_code
+
+
+def test_add_asset_api_concurrent_same_name(client):
+    client.application.bank = Storage()
+    statuses = []
+
+    def add():
+        with app.test_client() as thread_client:
+            statuses.append(thread_client.get('/api/asset/add/USD/Anya/10/1.0').status_code)
+
+    threads = [threading.Thread(target=add) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert [200] + [403] * 7 == sorted(statuses)
+    assert 1 == len(client.application.bank.asset_list)
+
+
+def test_sqlite_storage_api(client, tmp_path):
+    client.application.bank = SQLiteStorage(str(tmp_path / 'assets.db'))
+    assert 200 == client.get('/api/asset/add/USD/Anya/10/1').status_code
+    assert 403 == client.get('/api/asset/add/USD/Anya/10/1').status_code
+    response = client.post('/api/asset/bulk', data=b'EUR,Alice,15,2\nEUR,Anya,1,1\n', content_type='text/csv')
+    assert {'added': 1, 'errors': [{'line': 2, 'error': 'Name has already exist'}]} == response.get_json()
+    assert [['EUR', 'Alice', 15, 2], ['USD', 'Anya', 10, 1]] == client.get('/api/asset/list').json
+    assert [['USD', 'Anya', 10, 1]] == client.get('/api/asset/get?name=Anya').json
+
+
+def test_asset_list_api_pages(client):
+    names = [f'asset{number:02d}' for number in range(25)]
+    client.application.bank = Storage([Asset(name, 1, 1, 'EUR' if number % 3 else 'USD')
+                                       for number, name in enumerate(names)])
+    expected_result = client.application.bank.get_json()
+    result = []
+    route = '/api/asset/list?limit=10'
+    while route:
+        response = client.get(route)
+        assert 200 == response.status_code
+        result.extend(response.json)
+        after = response.headers.get('X-Next-After')
+        route = f'/api/asset/list?limit=10&after={after}' if after else None
+    assert expected_result == result, (
+        f'Wrong result: {result}, '
+        f'expected: {expected_result}'
+    )
+
+
+@pytest.mark.parametrize('route', ['/api/asset/list?limit=0', '/api/asset/list?limit=x',
+                                   '/api/asset/list?after=Unknown', '/api/asset/list?format=jsonl&after=Unknown'])
+def test_asset_list_api_wrong_page(route, client):
+    client.application.bank = Storage([Asset('Anya', 10, 1, 'USD')])
+    assert 400 == client.get(route).status_code
+
+
+@pytest.mark.parametrize(
+    'route, expected_count',
+    [
+        pytest.param('/api/asset/list?format=jsonl', 2500),
+        pytest.param('/api/asset/list?format=jsonl&limit=1200', 1200),
+        pytest.param('/api/asset/list?format=jsonl&after=asset0000', 2499),
+    ]
+)
+def test_asset_list_api_jsonl(route, expected_count, client):
+    client.application.bank = Storage([Asset(f'asset{number:04d}', number, 1, 'USD')
+                                       for number in range(2500)])
+    response = client.get(route)
+    assert 'application/x-ndjson' == response.mimetype
+    result = [json.loads(line) for line in response.data.decode().splitlines()]
+    expected_result = client.application.bank.get_json()
+    start = len(expected_result) - expected_count if 'after' in route else 0
+    assert expected_result[start:start + expected_count] == result
+
+
+@pytest.mark.parametrize('route', ['/api/asset/list', '/api/asset/list?limit=1', '/api/asset/get?name=Anya'])
+def test_asset_api_conditional_get(route, client):
+    client.application.bank = Storage([Asset('Anya', 10, 1, 'USD')])
+    response = client.get(route)
+    etag = response.headers['ETag']
+    assert 200 == response.status_code and response.headers['Last-Modified']
+    with patch.object(client.application.bank, 'get_json_dump') as get_json_dump, \
+            patch.object(client.application.bank, 'get_json_page') as get_json_page:
+        result = client.get(route, headers={'If-None-Match': etag})
+        assert 304 == result.status_code and b'' == result.data
+        get_json_dump.assert_not_called()
+        get_json_page.assert_not_called()
+    client.application.bank.add_asset(Asset('Alice', 15, 2, 'EUR'))
+    result = client.get(route, headers={'If-None-Match': etag})
+    assert 200 == result.status_code and etag != result.headers['ETag']
+
+
+def test_sqlite_storage_etag_is_shared_between_workers(client, tmp_path, monkeypatch):
+    path = str(tmp_path / 'assets.db')
+    client.application.bank = SQLiteStorage(path, [Asset('Anya', 10, 1, 'USD')])
+    response = client.get('/api/asset/list')
+    etag = response.headers['ETag']
+    assert str(os.getpid()) not in etag
+    monkeypatch.setattr('task_Smelova_Anna_asset_web_service.ETAG_PREFIX', 'worker2')
+    monkeypatch.setattr('task_Smelova_Anna_asset_web_service.os.getpid', lambda: -1)
+    client.application.bank = SQLiteStorage(path)
+    result = client.get('/api/asset/list', headers={'If-None-Match': etag})
+    assert 304 == result.status_code, (
+        f'Wrong status code: {result.status_code}, '
+        f'expected 304 for the same database in another worker'
+    )
+    client.application.bank.add_asset(Asset('Alice', 15, 2, 'EUR'))
+    result = client.get('/api/asset/list', headers={'If-None-Match': etag})
+    assert 200 == result.status_code and etag != result.headers['ETag']
+    client.application.bank = Storage([Asset('Anya', 10, 1, 'USD')])
+    assert 'worker2--1-assets' in client.get('/api/asset/list').headers['ETag']
+
+
+def test_sqlite_storage_etag_changes_when_database_is_recreated(client, tmp_path):
+    path = tmp_path / 'assets.db'
+    client.application.bank = SQLiteStorage(str(path), [Asset('Anya', 10, 1, 'USD')])
+    etag = client.get('/api/asset/list').headers['ETag']
+    dump = client.application.bank.get_json_dump()
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(f'{path}{suffix}'):
+            os.remove(f'{path}{suffix}')
+    client.application.bank = SQLiteStorage(str(path), [Asset('Diana', 5, 0, 'RUB')])
+    result = client.get('/api/asset/list', headers={'If-None-Match': etag})
+    assert 200 == result.status_code and [['RUB', 'Diana', 5, 0]] == result.json, (
+        f'Wrong result: {result.status_code} {result.json}, '
+        f'expected new data of recreated database'
+    )
+    assert etag != result.headers['ETag'] and dump != client.application.bank.get_json_dump()
+
+
+@pytest.fixture(params=sorted(JSON_PROVIDERS))
+def json_provider(request, monkeypatch):
+    monkeypatch.setattr('task_Smelova_Anna_asset_web_service.JSON_PROVIDER', request.param)
+    monkeypatch.setattr(app, 'json', JSON_PROVIDERS[request.param](app))
+    return request.param
+
+
+def test_json_provider(json_provider, client):
+    data = {3: 1.5, 1: [['USD', 'Анна', 10, 0.5]]}
+    expected_result = {'3': 1.5, '1': [['USD', 'Анна', 10, 0.5]]}
+    assert expected_result == json.loads(dump_json(data))
+    assert expected_result == load_json(dump_json(data))
+    with app.app_context():
+        response = app.json.response(data)
+    assert expected_result == response.json
+    assert response.get_data().startswith(b'{"1":')
+
+
+@pytest.mark.parametrize('encoding, wbits', [('gzip', 16 + zlib.MAX_WBITS), ('deflate', zlib.MAX_WBITS)])
+@pytest.mark.parametrize('route', ['/api/asset/list', '/api/asset/list?format=jsonl'])
+def test_asset_list_api_compression(encoding, wbits, route, client, json_provider):
+    client.application.bank = Storage([Asset(f'asset{number:04d}', number, 1, 'USD') for number in range(200)])
+    expected_result = client.get(route).data
+    response = client.get(route, headers={'Accept-Encoding': f'br, {encoding}'})
+    assert encoding == response.headers['Content-Encoding']
+    assert 'Accept-Encoding' in response.headers['Vary']
+    result = zlib.decompress(response.data, wbits)
+    assert expected_result == result
+    if 'jsonl' not in route:
+        assert response.headers['ETag'].startswith('W/')
+        result = client.get(route, headers={'Accept-Encoding': encoding,
+                                            'If-None-Match': response.headers['ETag']})
+        assert 304 == result.status_code
+
+
+def test_small_response_is_not_compressed(client):
+    client.application.bank = Storage([Asset('Anya', 10, 1, 'USD')])
+    response = client.get('/api/asset/list', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in response.headers
+    assert [['USD', 'Anya', 10, 1]] == response.json
+
+
 def test_asset_list_api(client):
     client.application.bank = Storage([
         Asset('Anya', 10, 1, 'USD'),
@@ -426,6 +1158,12 @@ def test_asset_list_api(client):
         pytest.param("/api/asset/get?name=Vitaly",
                      []
                      ),
+        pytest.param("/api/asset/get?name=Diana&name=Vitaly&name=Alice&name=Diana",
+                     [
+                         ['EUR', 'Alice', 15, 2],
+                         ['RUB', 'Diana', 5, 0],
+                     ]
+                     ),
     ]
 )
 def test_asset_get_api(route, expected_result, client):
@@ -446,7 +1184,7 @@ def test_asset_get_api(route, expected_result, client):
     )
 
 
-@patch('requests.get')
+@patch('requests.Session.get')
 @pytest.mark.parametrize(
     'route, periods',
     [
@@ -455,13 +1193,12 @@ def test_asset_get_api(route, expected_result, client):
     ]
 )
 def test_asset_calc_revenue_api(mock_get, route, periods, client):
-    side_effect = []
-    return_value = namedtuple('return_value', ['text', 'status_code'])
+    side_effect = {}
     with open('cbr_key_indicators.html', 'r', encoding='utf8') as f:
-        side_effect.append(return_value(f.read(), 200))
+        side_effect[KEY_INDICATORS_URL] = MagicMock(text=f.read(), status_code=200)
     with open('cbr_currency_base_daily.html', 'r', encoding='utf8') as f:
-        side_effect.append(return_value(f.read(), 200))
-    mock_get.side_effect = side_effect
+        side_effect[DAILY_URL] = MagicMock(text=f.read(), status_code=200)
+    mock_get.side_effect = lambda url, **kwargs: side_effect[url]
     daily = {
         'AUD': 57.0229,
         'AZN': 44.4127,
@@ -498,7 +1235,7 @@ def test_asset_calc_revenue_api(mock_get, route, periods, client):
     )
 
 
-@patch('requests.get')
+@patch('requests.Session.get')
 def test_asset_calc_revenue_api_unavailable(mock_get, client):
     mock_get.return_value.status_code = 503
     expected_result = 'CBR service is unavailable'
@@ -535,3 +1272,321 @@ def test_clear_api(client):
         f'Wrong bank count: {banks_cnt}, '
         f'expected 0'
     )
+
+
+def test_rates_cache_serves_fresh_value():
+    cache = RatesCache(ttl=60, stale_ttl=60)
+    loader = MagicMock(return_value={'USD': 75.0})
+    assert {'USD': 75.0} == cache.get('daily', loader)
+    assert {'USD': 75.0} == cache.get('daily', loader)
+    assert 1 == loader.call_count
+
+
+def test_rates_cache_serves_stale_value_while_revalidating():
+    cache = RatesCache(ttl=0, stale_ttl=60)
+    refreshed = threading.Event()
+    cache.get('daily', lambda: 'old')
+
+    def loader():
+        refreshed.set()
+        return 'new'
+
+    assert 'old' == cache.get('daily', loader)
+    assert refreshed.wait(5)
+    cache.ttl = 60
+    for _ in range(100):
+        if 'new' == cache.get('daily', loader):
+            break
+        time.sleep(0.01)
+    assert 'new' == cache.get('daily', loader)
+
+
+def test_rates_cache_get_many_values_match_version():
+    cache = RatesCache(ttl=60, stale_ttl=60)
+    cache.publish({'key_indicators': {'USD': 1.0}})
+
+    def loader():
+        cache.publish({'key_indicators': {'USD': 2.0}})
+        return {'AUD': 3.0}
+
+    values, version = cache.get_many({'daily': loader, 'key_indicators': MagicMock(side_effect=AssertionError)})
+    expected_result = {'daily': {'AUD': 3.0}, 'key_indicators': {'USD': 2.0}}
+    assert expected_result == values and cache.snapshot.version == version, (
+        f'Wrong result: {values}, {version}, '
+        f'expected: {expected_result}, {cache.snapshot.version}'
+    )
+
+
+def test_rates_cache_get_many_reloads_values_cleared_while_loading():
+    cache = RatesCache(ttl=60, stale_ttl=60)
+    cache.publish({'key_indicators': {'USD': 1.0}})
+
+    def loader():
+        cache.clear()
+        return {'AUD': 3.0}
+
+    values, version = cache.get_many({'daily': loader, 'key_indicators': MagicMock(return_value={'USD': 2.0})})
+    assert {'daily': {'AUD': 3.0}, 'key_indicators': {'USD': 2.0}} == values
+    assert cache.snapshot.version == version
+
+
+def test_rates_cache_concurrent_requests_load_value_once():
+    cache = RatesCache(ttl=60, stale_ttl=60)
+    calls = []
+    results = []
+
+    def loader(key):
+        calls.append(key)
+        time.sleep(0.1)
+        return {key: 1.0}
+
+    def request():
+        results.append(cache.get_many({'daily': lambda: loader('daily'),
+                                       'key_indicators': lambda: loader('key_indicators')}))
+
+    threads = [threading.Thread(target=request) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert ['daily', 'key_indicators'] == sorted(calls), (
+        f'Wrong loads: {calls}, '
+        f'expected one load per key'
+    )
+    expected_result = {'daily': {'daily': 1.0}, 'key_indicators': {'key_indicators': 1.0}}
+    assert 8 == len(results) and all(expected_result == values for values, _ in results)
+
+
+def test_rates_cache_concurrent_requests_share_failed_load():
+    cache = RatesCache(ttl=60, stale_ttl=60)
+    started = threading.Event()
+    errors = []
+
+    def loader():
+        started.set()
+        time.sleep(0.1)
+        raise ConnectionError('CBR is down')
+
+    def request():
+        try:
+            cache.get('daily', loader)
+        except ConnectionError as error:
+            errors.append(error)
+
+    threads = [threading.Thread(target=request)]
+    threads[0].start()
+    started.wait()
+    threads.extend(threading.Thread(target=request) for _ in range(3))
+    for thread in threads[1:]:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert 4 == len(errors) and 1 == len(set(map(id, errors)))
+    assert 'fresh' == cache.get('daily', MagicMock(return_value='fresh'))
+
+
+def test_rates_cache_reloads_expired_value():
+    cache = RatesCache(ttl=0, stale_ttl=0)
+    loader = MagicMock(side_effect=['old', 'new'])
+    assert 'old' == cache.get('daily', loader)
+    assert 'new' == cache.get('daily', loader)
+
+
+@patch('requests.Session.get')
+def test_cbr_daily_api_is_cached(mock_get, client):
+    with open('cbr_currency_base_daily.html', 'r', encoding='utf8') as f:
+        mock_get.return_value.text = f.read()
+    first = client.get('/cbr/daily')
+    second = client.get('/cbr/daily')
+    assert 1 == mock_get.call_count
+    assert first.json == second.json
+
+
+def test_rates_refresher_publishes_versioned_snapshots():
+    cache = RatesCache(ttl=60, stale_ttl=60)
+    refresher = RatesRefresher(cache, {
+        'daily': MagicMock(side_effect=[{'AUD': 1.0}, {'AUD': 2.0}]),
+        'key_indicators': MagicMock(return_value={'USD': 3.0}),
+    })
+    first = refresher.refresh()
+    second = refresher.refresh()
+    assert 1 == first.version and {'daily': {'AUD': 1.0}, 'key_indicators': {'USD': 3.0}} == first.values
+    assert 2 == second.version and {'AUD': 2.0} == second.values['daily']
+    assert second is cache.snapshot
+    assert {'AUD': 2.0} == cache.get('daily', MagicMock(side_effect=AssertionError))
+
+
+def test_rates_refresher_thread():
+    cache = RatesCache(ttl=60, stale_ttl=60)
+    refreshed = threading.Event()
+
+    def loader():
+        refreshed.set()
+        return {'AUD': 1.0}
+
+    refresher = RatesRefresher(cache, {'daily': loader}, interval=60)
+    refresher.start()
+    assert refreshed.wait(5)
+    refresher.stop()
+    assert {'AUD': 1.0} == cache.snapshot.values['daily']
+
+
+def test_rates_refresher_is_started_on_first_request(client, monkeypatch):
+    loaded = threading.Event()
+
+    def loader():
+        loaded.set()
+        return {'AUD': 1.0}
+
+    refresher = RatesRefresher(RatesCache(), {'daily': loader}, interval=60)
+    monkeypatch.setattr(app, 'rates_refresher', refresher)
+    monkeypatch.setitem(app.config, 'RATES_REFRESHER', True)
+    try:
+        client.get('/api/asset/list')
+        assert loaded.wait(5)
+        thread = refresher._thread
+        client.get('/api/asset/list')
+        assert thread is refresher._thread
+        monkeypatch.setattr(refresher, '_pid', -1)
+        client.get('/api/asset/list')
+        assert thread is not refresher._thread and refresher._thread.is_alive()
+    finally:
+        refresher.stop()
+
+
+@patch('requests.Session.get')
+def test_cbr_daily_api_returns_rates_version(mock_get, client):
+    with open('cbr_currency_base_daily.html', 'r', encoding='utf8') as f:
+        mock_get.return_value.text = f.read()
+    result = client.get('/cbr/daily')
+    assert str(app.rates_cache.snapshot.version) == result.headers[RATES_VERSION_HEADER]
+
+
+def test_calculate_revenue_api_returns_rates_version_used_by_handler(client, monkeypatch):
+    monkeypatch.setattr(app, 'bank', Storage([Asset('Anya', 10, 1, 'USD')]))
+    used_version = app.rates_cache.publish({DAILY_URL: {'USD': 2.0}, KEY_INDICATORS_URL: {}}).version
+    get_total_revenues = app.revenue_memo.get_total_revenues
+
+    def publish_while_calculating(**kwargs):
+        app.rates_cache.publish({DAILY_URL: {'USD': 3.0}})
+        return get_total_revenues(**kwargs)
+
+    monkeypatch.setattr(app.revenue_memo, 'get_total_revenues', publish_while_calculating)
+    result = client.get('/api/asset/calculate_revenue?period=1')
+    assert {'1': 10 * 2.0} == result.json
+    assert str(used_version) == result.headers[RATES_VERSION_HEADER], (
+        f'Wrong result: {result.headers[RATES_VERSION_HEADER]}, '
+        f'expected: {used_version}'
+    )
+    assert RATES_VERSION_HEADER not in client.get('/api/asset/list').headers
+
+
+UPSTREAM_DELAY = 0.3
+
+
+@pytest.fixture
+def slow_upstream(monkeypatch):
+    pages = {}
+    with open('cbr_key_indicators.html', 'rb') as f:
+        pages['/key-indicators/'] = f.read()
+    with open('cbr_currency_base_daily.html', 'rb') as f:
+        pages['/currency_base/daily/'] = f.read()
+
+    class SlowUpstreamHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            time.sleep(UPSTREAM_DELAY)
+            body = pages[self.path] if self.server.status == 200 else b'Service Unavailable'
+            self.send_response(self.server.status)
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), SlowUpstreamHandler)
+    server.status = 200
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    base_url = f'http://127.0.0.1:{server.server_port}'
+    monkeypatch.setitem(app.config, 'DAILY_URL', base_url + '/currency_base/daily/')
+    monkeypatch.setitem(app.config, 'KEY_INDICATORS_URL', base_url + '/key-indicators/')
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_asset_calc_revenue_api_fetches_upstreams_concurrently(slow_upstream, client):
+    client.application.bank = Storage([Asset('Anya', 10, 1, 'EUR')])
+    start = time.perf_counter()
+    result = client.get('/api/asset/calculate_revenue?period=1')
+    elapsed = time.perf_counter() - start
+    assert 200 == result.status_code
+    assert {'1': 10 * 91.9822} == result.json
+    assert UPSTREAM_DELAY <= elapsed < 2 * UPSTREAM_DELAY, (
+        f'Wrong latency: {elapsed}, '
+        f'expected latency of the slowest upstream {UPSTREAM_DELAY}'
+    )
+
+
+@pytest.mark.parametrize('route', ['/cbr/daily', '/cbr/key_indicators'])
+def test_cbr_api_upstream_error_is_not_cached(route, slow_upstream, client, monkeypatch):
+    monkeypatch.setattr(app, 'http_session', create_http_session(retries=0))
+    slow_upstream.status = 503
+    expected_result = 'CBR service is unavailable'
+    result = client.get(route)
+    assert 503 == result.status_code and expected_result == result.data.decode(), (
+        f'Wrong result: {result.status_code} {result.data}, '
+        f'expected: 503 {expected_result}'
+    )
+    assert {} == app.rates_cache.snapshot.values
+    slow_upstream.status = 200
+    assert 200 == client.get(route).status_code
+
+
+def test_create_http_session():
+    session = create_http_session(pool_size=20, retries=5, backoff_factor=0.5)
+    adapter = session.get_adapter('https://www.cbr.ru/')
+    assert 20 == adapter._pool_maxsize
+    assert 5 == adapter.max_retries.total
+    assert 0.5 == adapter.max_retries.backoff_factor
+    assert adapter is session.get_adapter('http://127.0.0.1/')
+
+
+@pytest.mark.parametrize('parser', sorted(CBR_DAILY_PARSERS))
+def test_cbr_daily_parsers_agree(parser):
+    with open('cbr_currency_base_daily.html', 'r', encoding='utf8') as f:
+        html_data = f.read()
+    result = CBR_DAILY_PARSERS[parser](html_data)
+    expected_result = CBR_DAILY_PARSERS['bs4'](html_data)
+    assert 34 == len(result) and expected_result == result, (
+        f'Wrong result: {result}, '
+        f'expected: {expected_result}'
+    )
+
+
+@pytest.mark.parametrize('parser', sorted(CBR_KEY_INDICATORS_PARSERS))
+def test_cbr_key_indicators_parsers(parser):
+    expected_result = {
+        'USD': 75.4571,
+        'EUR': 91.9822,
+        'Au': 4529.59,
+        'Ag': 62.52,
+        'Pt': 2459.96,
+        'Pd': 5667.14
+    }
+    with open('cbr_key_indicators.html', 'r', encoding='utf8') as f:
+        result = CBR_KEY_INDICATORS_PARSERS[parser](f.read())
+    assert expected_result == result, (
+        f'Wrong result: {result}, '
+        f'expected: {expected_result}'
+    )
+
+
+@pytest.mark.parametrize('parsers', [CBR_DAILY_PARSERS, CBR_KEY_INDICATORS_PARSERS], ids=['daily', 'key_indicators'])
+@pytest.mark.parametrize('parser', sorted(CBR_DAILY_PARSERS))
+def test_cbr_parsers_reject_page_without_tables(parsers, parser):
+    html_data = '<html><body><h1>Service Unavailable</h1><table class="data"></table></body></html>'
+    with pytest.raises(ValueError):
+        parsers[parser](html_data)
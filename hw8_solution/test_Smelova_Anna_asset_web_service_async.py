@@ -0,0 +1,251 @@
+import asyncio
+import json
+import threading
+import time
+from collections import namedtuple
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import MagicMock
+
+import pytest
+
+from task_Smelova_Anna_asset_web_service import Asset, Storage, DAILY_URL, RATES_VERSION_HEADER, app
+from task_Smelova_Anna_asset_web_service_async import AsyncHttpClient, asgi_app, http_client, rates_loader
+
+UPSTREAM_DELAY = 0.3
+
+AsgiResponse = namedtuple('AsgiResponse', ['status', 'headers', 'body', 'chunks'])
+
+
+async def asgi_request(route, method='GET', headers=(), body=b''):
+    path, _, query = route.partition('?')
+    scope = {
+        'type': 'http',
+        'http_version': '1.1',
+        'method': method,
+        'scheme': 'http',
+        'path': path,
+        'root_path': '',
+        'query_string': query.encode(),
+        'headers': [(name.lower().encode(), value.encode()) for name, value in headers],
+        'client': ('127.0.0.1', 50000),
+        'server': ('testserver', 80),
+    }
+    messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0) if messages else {'type': 'http.disconnect'}
+
+    async def send(message):
+        sent.append(message)
+
+    await asgi_app(scope, receive, send)
+    chunks = [message['body'] for message in sent[1:] if message['body']]
+    return AsgiResponse(sent[0]['status'],
+                        {name.decode(): value.decode() for name, value in sent[0]['headers']},
+                        b''.join(chunks), chunks)
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    pages = {}
+    with open('cbr_key_indicators.html', 'rb') as f:
+        pages['/key-indicators/'] = f.read()
+    with open('cbr_currency_base_daily.html', 'rb') as f:
+        pages['/currency_base/daily/'] = f.read()
+    state = {'hits': 0, 'status': 200, 'redirect_status': 302, 'lock': threading.Lock()}
+
+    class SlowUpstreamHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            with state['lock']:
+                state['hits'] += 1
+            time.sleep(UPSTREAM_DELAY)
+            if self.path.startswith('/moved/'):
+                self.send_response(state['redirect_status'])
+                self.send_header('Location', self.path[len('/moved'):])
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            if self.path.startswith(('/truncated/', '/unsized/')):
+                body = pages[self.path[self.path.index('/', 1):]]
+                self.send_response(200)
+                if self.path.startswith('/truncated/'):
+                    self.send_header('Content-Length', str(len(body) + 10))
+                self.end_headers()
+                self.wfile.write(body)
+                return
+            body = pages[self.path] if state['status'] == 200 else b'Service Unavailable'
+            self.send_response(state['status'])
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), SlowUpstreamHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    base_url = f'http://127.0.0.1:{server.server_port}'
+    monkeypatch.setitem(app.config, 'DAILY_URL', base_url + '/currency_base/daily/')
+    monkeypatch.setitem(app.config, 'KEY_INDICATORS_URL', base_url + '/key-indicators/')
+    monkeypatch.setattr(http_client, 'backoff_factor', 0)
+    app.rates_cache.clear()
+    state['base_url'] = base_url
+    yield state
+    server.shutdown()
+    server.server_close()
+    app.rates_cache.clear()
+
+
+def test_async_cbr_daily_api(upstream):
+    result = asyncio.run(asgi_request('/cbr/daily'))
+    assert 200 == result.status and 57.0229 == json.loads(result.body)['AUD'], (
+        f'Wrong result: {result}, '
+        f'expected AUD rate 57.0229'
+    )
+    assert str(app.rates_cache.snapshot.version) == result.headers[RATES_VERSION_HEADER.lower()]
+    etag = result.headers['etag']
+    result = asyncio.run(asgi_request('/cbr/daily', headers=[('If-None-Match', etag)]))
+    assert 304 == result.status and b'' == result.body
+    assert 1 == upstream['hits']
+
+
+def test_async_rates_routes_serve_concurrent_requests(upstream, monkeypatch):
+    monkeypatch.setattr(app, 'bank', Storage([Asset('Anya', 10, 1, 'EUR')]))
+    routes = ['/cbr/daily', '/cbr/key_indicators', '/api/asset/calculate_revenue?period=1'] * 100
+
+    async def request_all():
+        return await asyncio.gather(*(asgi_request(route) for route in routes))
+
+    start = time.perf_counter()
+    results = asyncio.run(request_all())
+    elapsed = time.perf_counter() - start
+    assert all(200 == result.status for result in results)
+    assert {'1': 10 * 91.9822} == json.loads(results[2].body)
+    assert 2 == upstream['hits'], (
+        f'Wrong upstream requests count: {upstream["hits"]}, '
+        f'expected one request per page'
+    )
+    assert elapsed < 2 * UPSTREAM_DELAY + 1, (
+        f'Wrong latency: {elapsed}, '
+        f'expected latency of the slowest upstream {UPSTREAM_DELAY}'
+    )
+
+
+def test_async_slow_upstream_does_not_block_other_routes(upstream, monkeypatch):
+    monkeypatch.setattr(app, 'bank', Storage([Asset('Anya', 10, 1, 'EUR')]))
+
+    async def request_both():
+        rates = asyncio.ensure_future(asgi_request('/cbr/daily'))
+        await asyncio.sleep(0)
+        assets = await asgi_request('/api/asset/list')
+        return rates.done(), assets, await rates
+
+    rates_done, assets, rates = asyncio.run(request_both())
+    assert not rates_done and 200 == rates.status
+    assert 200 == assets.status and [['EUR', 'Anya', 10.0, 1.0]] == json.loads(assets.body)
+
+
+def test_async_stale_value_is_refreshed_in_background(upstream, monkeypatch):
+    monkeypatch.setattr(app.rates_cache, 'ttl', 0)
+    app.rates_cache.publish({DAILY_URL: {'AUD': 1.0}})
+
+    async def request_stale():
+        result = await asgi_request('/cbr/daily')
+        await asyncio.gather(*rates_loader._pending.values())
+        return result
+
+    result = asyncio.run(request_stale())
+    assert {'AUD': 1.0} == json.loads(result.body)
+    assert 57.0229 == app.rates_cache.snapshot.values[DAILY_URL]['AUD']
+    assert 1 == upstream['hits']
+
+
+def test_async_cbr_unavailable(upstream):
+    upstream['status'] = 503
+    expected_result = 'CBR service is unavailable'
+    result = asyncio.run(asgi_request('/api/asset/calculate_revenue?period=1'))
+    assert 503 == result.status and expected_result == result.body.decode(), (
+        f'Wrong result: {result}, '
+        f'expected: {expected_result}'
+    )
+    assert 2 * (http_client.retries + 1) == upstream['hits']
+    assert DAILY_URL not in app.rates_cache.snapshot.values
+
+
+def test_async_http_client_follows_redirects(upstream):
+    client = AsyncHttpClient(retries=0)
+    text = asyncio.run(client.get(upstream['base_url'] + '/moved/currency_base/daily/', 5))
+    assert 'AUD' in text and 2 == upstream['hits']
+    upstream['redirect_status'] = 304
+    with pytest.raises(ConnectionError):
+        asyncio.run(client.get(upstream['base_url'] + '/moved/currency_base/daily/', 5))
+
+
+def test_async_http_client_checks_body_size(upstream):
+    client = AsyncHttpClient(retries=1)
+    with pytest.raises(ConnectionError, match='truncated'):
+        asyncio.run(client.get(upstream['base_url'] + '/truncated/currency_base/daily/', 5))
+    assert 2 == upstream['hits']
+    text = asyncio.run(client.get(upstream['base_url'] + '/unsized/currency_base/daily/', 5))
+    assert 'AUD' in text
+    client = AsyncHttpClient(retries=1, max_body_size=1000)
+    for path in ('/currency_base/daily/', '/unsized/currency_base/daily/'):
+        with pytest.raises(ValueError, match='exceeds 1000 bytes'):
+            asyncio.run(client.get(upstream['base_url'] + path, 5))
+    assert 5 == upstream['hits']
+
+
+def test_async_http_client_timeout(upstream):
+    client = AsyncHttpClient(retries=0)
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(client.get(app.config['DAILY_URL'], UPSTREAM_DELAY / 10))
+
+
+def test_async_wsgi_routes(monkeypatch):
+    monkeypatch.setattr(app, 'bank', Storage())
+    result = asyncio.run(asgi_request('/api/asset/bulk', method='POST', body=b'USD,Anya,10,0.1\nEUR,Alice,15,0.2\n',
+                                      headers=[('Content-Type', 'text/csv')]))
+    assert 200 == result.status and {'added': 2, 'errors': []} == json.loads(result.body)
+    monkeypatch.setattr(app, 'bank', Storage([Asset(f'asset{index:04d}', 1, 0.1, 'USD') for index in range(2500)]))
+    result = asyncio.run(asgi_request('/api/asset/list?format=jsonl'))
+    assert 200 == result.status and 2500 == len(result.body.splitlines())
+    assert 3 == len(result.chunks)
+    result = asyncio.run(asgi_request('/cbr/weekly'))
+    assert 404 == result.status and b'This route is not found' == result.body
+
+
+def test_async_rejects_not_http_scopes():
+    messages = [{'type': 'websocket.connect'}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(asgi_app({'type': 'websocket', 'path': '/api/asset/list'}, receive, send))
+    assert [{'type': 'websocket.close', 'code': 1008}] == sent
+    with pytest.raises(ValueError, match='Unsupported ASGI scope type'):
+        asyncio.run(asgi_app({'type': 'webtransport', 'path': '/api/asset/list'}, receive, send))
+
+
+def test_async_lifespan(monkeypatch):
+    refresher = MagicMock()
+    monkeypatch.setattr(app, 'rates_refresher', refresher)
+    messages = [{'type': 'lifespan.startup'}, {'type': 'lifespan.shutdown'}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message['type'])
+
+    asyncio.run(asgi_app({'type': 'lifespan'}, receive, send))
+    assert ['lifespan.startup.complete', 'lifespan.shutdown.complete'] == sent
+    refresher.start.assert_called_once_with()
+    refresher.stop.assert_called_once_with()
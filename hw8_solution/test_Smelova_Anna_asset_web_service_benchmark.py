@@ -0,0 +1,248 @@
+import gc
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from task_Smelova_Anna_asset_web_service import \
+    Asset, Storage, ColumnarStorage, SQLiteStorage, PersistentStorage, CBR_DAILY_PARSERS, CBR_KEY_INDICATORS_PARSERS, \
+    DAILY_URL, KEY_INDICATORS_URL, JSON_PROVIDERS, app
+
+pytest.importorskip('pytest_benchmark')
+pytestmark = pytest.mark.slow
+
+STORAGE_SIZES = [1_000, 10_000, 100_000]
+CHAR_CODES = ['USD', 'EUR', 'RUB', 'AUD', 'Au']
+
+
+@pytest.fixture
+def client():
+    with app.test_client() as client:
+        yield client
+
+
+def generate_assets(count):
+    return [
+        Asset(f'asset{(index * 7919) % count:07d}', 100 + index % 1000,
+              (index % 50) / 100, CHAR_CODES[index % len(CHAR_CODES)])
+        for index in range(count)
+    ]
+
+
+@pytest.mark.parametrize('parser', sorted(CBR_DAILY_PARSERS))
+def test_benchmark_parse_cbr_currency_base_daily(benchmark, parser):
+    with open('cbr_currency_base_daily.html', 'r', encoding='utf8') as f:
+        html_data = f.read()
+    result = benchmark(CBR_DAILY_PARSERS[parser], html_data)
+    assert result
+
+
+@pytest.mark.parametrize('parser', sorted(CBR_KEY_INDICATORS_PARSERS))
+def test_benchmark_parse_cbr_key_indicators(benchmark, parser):
+    with open('cbr_key_indicators.html', 'r', encoding='utf8') as f:
+        html_data = f.read()
+    result = benchmark(CBR_KEY_INDICATORS_PARSERS[parser], html_data)
+    assert result
+
+
+@pytest.mark.parametrize('size', STORAGE_SIZES)
+def test_benchmark_storage_add_asset(benchmark, size):
+    assets = generate_assets(size)
+
+    def build_storage():
+        bank = Storage()
+        for asset in assets:
+            if not bank.is_contains(asset):
+                bank.add_asset(asset)
+        return bank.asset_list
+
+    assert size == len(benchmark(build_storage))
+
+
+@pytest.mark.parametrize('size', STORAGE_SIZES)
+def test_benchmark_asset_list_api(benchmark, client, size):
+    client.application.bank = Storage(generate_assets(size))
+    result = benchmark(client.get, '/api/asset/list')
+    assert 200 == result.status_code and size == len(result.json)
+
+
+@pytest.mark.parametrize('route', ['/api/asset/list?limit=100', '/api/asset/list?limit=100&after=asset0050000'])
+def test_benchmark_asset_list_api_page(benchmark, client, route):
+    client.application.bank = Storage(generate_assets(100_000))
+    result = benchmark(client.get, route)
+    assert 200 == result.status_code and 100 == len(result.json)
+
+
+@pytest.mark.parametrize('size', STORAGE_SIZES)
+def test_benchmark_asset_list_api_jsonl(benchmark, client, size):
+    client.application.bank = Storage(generate_assets(size))
+
+    def get_first_line():
+        response = client.get('/api/asset/list?format=jsonl', buffered=False)
+        first_chunk = next(response.response)
+        response.close()
+        return first_chunk
+
+    assert benchmark(get_first_line)
+
+
+@pytest.mark.parametrize('periods_count', [1, 10, 100])
+@pytest.mark.parametrize('size', STORAGE_SIZES)
+def test_benchmark_storage_get_total_revenues(benchmark, size, periods_count):
+    bank = Storage(generate_assets(size))
+    rates = {char_code: 1.0 + index for index, char_code in enumerate(CHAR_CODES)}
+    periods = list(range(1, periods_count + 1))
+    result = benchmark(bank.get_total_revenues, periods, rates, {})
+    assert periods_count == len(result)
+
+
+@pytest.mark.parametrize('size', STORAGE_SIZES)
+def test_benchmark_asset_bulk_api(benchmark, client, size):
+    body = ''.join(
+        f'{asset.char_code},{asset.name},{asset.capital},{asset.interest}\n'
+        for asset in generate_assets(size)
+    ).encode()
+
+    def load_portfolio():
+        client.application.bank = Storage()
+        return client.post('/api/asset/bulk', data=body, content_type='text/csv')
+
+    result = benchmark.pedantic(load_portfolio, rounds=3)
+    assert size == result.json['added'] and not result.json['errors']
+
+
+@pytest.mark.parametrize('backend', ['memory', 'sqlite'])
+@pytest.mark.parametrize('size', STORAGE_SIZES)
+def test_benchmark_storage_get_assets(benchmark, tmp_path, backend, size):
+    assets = generate_assets(size)
+    if backend == 'sqlite':
+        bank = SQLiteStorage(str(tmp_path / 'assets.db'), assets)
+    else:
+        bank = Storage(assets)
+    names = [asset.name for asset in assets[::max(1, size // 100)]]
+
+    def get_assets():
+        return [bank.get_assets(name) for name in names]
+
+    assert all(benchmark(get_assets))
+
+
+@pytest.mark.parametrize('names_count', [10, 5_000])
+@pytest.mark.parametrize('backend', ['memory', 'columnar', 'sqlite'])
+def test_benchmark_asset_get_api(benchmark, client, tmp_path, backend, names_count):
+    assets = generate_assets(100_000)
+    if backend == 'sqlite':
+        client.application.bank = SQLiteStorage(str(tmp_path / 'assets.db'), assets)
+    elif backend == 'columnar':
+        client.application.bank = ColumnarStorage(assets)
+    else:
+        client.application.bank = Storage(assets)
+    route = '/api/asset/get?' + '&'.join(f'name={asset.name}' for asset in assets[:names_count])
+    result = benchmark(client.get, route)
+    assert 200 == result.status_code and names_count == len(result.json)
+
+
+@pytest.mark.parametrize('source', ['snapshot', 'log'])
+@pytest.mark.parametrize('size', STORAGE_SIZES)
+def test_benchmark_persistent_storage_recovery(benchmark, tmp_path, source, size):
+    directory = str(tmp_path / 'storage')
+    bank = PersistentStorage(directory, sync=False)
+    assets = generate_assets(size)
+    for start in range(0, size, 100):
+        bank.add_assets(assets[start:start + 100])
+    if source == 'snapshot':
+        bank.snapshot()
+    bank.close()
+
+    def recover():
+        recovered_bank = PersistentStorage(directory, sync=False)
+        recovered_bank.close()
+        return recovered_bank
+
+    assert size == len(benchmark.pedantic(recover, rounds=3).asset_list)
+
+
+@pytest.mark.parametrize('threads_count', [1, 8])
+def test_benchmark_persistent_storage_group_commit(benchmark, tmp_path, threads_count):
+    directory = str(tmp_path / 'storage')
+    adds_count = 800
+
+    def add_assets():
+        bank = PersistentStorage(directory)
+        bank.clear_storage()
+
+        def add(number):
+            for index in range(adds_count // threads_count):
+                bank.add_asset(Asset(f'asset{number}_{index}', 1, 0.1, 'USD'))
+
+        with ThreadPoolExecutor(threads_count) as executor:
+            list(executor.map(add, range(threads_count)))
+        bank.close()
+        return bank
+
+    assert adds_count == len(benchmark.pedantic(add_assets, rounds=3).asset_list)
+
+
+def measure_storage_memory(storage_class, rows):
+    gc.collect()
+    tracemalloc.start()
+    try:
+        bank = storage_class()
+        bank.add_assets(Asset(*row) for row in rows)
+        bank.get_json_page(limit=10)
+        bank.get_many_assets(row[0] for row in rows[::100])
+        gc.collect()
+        size, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return bank, size
+
+
+@pytest.mark.parametrize('storage_class', [Storage, ColumnarStorage], ids=['objects', 'columnar'])
+@pytest.mark.parametrize('size', STORAGE_SIZES)
+def test_benchmark_storage_memory(benchmark, storage_class, size):
+    rows = [(asset.name, asset.capital, asset.interest, asset.char_code)
+            for asset in generate_assets(size)]
+    bank, memory = measure_storage_memory(storage_class, rows)
+    benchmark.extra_info['bytes_per_asset'] = memory / size
+    if storage_class is ColumnarStorage:
+        _, object_memory = measure_storage_memory(Storage, rows)
+        assert memory < object_memory, (
+            f'Wrong memory: {memory}, '
+            f'expected less than {object_memory}'
+        )
+    result = benchmark(bank.get_assets, rows[size // 2][0])
+    assert rows[size // 2][0] == result[1]
+
+
+@pytest.fixture(params=sorted(JSON_PROVIDERS))
+def json_provider(request, monkeypatch):
+    monkeypatch.setattr('task_Smelova_Anna_asset_web_service.JSON_PROVIDER', request.param)
+    monkeypatch.setattr(app, 'json', JSON_PROVIDERS[request.param](app))
+    return request.param
+
+
+@pytest.mark.parametrize('encoding', ['identity', 'gzip'])
+@pytest.mark.parametrize('size', STORAGE_SIZES)
+def test_benchmark_asset_list_api_json_provider(benchmark, client, json_provider, encoding, size):
+    client.application.bank = Storage(generate_assets(size))
+
+    def get_list():
+        client.application.bank.add_asset(Asset('asset_new', 1, 0.1, 'USD'))
+        return client.get('/api/asset/list', headers={'Accept-Encoding': encoding})
+
+    result = benchmark(get_list)
+    assert 200 == result.status_code
+
+
+@pytest.mark.parametrize('periods_count', [10, 1000])
+def test_benchmark_asset_calc_revenue_api_json_provider(benchmark, client, json_provider, periods_count):
+    client.application.bank = Storage(generate_assets(10_000))
+    client.application.rates_cache.publish({
+        DAILY_URL: {char_code: 1.0 for char_code in CHAR_CODES},
+        KEY_INDICATORS_URL: {},
+    })
+    client.application.revenue_memo.clear()
+    route = '/api/asset/calculate_revenue?' + '&'.join(f'period={period}' for period in range(periods_count))
+    result = benchmark(client.get, route)
+    assert 200 == result.status_code and periods_count == len(result.json)
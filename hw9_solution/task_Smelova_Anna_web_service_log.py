@@ -3,12 +3,20 @@
 Web service for Wiki with Logging
 """
 import logging.config
+import os
 import yaml
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from bs4 import BeautifulSoup
 from flask import Flask, Response, jsonify, make_response, request, abort
+from flask.json.provider import DefaultJSONProvider
 from flask.logging import create_logger
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 
 logging.config.dictConfig(yaml.safe_load(
@@ -45,11 +53,48 @@ logging.config.dictConfig(yaml.safe_load(
 ))
 
 
-app = Flask(__name__)
-app.logger = create_logger(app)
-
 WIKI_BASE_URL = "https://en.wikipedia.org"
 WIKI_BASE_SEARCH_URL = f"{WIKI_BASE_URL}/w/index.php?search="
+HTTP_TIMEOUT = 5.0
+HTTP_POOL_SIZE = 10
+HTTP_RETRY = Retry(total=3, backoff_factor=0.3, status_forcelist=(500, 502, 503, 504),
+                   allowed_methods=['GET'], raise_on_status=False)
+JSON_PROVIDER = os.environ.get('JSON_PROVIDER', 'orjson' if orjson is not None else 'stdlib')
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """
+    Flask JSON provider which serializes with orjson
+    """
+
+    def dumps(self, obj, **kwargs) -> str:
+        """
+        Serialize object to JSON
+        :param obj: object
+        :return: JSON string
+        """
+        option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_SORT_KEYS if self.sort_keys else 0)
+        return orjson.dumps(obj, option=option).decode()
+
+    def loads(self, s, **kwargs):
+        """
+        Deserialize JSON
+        :param s: JSON string
+        :return: object
+        """
+        return orjson.loads(s)
+
+
+JSON_PROVIDERS = {'stdlib': DefaultJSONProvider}
+if orjson is not None:
+    JSON_PROVIDERS['orjson'] = OrjsonProvider
+
+
+app = Flask(__name__)
+app.logger = create_logger(app)
+app.http_session = requests.Session()
+app.http_session.mount('https://', HTTPAdapter(pool_maxsize=HTTP_POOL_SIZE, max_retries=HTTP_RETRY))
+app.json = JSON_PROVIDERS[JSON_PROVIDER](app)
 
 
 @app.errorhandler(404)
@@ -75,7 +120,7 @@ def api_wiki_proxy_search():
     """Search API"""
     query = request.args.get('query', '')
     app.logger.debug('start processing query: %s', query)
-    response = requests.get(WIKI_BASE_SEARCH_URL + query)
+    response = app.http_session.get(WIKI_BASE_SEARCH_URL + query, timeout=HTTP_TIMEOUT)
     if not response.ok:
         abort(503)
     article_count = parse_article_count(response.text)
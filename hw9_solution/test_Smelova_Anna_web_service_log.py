@@ -1,6 +1,8 @@
 import pytest
 import requests
-from task_Smelova_Anna_web_service_log import app, WIKI_BASE_SEARCH_URL, parse_article_count
+from unittest.mock import patch
+from task_Smelova_Anna_web_service_log import app, WIKI_BASE_SEARCH_URL, HTTP_TIMEOUT, JSON_PROVIDERS, \
+    parse_article_count
 
 
 @pytest.fixture
@@ -29,3 +31,27 @@ def test_can_proxy_request_to_wiki(client):
         f'Wrong status code: {response.status_code}, '
         f'expected 200'
     )
+
+
+@patch('requests.Session.get')
+def test_proxy_request_uses_shared_session(mock_get, client):
+    mock_get.return_value.ok = True
+    mock_get.return_value.text = '<div class="results-info">1 of <strong>1,234</strong></div>'
+    response = client.get('/api/search?query=python')
+    mock_get.assert_called_once_with(WIKI_BASE_SEARCH_URL + 'python', timeout=HTTP_TIMEOUT)
+    assert 1234 == response.json['article_count']
+
+
+@pytest.mark.parametrize('json_provider', sorted(JSON_PROVIDERS))
+@patch('requests.Session.get')
+def test_proxy_request_json_provider(mock_get, json_provider, client, monkeypatch):
+    monkeypatch.setattr(app, 'json', JSON_PROVIDERS[json_provider](app))
+    mock_get.return_value.ok = True
+    mock_get.return_value.text = '<div class="results-info">1 of <strong>1,234</strong></div>'
+    response = client.get('/api/search?query=python')
+    expected_result = b'{"article_count":1234,"version":1.0}'
+    result = response.data.strip()
+    assert expected_result == result, (
+        f'Wrong result: {result}, '
+        f'expected: {expected_result}'
+    )